@@ -0,0 +1,307 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+from botocore.exceptions import ClientError
+from aws_context import get_account_id, get_client, get_session, load_cymballic_config
+from glue_types import arrow_type_from_athena
+from run_metrics import metrics
+
+# Queries against the external-cat-<customer> catalogs registered by
+# update.py, run from the main account. Results are streamed from the CSV
+# file Athena writes to the output location straight into Arrow, instead of
+# being paged through GetQueryResults.
+
+# Polling of running queries: the first wait, growth per poll and longest wait
+POLL_INITIAL_SECONDS = 0.25
+POLL_BACKOFF = 1.5
+POLL_MAX_SECONDS = 5
+
+# Queries in flight at once, kept under the workgroup's share of the
+# account's active query quota. Override with "athena_max_concurrency" in
+# cymballic.json.
+DEFAULT_QUERY_CONCURRENCY = 5
+# Athena returns the results of an identical query run at most this long
+# ago without scanning the data again (engine version 3 workgroups)
+DEFAULT_REUSE_MINUTES = 60
+DEFAULT_WORKGROUP = "primary"
+# Under the s3_bucket of cymballic.json, for workgroups without an output location
+RESULT_PREFIX = "athena-results/"
+# Local results cache, keyed by query text and the versions of the tables read
+RESULT_CACHE_DIR = "cache/athena"
+# Bytes of the result CSV decoded into one record batch
+CSV_BLOCK_SIZE = 8 * 1024 * 1024
+
+logging.basicConfig(
+    format="%(asctime)s - %(levelname)s - %(message)s",
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+def fail_fast(msg):
+    logger.error(msg)
+    exit(1)
+
+def parse_s3_location(location):
+    bucket_name, _, key = location.removeprefix("s3://").partition("/")
+    return bucket_name, key
+
+def referenced_tables(query, table_names):
+    """Tables of the database whose names appear in query, bare or quoted."""
+    words = {word.lower() for word in re.findall(r'[A-Za-z_][A-Za-z0-9_]*|"[^"]+"|`[^`]+`', query)}
+    words |= {word.strip('"`') for word in words}
+    return sorted(name for name in table_names if name.lower() in words)
+
+def write_parquet(reader, path):
+    """Write a RecordBatchReader to path batch by batch, replacing it only once complete."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    rows = 0
+    with pq.ParquetWriter(f"{path}.tmp", reader.schema) as writer:
+        for batch in reader:
+            writer.write_batch(batch)
+            rows += batch.num_rows
+    os.replace(f"{path}.tmp", path)
+    return rows
+
+def read_parquet(path):
+    parquet_file = pq.ParquetFile(path)
+    return pa.RecordBatchReader.from_batches(parquet_file.schema_arrow, parquet_file.iter_batches())
+
+class AthenaQueryRunner:
+    """
+    Runs queries against one catalog and database. At most max_concurrency
+    queries run at once, however many threads submit them. Athena reuses
+    results up to reuse_minutes old, and with a cache_dir results are also
+    kept locally as Parquet, keyed by the query text and the versions of the
+    tables it reads.
+    """
+
+    def __init__(self, session, region, catalog, database, catalog_id=None, workgroup=DEFAULT_WORKGROUP,
+                 output_location=None, max_concurrency=DEFAULT_QUERY_CONCURRENCY, reuse_minutes=DEFAULT_REUSE_MINUTES,
+                 cache_dir=None):
+        self.athena = get_client(session, 'athena', region)
+        self.glue = get_client(session, 'glue', region)
+        self.s3 = get_client(session, 's3', region)
+        self.catalog = catalog
+        self.database = database
+        self.catalog_id = catalog_id
+        self.workgroup = workgroup
+        self.output_location = output_location
+        self.reuse_minutes = reuse_minutes
+        self.cache_dir = cache_dir
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.lock = threading.Lock()
+        self.table_names = None
+
+    def start(self, query):
+        request = {
+            "QueryString": query,
+            "QueryExecutionContext": {"Catalog": self.catalog, "Database": self.database},
+            "WorkGroup": self.workgroup
+        }
+        if self.output_location:
+            request["ResultConfiguration"] = {"OutputLocation": self.output_location}
+        if self.reuse_minutes:
+            request["ResultReuseConfiguration"] = {
+                "ResultReuseByAgeConfiguration": {"Enabled": True, "MaxAgeInMinutes": int(self.reuse_minutes)}
+            }
+        return self.athena.start_query_execution(**request)['QueryExecutionId']
+
+    def wait(self, query_id):
+        """Poll until the query is done, backing off up to POLL_MAX_SECONDS between polls."""
+        delay = POLL_INITIAL_SECONDS
+        while True:
+            execution = self.athena.get_query_execution(QueryExecutionId=query_id)['QueryExecution']
+            state = execution['Status']['State']
+            if state == "SUCCEEDED":
+                return execution
+            if state in ("FAILED", "CANCELLED"):
+                reason = execution['Status'].get('StateChangeReason', '')
+                raise RuntimeError(f"Query {query_id} {state.lower()}: {reason}")
+            time.sleep(delay)
+            delay = min(delay * POLL_BACKOFF, POLL_MAX_SECONDS)
+
+    def execute(self, query):
+        """Run query once a slot is free and return its finished execution."""
+        with self.slots:
+            with metrics.stage("athena"):
+                query_id = self.start(query)
+                try:
+                    execution = self.wait(query_id)
+                except KeyboardInterrupt:
+                    # Do not leave the query running after an interrupt
+                    self.athena.stop_query_execution(QueryExecutionId=query_id)
+                    raise
+        statistics = execution.get('Statistics', {})
+        scanned = statistics.get('DataScannedInBytes', 0)
+        metrics.add("athena", bytes=scanned)
+        reused = statistics.get('ResultReuseInformation', {}).get('ReusedPreviousResult')
+        logger.info(f"Query {query_id} {'reused earlier results' if reused else 'succeeded'} in "
+                    f"{statistics.get('TotalExecutionTimeInMillis', 0) / 1000:.1f}s, "
+                    f"{scanned / 1024 / 1024:.1f} MB scanned")
+        return execution
+
+    def open_results(self, execution):
+        """RecordBatchReader over the results of a finished query."""
+        query_id = execution['QueryExecutionId']
+        if execution.get('StatementType') != "DML":
+            # DDL and utility statements have small results that are not CSV
+            return self.paged_results(query_id)
+        response = self.athena.get_query_results(QueryExecutionId=query_id, MaxResults=1)
+        columns = response['ResultSet']['ResultSetMetadata']['ColumnInfo']
+        schema = pa.schema([(column['Name'], arrow_type_from_athena(column['Type'], column.get('Precision'),
+                                                                   column.get('Scale'))) for column in columns])
+        bucket_name, key = parse_s3_location(execution['ResultConfiguration']['OutputLocation'])
+        body = self.s3.get_object(Bucket=bucket_name, Key=key)['Body']
+        # Athena quotes every value and leaves NULLs empty and unquoted
+        return pa_csv.open_csv(
+            body,
+            read_options=pa_csv.ReadOptions(column_names=schema.names, skip_rows=1, block_size=CSV_BLOCK_SIZE),
+            convert_options=pa_csv.ConvertOptions(column_types=schema, strings_can_be_null=True,
+                                                  quoted_strings_can_be_null=False)
+        )
+
+    def paged_results(self, query_id):
+        rows = []
+        paginator = self.athena.get_paginator('get_query_results')
+        for page in paginator.paginate(QueryExecutionId=query_id):
+            rows.extend([field.get('VarCharValue') for field in row['Data']] for row in page['ResultSet']['Rows'])
+            names = [column['Name'] for column in page['ResultSet']['ResultSetMetadata']['ColumnInfo']]
+        table = pa.table({name: [row[i] if i < len(row) else None for row in rows] for i, name in enumerate(names)})
+        return pa.RecordBatchReader.from_batches(table.schema, table.to_batches())
+
+    def table_version(self, table_name):
+        """
+        Glue version of the table and a summary of the objects under its
+        location, which changes when files are added without a Glue change.
+        """
+        request = {"DatabaseName": self.database, "Name": table_name}
+        if self.catalog_id:
+            request["CatalogId"] = self.catalog_id
+        table = self.glue.get_table(**request)['Table']
+        bucket_name, prefix = parse_s3_location(table['StorageDescriptor']['Location'])
+        count = size = 0
+        latest = ""
+        paginator = self.s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                count += 1
+                size += obj['Size']
+                latest = max(latest, obj['LastModified'].isoformat())
+        return f"{table.get('VersionId')}/{table['UpdateTime'].isoformat()}/{count}/{size}/{latest}"
+
+    def cache_path(self, query):
+        """Cache file of query, or None if the versions of its tables cannot be read."""
+        with self.lock:
+            if self.table_names is None:
+                request = {"DatabaseName": self.database}
+                if self.catalog_id:
+                    request["CatalogId"] = self.catalog_id
+                self.table_names = [table['Name'] for page in self.glue.get_paginator('get_tables').paginate(**request)
+                                    for table in page['TableList']]
+        try:
+            versions = {name: self.table_version(name) for name in referenced_tables(query, self.table_names)}
+        except ClientError as e:
+            logger.warning(f"Not caching results, could not read table versions: {str(e)}")
+            return None
+        key = json.dumps([self.catalog, self.database, query.strip(), versions], sort_keys=True)
+        return f"{self.cache_dir}/{hashlib.sha256(key.encode('utf-8')).hexdigest()}.parquet"
+
+    def query(self, query):
+        """Run query and return a RecordBatchReader over its results."""
+        path = self.cache_path(query) if self.cache_dir else None
+        if path is None:
+            return self.open_results(self.execute(query))
+        if os.path.exists(path):
+            logger.info(f"Using cached results {path}")
+            metrics.add("cache", count=1)
+        else:
+            with metrics.stage("download"):
+                rows = write_parquet(self.open_results(self.execute(query)), path)
+            metrics.add("download", rows=rows)
+        return read_parquet(path)
+
+    def query_to_parquet(self, query, path):
+        """Run query and stream its results into a Parquet file. Returns the number of rows."""
+        with metrics.stage("save"):
+            rows = write_parquet(self.query(query), path)
+        metrics.add("save", rows=rows)
+        return rows
+
+    def query_all(self, queries):
+        """
+        Run independent queries concurrently and save each one's results,
+        given as (query, path) pairs. Returns the row counts in order.
+        """
+        queries = list(queries)
+        if not queries:
+            return []
+        with ThreadPoolExecutor(max_workers=len(queries)) as pool:
+            return list(pool.map(lambda item: self.query_to_parquet(*item), queries))
+
+def runner_for_customer(config, cache=True):
+    """Runner for the catalog and database update.py registered for a customer config."""
+    cymballic_config = load_cymballic_config()
+    customer = config['customer'].lower()
+    output_location = None
+    if cymballic_config.get('s3_bucket'):
+        output_location = f"{cymballic_config['s3_bucket'].rstrip('/')}/{RESULT_PREFIX}"
+    return AthenaQueryRunner(
+        get_session(cymballic_config['aws_account_profile']),
+        cymballic_config.get('aws_region'),
+        catalog=f"external-cat-{customer}",
+        database=customer,
+        catalog_id=get_account_id(config.get('aws_profile')),
+        workgroup=cymballic_config.get('athena_workgroup', DEFAULT_WORKGROUP),
+        output_location=output_location,
+        max_concurrency=int(cymballic_config.get('athena_max_concurrency', DEFAULT_QUERY_CONCURRENCY)),
+        reuse_minutes=int(cymballic_config.get('athena_reuse_minutes', DEFAULT_REUSE_MINUTES)),
+        cache_dir=RESULT_CACHE_DIR if cache else None
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="Run Athena queries against a customer's registered catalog")
+    parser.add_argument("-c", "--config", required=True, help="Path to the customer's JSON configuration file")
+    parser.add_argument("-q", "--query", action="append", default=[], help="SQL to run; may be repeated")
+    parser.add_argument("-f", "--file", action="append", default=[], help="File with the SQL to run; may be repeated")
+    parser.add_argument("-o", "--output", default="out/queries", help="Directory the results are saved to as Parquet")
+    parser.add_argument("--no-cache", action="store_true", help="Do not use the local results cache")
+    args = parser.parse_args()
+
+    try:
+        with open(args.config, 'r') as file:
+            config = json.load(file)
+    except Exception as e:
+        fail_fast(f"Failed to load configuration: {str(e)}")
+    queries = [(f"query-{i}", query) for i, query in enumerate(args.query, start=1)]
+    for path in args.file:
+        with open(path, 'r') as file:
+            queries.append((os.path.splitext(os.path.basename(path))[0], file.read()))
+    if not queries:
+        fail_fast("No queries given, use -q or -f")
+
+    runner = runner_for_customer(config, cache=not args.no_cache)
+    paths = [f"{args.output}/{name}.parquet" for name, _ in queries]
+    try:
+        rows = runner.query_all((query, path) for (_, query), path in zip(queries, paths))
+    except Exception as e:
+        fail_fast(f"Query failed: {str(e)}")
+    for path, count in zip(paths, rows):
+        logger.info(f"Saved {count} rows to {path}")
+        preview = next(pq.ParquetFile(path).iter_batches(batch_size=10), None)
+        if preview is not None:
+            logger.info(f"\n{preview.to_pandas().to_string()}")
+
+if __name__ == "__main__":
+    try:
+        main()
+    finally:
+        metrics.write_report("query")
@@ -0,0 +1,126 @@
+import configparser
+import json
+import logging
+import os
+import sys
+import threading
+from functools import lru_cache
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError, UnauthorizedSSOTokenError
+from run_metrics import instrument_session
+
+# Shared AWS profile, account and client handling for onboard.py, update.py
+# and the other scripts, and the customer config options they share.
+#
+# Sessions are cached per profile and clients per (profile, service, region),
+# so each run resolves credentials and opens connection pools once instead of
+# in every function. Clients are thread-safe once created, but creating them
+# from one session is not, so creation is done under a lock.
+
+CYMBALLIC_CONFIG_PATH = 'cymballic.json'
+
+# Rule between the sections of the summaries the scripts log
+SEPARATOR = "=" * 80
+
+# Connections kept per client; concurrent exports and registrations share them
+DEFAULT_MAX_POOL_CONNECTIONS = 50
+# Adaptive retries back off and rate limit the client when AWS throttles
+DEFAULT_MAX_ATTEMPTS = 10
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_sessions = {}
+_clients = {}
+
+def _reset_after_fork():
+    # Connection pools must not be shared with a forked worker process
+    global _lock
+    _lock = threading.Lock()
+    _sessions.clear()
+    _clients.clear()
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+@lru_cache(maxsize=None)
+def load_cymballic_config():
+    with open(CYMBALLIC_CONFIG_PATH, 'r') as file:
+        config = json.load(file)
+        return config
+
+@lru_cache(maxsize=None)
+def load_aws_config():
+    config = configparser.ConfigParser()
+    # Same file boto3 reads, so a relocated config is honoured here too
+    config.read(os.path.expanduser(os.environ.get('AWS_CONFIG_FILE', '~/.aws/config')))
+    return config
+
+def get_account_id(profile):
+    try:
+        config = load_aws_config()
+        profile_section = f"profile {profile}"
+        if profile_section in config:
+            return config[profile_section].get('sso_account_id')
+    except Exception as e:
+        logger.warning(f"Could not read account ID from AWS config: {e}")
+    return None
+
+@lru_cache(maxsize=None)
+def client_config():
+    try:
+        cymballic_config = load_cymballic_config()
+    except (OSError, ValueError):
+        cymballic_config = {}
+    return Config(
+        max_pool_connections=int(cymballic_config.get('max_pool_connections', DEFAULT_MAX_POOL_CONNECTIONS)),
+        retries={
+            'mode': 'adaptive',
+            'max_attempts': int(cymballic_config.get('max_attempts', DEFAULT_MAX_ATTEMPTS))
+        },
+        tcp_keepalive=True
+    )
+
+def get_session(profile):
+    with _lock:
+        session = _sessions.get(profile)
+        if session is None:
+            session = boto3.Session(profile_name=profile)
+            # Every client of the session reports its calls to the run metrics
+            instrument_session(session)
+            _sessions[profile] = session
+        return session
+
+def get_client(session, service, region_name=None):
+    """Return the cached client for the session's profile, service and region."""
+    key = (session.profile_name, service, region_name)
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            client = session.client(service, region_name=region_name, config=client_config())
+            _clients[key] = client
+        return client
+
+def ensure_sso_session(profile):
+    """Session and account ID of profile; exits with the login command to run if its SSO session is not valid."""
+    session = get_session(profile)
+    try:
+        # Try to use the session to verify it's valid
+        get_client(session, 'sts').get_caller_identity()
+        logger.info(f"Using existing AWS SSO session for profile {profile}")
+        return session, get_account_id(profile)
+    except UnauthorizedSSOTokenError:
+        logger.error(f"AWS SSO session has expired or is invalid for profile '{profile}'.\n"
+                     f"Please run: aws sso login --profile {profile} --no-browser")
+    except ClientError:
+        logger.error(f"No active session for profile {profile}. Please run: aws sso login --profile {profile} --no-browser")
+    sys.exit(1)
+
+def table_options(config, table_name):
+    """
+    Customer config with any per-table overrides from its "tables" section
+    applied, e.g. {"tables": {"orders": {"watermark_column": "updated_at"}}}.
+    """
+    options = {key: value for key, value in config.items() if key != "tables"}
+    options.update(config.get("tables", {}).get(table_name, {}))
+    return options
@@ -0,0 +1,95 @@
+import argparse
+import json
+import os
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+# Run against the onboarding code in the parent directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import pandas as pd
+import pyarrow as pa
+from onboard import (ParquetLayout, arrow_schema_from_frame, connect_to_postgres, logger, open_parquet_writer,
+                     write_parquet_copy, write_parquet_streaming)
+from synthetic import DEFAULT_TYPE_MIX, TYPE_MIXES, create_table
+
+# Compare the extraction engines of export_table_to_s3_parquet on a local
+# Postgres: rows/s, client CPU time and peak RSS of each, every engine in a
+# fresh process so the numbers don't leak into each other.
+
+BENCH_TABLE = "cymballic_bench"
+ENGINES = ("pandas", "cursor", "copy")
+DEFAULT_ROWS = 1000000
+DEFAULT_WIDTH = 1
+
+def run_engine(engine, rds_info, table_name, batch_size):
+    # Runs in a fresh process
+    parquet_path = f"/tmp/{table_name}-{engine}.parquet"
+    query = f"SELECT * FROM {table_name};"
+    conn = connect_to_postgres(rds_info)
+    start_time = time.time()
+    try:
+        if engine == "pandas":
+            df = pd.read_sql(query, conn)
+            table = pa.Table.from_pandas(df, schema=arrow_schema_from_frame(df), preserve_index=False)
+            writer = open_parquet_writer(parquet_path, table.schema)
+            writer.write_table(table)
+            writer.close()
+            row_count = len(df)
+        elif engine == "cursor":
+            _, row_count = write_parquet_streaming(conn, query, parquet_path, batch_size, layout=ParquetLayout({}))
+        else:
+            _, row_count = write_parquet_copy(conn, query, parquet_path, layout=ParquetLayout({}))
+    finally:
+        conn.close()
+    elapsed_time = time.time() - start_time
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return {
+        "engine": engine,
+        "rows": row_count,
+        "seconds": round(elapsed_time, 3),
+        "rows_per_second": round(row_count / max(elapsed_time, 1e-6)),
+        "cpu_seconds": round(usage.ru_utime + usage.ru_stime, 3),
+        "peak_rss_mb": round(usage.ru_maxrss / 1024, 1),
+        "parquet_bytes": os.path.getsize(parquet_path)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Postgres extraction engines")
+    parser.add_argument("-c", "--config", required=True, help="JSON config with the Postgres connection")
+    parser.add_argument("-r", "--rows", type=int, default=DEFAULT_ROWS, help="Rows in the synthetic table")
+    parser.add_argument("-w", "--width", type=int, default=DEFAULT_WIDTH, help="Column groups in the synthetic table")
+    parser.add_argument("-m", "--mix", default=DEFAULT_TYPE_MIX, choices=sorted(TYPE_MIXES),
+                        help="Column types of each column group")
+    parser.add_argument("-b", "--batch-size", type=int, default=100000, help="Batch size of the cursor engine")
+    parser.add_argument("-e", "--engines", nargs="+", default=list(ENGINES), choices=ENGINES)
+    parser.add_argument("--reuse", action="store_true", help="Reuse the existing synthetic table")
+    parser.add_argument("-o", "--output", default="bench_extract.json", help="Where to save the results")
+    args = parser.parse_args()
+
+    with open(args.config, 'r') as file:
+        rds_info = json.load(file)
+
+    if not args.reuse:
+        conn = connect_to_postgres(rds_info)
+        try:
+            create_table(conn, BENCH_TABLE, args.rows, args.width, args.mix)
+        finally:
+            conn.close()
+
+    results = []
+    for engine in args.engines:
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+            result = pool.submit(run_engine, engine, rds_info, BENCH_TABLE, args.batch_size).result()
+        logger.info(f"{engine:<8} {result['rows_per_second']:>10} rows/s {result['cpu_seconds']:>8.1f}s CPU "
+                    f"{result['peak_rss_mb']:>8.0f} MB peak RSS")
+        results.append(result)
+
+    with open(args.output, "w") as f:
+        json.dump({"rows": args.rows, "width": args.width, "mix": args.mix, "results": results}, f, indent=2)
+    logger.info(f"Results saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
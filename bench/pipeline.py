@@ -0,0 +1,358 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from importlib import metadata
+from multiprocessing import get_context
+
+# Run against the onboarding code in the parent directory
+REPO_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, REPO_DIR)
+import pandas as pd
+import pyarrow as pa
+from moto import mock_aws
+import aws_context
+import onboard
+import update
+from aws_context import get_client, get_session
+from synthetic import DEFAULT_TYPE_MIX, TYPE_MIXES, create_table, table_name_for
+
+# End-to-end benchmark of onboard.py and update.py that needs no AWS account:
+# tables come from a local Postgres and every AWS call goes to moto's
+# in-process S3, Glue, IAM, STS and Athena. Each scenario runs in a fresh
+# process, and the results are saved as JSON so that two versions can be
+# compared with --baseline.
+#
+# moto answers from memory, so upload throughput only measures the client
+# side. Call counts are exact.
+
+# moto's default account, used as both the source and the main account
+BENCH_ACCOUNT_ID = "123456789012"
+BENCH_REGION = "us-east-1"
+SOURCE_PROFILE = "bench-source"
+MAIN_PROFILE = "bench-main"
+BENCH_CUSTOMER = "benchcustomer"
+BENCH_ROLE = "bench-role"
+# Keeps update.py's IAM grant registry
+METADATA_BUCKET = "bench-metadata"
+
+DEFAULT_ROWS = [100000]
+DEFAULT_WIDTHS = [1]
+DEFAULT_BATCH_SIZE = 100000
+
+# Operations that only read state; every other call counts as mutating
+READ_OPERATION_PREFIXES = ("Get", "List", "Describe", "Head", "Select")
+
+# The onboarding log is only shown with -v; the benchmark's own always is
+logger = logging.getLogger("bench")
+logger.setLevel(logging.INFO)
+
+class CallCounter:
+    """Counts AWS API calls by service and operation through botocore events."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = Counter()
+
+    def attach(self, session):
+        # Clients created from the session afterwards inherit the handler
+        session.events.register('before-call', self)
+
+    def __call__(self, model, **kwargs):
+        with self.lock:
+            self.calls[f"{model.service_model.service_name}.{model.name}"] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return Counter(self.calls)
+
+    def since(self, snapshot):
+        return {name: count for name, count in sorted((self.snapshot() - snapshot).items())}
+
+def is_mutating(call):
+    return not call.split(".", 1)[1].startswith(READ_OPERATION_PREFIXES)
+
+def configure_aws(workdir):
+    # Profiles with static fake credentials; botocore rejects sso_* keys
+    # without the rest of an SSO configuration, see bench_account_id
+    with open(f"{workdir}/config", "w") as f:
+        for profile in (SOURCE_PROFILE, MAIN_PROFILE):
+            f.write(f"[profile {profile}]\nregion = {BENCH_REGION}\n\n")
+    with open(f"{workdir}/credentials", "w") as f:
+        for profile in (SOURCE_PROFILE, MAIN_PROFILE):
+            f.write(f"[{profile}]\naws_access_key_id = testing\naws_secret_access_key = testing\n\n")
+    with open(f"{workdir}/cymballic.json", "w") as f:
+        json.dump({
+            "aws_account_profile": MAIN_PROFILE,
+            "aws_account_id": BENCH_ACCOUNT_ID,
+            "aws_region": BENCH_REGION,
+            "iam_service_role": BENCH_ROLE,
+            "iam_sso_role": "bench-sso-role",
+            "s3_bucket": f"s3://{METADATA_BUCKET}/"
+        }, f, indent=2)
+    os.environ["AWS_CONFIG_FILE"] = f"{workdir}/config"
+    os.environ["AWS_SHARED_CREDENTIALS_FILE"] = f"{workdir}/credentials"
+    os.environ["AWS_DEFAULT_REGION"] = BENCH_REGION
+    for name in ("AWS_PROFILE", "AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY", "AWS_SESSION_TOKEN"):
+        os.environ.pop(name, None)
+
+def bench_account_id(profile):
+    # Stands in for get_account_id, which reads sso_account_id from the
+    # profile; moto's STS answers with its default account
+    return get_client(get_session(profile), 'sts').get_caller_identity()['Account']
+
+def run_stage(stages, counter, name, fn):
+    before = counter.snapshot()
+    start_time = time.time()
+    stage = {"status": "ok"}
+    try:
+        stage.update(fn() or {})
+    except (Exception, SystemExit) as e:
+        # fail_fast exits; the remaining stages still run
+        stage["status"] = "failed"
+        stage["error"] = f"{type(e).__name__}: {e}"
+        logger.error(f"Stage {name} failed: {stage['error']}")
+    stage["seconds"] = round(time.time() - start_time, 3)
+    stage["peak_rss_mb"] = round(onboard.peak_rss_mb(), 1)
+    calls = counter.since(before)
+    stage["aws_calls"] = sum(calls.values())
+    stage["aws_mutating_calls"] = sum(count for call, count in calls.items() if is_mutating(call))
+    stage["calls"] = calls
+    stages[name] = stage
+    logger.info(f"{name:<18} {stage['status']:<7} {stage['seconds']:>9.3f}s {stage['aws_calls']:>5} calls "
+                f"({stage['aws_mutating_calls']} mutating)")
+    return stage
+
+def extract_and_encode(rds_info, table_name, parquet_path, batch_size, layout):
+    """
+    Export the table like the streaming cursor engine does, timing the
+    Postgres fetch and Arrow conversion apart from the Parquet encoding.
+    """
+    conn = onboard.connect_to_postgres(rds_info)
+    extract_time = 0
+    encode_time = 0
+    row_count = 0
+    writer = None
+    try:
+        start_time = time.time()
+        with conn.cursor() as cur:
+            schema, select_list = onboard.table_export_schema(cur, table_name)
+        with conn.cursor(name="cymballic_bench") as cur:
+            cur.itersize = batch_size
+            cur.execute(f"SELECT {select_list} FROM {table_name}")
+            extract_time += time.time() - start_time
+            while True:
+                start_time = time.time()
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    extract_time += time.time() - start_time
+                    break
+                df = pd.DataFrame.from_records(rows, columns=[desc[0] for desc in cur.description])
+                table = pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+                extract_time += time.time() - start_time
+                start_time = time.time()
+                if writer is None:
+                    writer = onboard.open_parquet_writer(parquet_path, table.schema, layout=layout)
+                writer.write_table(table)
+                encode_time += time.time() - start_time
+                row_count += len(rows)
+        start_time = time.time()
+        if writer is not None:
+            writer.close()
+        encode_time += time.time() - start_time
+    finally:
+        conn.close()
+    parquet_bytes = os.path.getsize(parquet_path) if writer is not None else 0
+    return {
+        "rows": row_count,
+        "extract_seconds": round(extract_time, 3),
+        "extract_rows_per_second": round(row_count / max(extract_time, 1e-6)),
+        "encode_seconds": round(encode_time, 3),
+        "encode_mb_per_second": round(parquet_bytes / 1024 / 1024 / max(encode_time, 1e-6), 1),
+        "parquet_bytes": parquet_bytes
+    }
+
+def upload(session, bucket_name, parquet_path, table_name):
+    s3 = get_client(session, 's3', onboard.AWS_REGION)
+    start_time = time.time()
+    s3.upload_file(parquet_path, bucket_name, f"_bench/{table_name}.parquet")
+    elapsed_time = time.time() - start_time
+    s3.delete_object(Bucket=bucket_name, Key=f"_bench/{table_name}.parquet")
+    size = os.path.getsize(parquet_path)
+    return {"bytes": size, "upload_mb_per_second": round(size / 1024 / 1024 / max(elapsed_time, 1e-6), 1)}
+
+def run_scenario(rds_info, table_name, options, verbose=False):
+    # Runs in a fresh process, so moto's state, the cached AWS clients and
+    # the peak RSS all start from nothing
+    workdir = tempfile.mkdtemp(prefix="cymballic-bench-")
+    configure_aws(workdir)
+    # onboard.py and update.py write log/, out/ and state/ under the cwd
+    os.chdir(workdir)
+    logging.getLogger().setLevel(logging.INFO if verbose else logging.WARNING)
+
+    config = {**rds_info, **options, "type": "postgres", "customer": BENCH_CUSTOMER, "aws_profile": SOURCE_PROFILE}
+    bucket_name = database_name = BENCH_CUSTOMER
+    parquet_path = f"{workdir}/{table_name}.parquet"
+    stages = {}
+    counter = CallCounter()
+    aws_context.get_account_id = update.get_account_id = bench_account_id
+    with mock_aws():
+        session = get_session(SOURCE_PROFILE)
+        counter.attach(session)
+        counter.attach(get_session(MAIN_PROFILE))
+
+        def setup():
+            onboard.ensure_sso_session(SOURCE_PROFILE)
+            onboard.ensure_s3_bucket(session, bucket_name)
+            onboard.ensure_glue_database(session, database_name)
+            onboard.ensure_s3_bucket(get_session(MAIN_PROFILE), METADATA_BUCKET)
+            get_client(get_session(MAIN_PROFILE), 'iam').create_role(
+                RoleName=BENCH_ROLE, AssumeRolePolicyDocument=json.dumps({"Version": "2012-10-17", "Statement": []}))
+
+        run_stage(stages, counter, "setup", setup)
+        layout = onboard.ParquetLayout(config)
+        batch_size = int(config.get('batch_size', DEFAULT_BATCH_SIZE))
+        extracted = run_stage(stages, counter, "extract_encode",
+                              lambda: extract_and_encode(rds_info, table_name, parquet_path, batch_size, layout))
+        if extracted["status"] == "ok":
+            run_stage(stages, counter, "upload", lambda: upload(session, bucket_name, parquet_path, table_name))
+
+        def export():
+            columns = onboard.export_table_to_s3_parquet(onboard.table_options(config, table_name), table_name,
+                                                         bucket_name, session)
+            return {"columns": len(columns or [])}
+
+        run_stage(stages, counter, "export", export)
+        run_stage(stages, counter, "schema_inference",
+                  lambda: onboard.create_glue_table(session, database_name, table_name, bucket_name))
+        run_stage(stages, counter, "onboard", lambda: onboard.onboard_table(config, table_name, database_name, bucket_name))
+        # A rerun with nothing changed should not touch the catalog
+        run_stage(stages, counter, "onboard_rerun",
+                  lambda: onboard.onboard_table(config, table_name, database_name, bucket_name))
+        run_stage(stages, counter, "permissions",
+                  lambda: onboard.setup_permissions(session, BENCH_ACCOUNT_ID, database_name, bucket_name))
+
+        def run_update():
+            update.update_policy([(SOURCE_PROFILE, BENCH_CUSTOMER)])
+            update.register_glue_catalog(SOURCE_PROFILE, BENCH_CUSTOMER)
+
+        run_stage(stages, counter, "update", run_update)
+        run_stage(stages, counter, "update_rerun", run_update)
+
+    rows = extracted.get("rows")
+    if rows and stages["export"]["status"] == "ok":
+        stages["export"]["rows_per_second"] = round(rows / max(stages["export"]["seconds"], 1e-6))
+    return stages
+
+def package_versions():
+    versions = {"python": platform.python_version()}
+    for package in ("pyarrow", "pandas", "psycopg2-binary", "psycopg2", "boto3", "botocore", "moto"):
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            pass
+    return versions
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+def compare_with_baseline(results, baseline_path, max_regression):
+    """Log stages slower than in the baseline; return how many exceed max_regression percent."""
+    with open(baseline_path, 'r') as file:
+        baseline = {scenario["table"]: scenario for scenario in json.load(file)["scenarios"]}
+    regressions = 0
+    for scenario in results:
+        previous = baseline.get(scenario["table"])
+        if not previous:
+            logger.info(f"{scenario['table']}: not in baseline")
+            continue
+        for name, stage in scenario["stages"].items():
+            old = previous["stages"].get(name)
+            if not old or old["status"] != "ok" or stage["status"] != "ok":
+                continue
+            change = (stage["seconds"] - old["seconds"]) / max(old["seconds"], 1e-6) * 100
+            calls = stage["aws_calls"] - old["aws_calls"]
+            logger.info(f"{scenario['table']:<32} {name:<18} {old['seconds']:>9.3f}s -> {stage['seconds']:>9.3f}s "
+                        f"({change:+.0f}%), {calls:+d} calls")
+            if max_regression is not None and (change > max_regression or calls > 0):
+                regressions += 1
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark onboard.py and update.py against local Postgres and moto")
+    parser.add_argument("-c", "--config", required=True, help="JSON config with the Postgres connection")
+    parser.add_argument("-r", "--rows", type=int, nargs="+", default=DEFAULT_ROWS, help="Row counts to benchmark")
+    parser.add_argument("-w", "--width", type=int, nargs="+", default=DEFAULT_WIDTHS,
+                        help="Column group counts to benchmark")
+    parser.add_argument("-m", "--mix", nargs="+", default=[DEFAULT_TYPE_MIX], choices=sorted(TYPE_MIXES),
+                        help="Type mixes to benchmark")
+    parser.add_argument("-x", "--option", action="append", default=[],
+                        help="Export option for every scenario, e.g. -x export_mode=streaming -x compression=zstd")
+    parser.add_argument("--reuse", action="store_true", help="Reuse existing synthetic tables")
+    parser.add_argument("-o", "--output", default="bench_pipeline.json", help="Where to save the results")
+    parser.add_argument("--baseline", help="Earlier results to compare with")
+    parser.add_argument("--max-regression", type=float,
+                        help="Exit with an error if a stage is this many percent slower than the baseline, or makes more AWS calls")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Show the onboarding log of every stage")
+    args = parser.parse_args()
+
+    with open(args.config, 'r') as file:
+        rds_info = json.load(file)
+    # Values are JSON where possible, so numbers and lists keep their types
+    options = {}
+    for option in args.option:
+        name, _, value = option.partition("=")
+        try:
+            options[name] = json.loads(value)
+        except ValueError:
+            options[name] = value
+
+    scenarios = [(mix, rows, width) for mix in args.mix for rows in args.rows for width in args.width]
+    if not args.reuse:
+        conn = onboard.connect_to_postgres(rds_info)
+        try:
+            for mix, rows, width in scenarios:
+                create_table(conn, table_name_for(mix, rows, width), rows, width, mix)
+        finally:
+            conn.close()
+
+    started = time.strftime("%Y-%m-%dT%H:%M:%S")
+    results = []
+    for mix, rows, width in scenarios:
+        table_name = table_name_for(mix, rows, width)
+        logger.info(f"Benchmarking {table_name}")
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+            stages = pool.submit(run_scenario, rds_info, table_name, options, args.verbose).result()
+        results.append({"table": table_name, "mix": mix, "rows": rows, "width": width, "stages": stages})
+
+    output = os.path.abspath(args.output)
+    with open(output, "w") as f:
+        json.dump({
+            "started": started,
+            "revision": git_revision(),
+            "versions": package_versions(),
+            "options": options,
+            "scenarios": results
+        }, f, indent=2)
+    logger.info(f"Results saved to {output}")
+
+    if args.baseline:
+        regressions = compare_with_baseline(results, args.baseline, args.max_regression)
+        if regressions:
+            logger.error(f"{regressions} stages regressed against {args.baseline}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
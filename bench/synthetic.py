@@ -0,0 +1,52 @@
+import logging
+
+# Synthetic Postgres tables for the benchmarks, generated server side with
+# generate_series so creating millions of rows takes seconds.
+
+logger = logging.getLogger(__name__)
+
+# SQL producing one column of each type from the series value g; {i} is the
+# index of the column group, so repeated columns differ
+COLUMN_TYPES = {
+    "int": "(g % 1000)::int",
+    "bigint": "g * 7919",
+    "float": "random() * g",
+    "numeric": "round((random() * 10000)::numeric, 2)::numeric(12,2)",
+    "text": "md5((g + {i})::text)",
+    "timestamp": "(timestamp '2020-01-01' + make_interval(secs => g))",
+    "timestamptz": "now() - make_interval(secs => g)",
+    "date": "(date '2020-01-01' + (g % 1500))",
+    "bool": "(g % 3 = 0)",
+    "nullable": "CASE WHEN g % 10 = 0 THEN NULL ELSE g END",
+    "json": "jsonb_build_object('id', g, 'tag', md5(g::text))",
+    "array": "ARRAY[g, g + 1, g + 2]",
+}
+
+# Type mixes: columns of each listed type per column group
+TYPE_MIXES = {
+    "basic": ["int", "float", "text", "bool"],
+    "typed": ["int", "float", "numeric", "text", "timestamptz", "date", "bool", "nullable"],
+    "text": ["text", "text", "text", "text"],
+    "all": list(COLUMN_TYPES),
+}
+DEFAULT_TYPE_MIX = "typed"
+
+def table_name_for(mix, rows, width):
+    return f"bench_{mix}_{rows}_{width}"
+
+def create_table(conn, table_name, rows, width=1, mix=DEFAULT_TYPE_MIX):
+    """
+    Replace table_name with rows rows of width groups of the columns in the
+    type mix, plus an integer primary key id.
+    """
+    columns = ["g AS id"]
+    for i in range(width):
+        columns += [f"{COLUMN_TYPES[typ].format(i=i)} AS {typ}_{i}_{j}" for j, typ in enumerate(TYPE_MIXES[mix])]
+    with conn.cursor() as cur:
+        cur.execute(f"DROP TABLE IF EXISTS {table_name}")
+        # The row count is inlined: the column SQL has % operators psycopg2 would take as placeholders
+        cur.execute(f"CREATE TABLE {table_name} AS SELECT {', '.join(columns)} FROM generate_series(1, {int(rows)}) AS g")
+        cur.execute(f"ALTER TABLE {table_name} ADD PRIMARY KEY (id)")
+        cur.execute(f"ANALYZE {table_name}")
+    conn.commit()
+    logger.info(f"Created {table_name} with {rows} rows and {len(columns)} columns")
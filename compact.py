@@ -0,0 +1,315 @@
+import argparse
+import fnmatch
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+import pyarrow as pa
+import pyarrow.parquet as pq
+from aws_context import ensure_sso_session, get_client, load_cymballic_config, table_options
+from parquet_footer import is_data_file, merge_arrow_schemas, parquet_file_stats, read_s3_parquet_metadata
+from parquet_layout import ParquetLayout, RowGroupWriter
+from reconcile import merge_table_input
+from run_metrics import metrics
+from s3_io import (DEFAULT_UPLOAD_CONCURRENCY, DEFAULT_UPLOAD_PART_SIZE_MB, S3MultipartWriter, S3ObjectReader,
+                   remove_stale_objects)
+
+# Compaction of the small Parquet files of onboarded tables. The data files
+# directly under a table (or partition) location are merged into files of
+# about the target size, by streaming their row groups into new files.
+#
+# Readers never see a file twice or miss one: the merged files and a copy of
+# every other file are written to a hidden generation directory
+# <location>/_compact_<id>/, the Glue table or partition is pointed at it,
+# the original location is rewritten, and then the Glue location is switched
+# back. Files added to the location meanwhile are left alone.
+
+# Files are merged into files of about this size, unless the table sets
+# target_file_size_mb
+DEFAULT_COMPACT_TARGET_MB = 256
+# Only files smaller than this fraction of the target size are merged
+SMALL_FILE_FRACTION = 0.5
+# Uncompressed bytes per output row group, unless the table sets row_group_size
+COMPACT_ROW_GROUP_BYTES = 128 * 1024 * 1024
+
+# Athena skips directories starting with "_", so generations stay hidden
+# until a location points at them
+GENERATION_PREFIX = "_compact_"
+# Kept in each generation so an interrupted compaction can be finished
+GENERATION_MANIFEST = "_sources.json"
+
+# Table and partition locations compacted at the same time
+DEFAULT_JOBS = 4
+
+logging.basicConfig(
+    format="%(asctime)s - %(levelname)s - %(message)s",
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+def fail_fast(msg):
+    logger.error(msg)
+    exit(1)
+
+def parse_s3_location(location):
+    bucket_name, _, prefix = location.removeprefix("s3://").partition("/")
+    return bucket_name, prefix.rstrip("/") + "/" if prefix else ""
+
+def list_directory(s3, bucket_name, prefix):
+    """Data files (key, size) directly under prefix, sorted by key, and its subdirectories."""
+    files = []
+    directories = []
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix, Delimiter="/"):
+        files.extend((obj['Key'], obj['Size']) for obj in page.get('Contents', [])
+                     if obj['Size'] > 0 and is_data_file(obj['Key']))
+        directories.extend(common['Prefix'] for common in page.get('CommonPrefixes', []))
+    return sorted(files), directories
+
+def directory_name(prefix):
+    return prefix.rstrip("/").rsplit("/", 1)[-1]
+
+def plan_bins(files, target_size):
+    """
+    Group the small files, in key order, into bins of about target_size.
+    Bins of a single file would not change anything and are left out.
+    """
+    bins = []
+    current = []
+    current_size = 0
+    for key, size in files:
+        if size >= target_size * SMALL_FILE_FRACTION:
+            continue
+        current.append((key, size))
+        current_size += size
+        if current_size >= target_size:
+            bins.append(current)
+            current = []
+            current_size = 0
+    if current:
+        bins.append(current)
+    return [sources for sources in bins if len(sources) > 1]
+
+def conform(table, schema):
+    # Columns missing from a file are filled with nulls
+    return pa.Table.from_arrays(
+        [table.column(field.name).cast(field.type) if field.name in table.column_names
+         else pa.nulls(table.num_rows, field.type) for field in schema],
+        schema=schema
+    )
+
+def merge_files(s3, bucket_name, sources, key, options):
+    """
+    Stream the row groups of the source files into one Parquet object at
+    key. Source row groups are read one at a time with ranged GETs, so only
+    one source row group, one output row group and the upload parts in
+    flight are held in memory; the output is sent as a multipart upload
+    while it is written. Returns the number of rows.
+    """
+    layout = ParquetLayout(options)
+    footers = [read_s3_parquet_metadata(s3, bucket_name, source_key, size) for source_key, size in sources]
+    schema = merge_arrow_schemas(footer.schema.to_arrow_schema() for footer in footers)
+    rows = sum(footer.num_rows for footer in footers)
+    row_group_size = layout.row_group_size
+    if not row_group_size:
+        uncompressed = sum(parquet_file_stats(footer)['uncompressed_bytes'] for footer in footers)
+        row_group_size = max(1, int(rows * COMPACT_ROW_GROUP_BYTES / max(uncompressed, 1)))
+    part_size = int(options.get('upload_part_size_mb', DEFAULT_UPLOAD_PART_SIZE_MB)) * 1024 * 1024
+    max_in_flight = int(options.get('upload_concurrency', DEFAULT_UPLOAD_CONCURRENCY))
+    with S3MultipartWriter(s3, bucket_name, key, part_size, max_in_flight) as sink:
+        writer = RowGroupWriter(pq.ParquetWriter(sink, schema, **layout.writer_options()), row_group_size)
+        for (source_key, size), footer in zip(sources, footers):
+            # pre_buffer coalesces the column chunks of a row group into few ranged GETs
+            parquet_file = pq.ParquetFile(S3ObjectReader(s3, bucket_name, source_key, size), metadata=footer,
+                                          pre_buffer=True)
+            for i in range(parquet_file.num_row_groups):
+                row_group = parquet_file.read_row_group(i)
+                with metrics.stage("encode"):
+                    writer.write_table(conform(row_group, schema))
+        with metrics.stage("encode"):
+            writer.close()
+    metrics.add("encode", rows=rows)
+    return rows
+
+def copy_object(s3, bucket_name, source_key, key):
+    # Server side, as a multipart copy for large objects
+    s3.copy({'Bucket': bucket_name, 'Key': source_key}, bucket_name, key)
+
+def delete_keys(s3, bucket_name, keys):
+    for i in range(0, len(keys), 1000):
+        s3.delete_objects(Bucket=bucket_name, Delete={'Objects': [{'Key': key} for key in keys[i:i + 1000]]})
+
+def switch_table_location(glue, database_name, table_name, location):
+    table = glue.get_table(DatabaseName=database_name, Name=table_name)['Table']
+    table_input = {"StorageDescriptor": {**table['StorageDescriptor'], "Location": location}}
+    glue.update_table(DatabaseName=database_name, TableInput=merge_table_input(table, table_input), SkipArchive=True)
+
+def switch_partition_location(glue, database_name, table_name, values, location):
+    partition = glue.get_partition(DatabaseName=database_name, TableName=table_name, PartitionValues=values)['Partition']
+    partition_input = {"Values": values, "StorageDescriptor": {**partition['StorageDescriptor'], "Location": location}}
+    if partition.get('Parameters'):
+        partition_input['Parameters'] = partition['Parameters']
+    glue.update_partition(DatabaseName=database_name, TableName=table_name, PartitionValueList=values,
+                          PartitionInput=partition_input)
+
+def finish_generation(s3, bucket_name, generation, switch):
+    """
+    With readers on the generation, replace the merged files under the
+    original location by their merged version, switch back and drop the
+    generation. Safe to repeat after an interruption.
+    """
+    response = s3.get_object(Bucket=bucket_name, Key=f"{generation}{GENERATION_MANIFEST}")
+    manifest = json.loads(response['Body'].read())
+    prefix = manifest['prefix']
+    delete_keys(s3, bucket_name, manifest['sources'])
+    for name in manifest['outputs']:
+        copy_object(s3, bucket_name, f"{generation}{name}", f"{prefix}{name}")
+    switch(f"s3://{bucket_name}/{prefix}")
+    remove_stale_objects(s3, bucket_name, generation, set())
+
+def compact_location(s3, location, switch, options, target_size, dry_run=False):
+    """
+    Compact the data files directly under location, the location of a table
+    or partition. switch(location) points the table or partition at another
+    location. Returns the number of files before and after.
+    """
+    bucket_name, prefix = parse_s3_location(location)
+    if directory_name(prefix).startswith(GENERATION_PREFIX):
+        # An earlier run stopped while readers were on the generation
+        logger.info(f"Finishing the interrupted compaction of s3://{bucket_name}/{prefix}")
+        if not dry_run:
+            finish_generation(s3, bucket_name, prefix, switch)
+        prefix = prefix[:-len(directory_name(prefix)) - 1]
+
+    files, directories = list_directory(s3, bucket_name, prefix)
+    for directory in directories:
+        if directory_name(directory).startswith(GENERATION_PREFIX) and not dry_run:
+            # Left by a run that stopped before readers were switched to it
+            remove_stale_objects(s3, bucket_name, directory, set())
+    if any(not directory_name(directory).startswith(("_", ".")) for directory in directories):
+        logger.warning(f"Skipping s3://{bucket_name}/{prefix}: it has subdirectories that are not registered partitions")
+        return len(files), len(files)
+    bins = plan_bins(files, target_size)
+    if not bins:
+        return len(files), len(files)
+    merged = {key for sources in bins for key, _ in sources}
+    untouched = [key for key, _ in files if key not in merged]
+    after = len(untouched) + len(bins)
+    logger.info(f"{'Would merge' if dry_run else 'Merging'} {len(merged)} of {len(files)} files under "
+                f"s3://{bucket_name}/{prefix} into {len(bins)}")
+    if dry_run:
+        return len(files), after
+
+    compaction_id = time.strftime('%Y%m%d%H%M%S')
+    generation = f"{prefix}{GENERATION_PREFIX}{compaction_id}/"
+    outputs = []
+    for i, sources in enumerate(bins):
+        name = f"compacted-{compaction_id}-{i:05d}.parquet"
+        rows = merge_files(s3, bucket_name, sources, f"{generation}{name}", options)
+        logger.info(f"Merged {len(sources)} files with {rows} rows into s3://{bucket_name}/{generation}{name}")
+        outputs.append(name)
+    # The generation must hold the whole table before readers move to it
+    for key in untouched:
+        copy_object(s3, bucket_name, key, f"{generation}{key[len(prefix):]}")
+    manifest = {"prefix": prefix, "sources": sorted(merged), "outputs": outputs}
+    s3.put_object(Bucket=bucket_name, Key=f"{generation}{GENERATION_MANIFEST}", Body=json.dumps(manifest, indent=2).encode('utf-8'))
+    switch(f"s3://{bucket_name}/{generation}")
+    finish_generation(s3, bucket_name, generation, switch)
+    return len(files), after
+
+def compact_table_location(table_name, *args):
+    with metrics.stage("compact", table_name):
+        return compact_location(*args)
+
+def table_locations(glue, database_name, table):
+    """(name, location, switch) of the table, or of each of its registered partitions."""
+    table_name = table['Name']
+    if not table.get('PartitionKeys'):
+        return [(table_name, table['StorageDescriptor']['Location'],
+                 partial(switch_table_location, glue, database_name, table_name))]
+    if table.get('Parameters', {}).get('projection.enabled') == "true":
+        # Projected partitions have no location of their own to switch
+        logger.warning(f"Skipping {table_name}: tables with partition projection cannot be compacted")
+        return []
+    locations = []
+    paginator = glue.get_paginator('get_partitions')
+    for page in paginator.paginate(DatabaseName=database_name, TableName=table_name):
+        for partition in page['Partitions']:
+            values = partition['Values']
+            locations.append((f"{table_name}/{'/'.join(values)}", partition['StorageDescriptor']['Location'],
+                              partial(switch_partition_location, glue, database_name, table_name, values)))
+    return locations
+
+def resolve_glue_tables(glue, database_name, patterns):
+    patterns = [name.strip() for arg in patterns for name in arg.split(',') if name.strip()]
+    tables = []
+    paginator = glue.get_paginator('get_tables')
+    for page in paginator.paginate(DatabaseName=database_name):
+        tables.extend(table for table in page['TableList']
+                      if not patterns or any(fnmatch.fnmatchcase(table['Name'], pattern) for pattern in patterns))
+    return tables
+
+def main():
+    start_time = time.time()
+    parser = argparse.ArgumentParser(description="Compact small Parquet files of onboarded tables")
+    parser.add_argument("-c", "--config", required=True, help="Path to JSON configuration file")
+    parser.add_argument("-t", "--table", nargs="*", default=[],
+                        help="Table names or globs, space or comma separated; all tables if omitted")
+    parser.add_argument("-j", "--jobs", type=int, default=DEFAULT_JOBS, help="Locations compacted concurrently")
+    parser.add_argument("-n", "--dry-run", action="store_true", help="Only show what would be merged")
+    args = parser.parse_args()
+
+    aws_region = load_cymballic_config().get('aws_region', 'us-east-1')
+    try:
+        with open(args.config, 'r') as file:
+            config = json.load(file)
+    except Exception as e:
+        fail_fast(f"Failed to load configuration: {str(e)}")
+    database_name = config.get("customer").lower()
+    session, _ = ensure_sso_session(config.get("aws_profile"))
+    glue = get_client(session, 'glue', aws_region)
+    s3 = get_client(session, 's3', aws_region)
+
+    tables = resolve_glue_tables(glue, database_name, args.table)
+    if not tables:
+        fail_fast(f"No tables to compact in Glue database {database_name}")
+    work = []
+    for table in tables:
+        options = table_options(config, table['Name'])
+        target_size = int(float(options.get('target_file_size_mb') or DEFAULT_COMPACT_TARGET_MB) * 1024 * 1024)
+        work.extend((table['Name'], name, location, switch, options, target_size)
+                    for name, location, switch in table_locations(glue, database_name, table))
+    logger.info(f"Compacting {len(work)} locations of {len(tables)} table(s)")
+
+    totals = {}
+    failed = []
+    with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+        futures = {}
+        for table_name, name, location, switch, options, target_size in work:
+            future = pool.submit(compact_table_location, table_name, s3, location, switch, options, target_size,
+                                 args.dry_run)
+            futures[future] = (table_name, name)
+        for future in as_completed(futures):
+            table_name, name = futures[future]
+            try:
+                before, after = future.result()
+            except Exception as e:
+                logger.error(f"Failed to compact {name}: {str(e)}")
+                failed.append(name)
+                continue
+            total = totals.setdefault(table_name, [0, 0])
+            total[0] += before
+            total[1] += after
+    for table_name, (before, after) in sorted(totals.items()):
+        logger.info(f"{table_name:<40} {before:>8} files -> {after:>8} files")
+    if failed:
+        fail_fast(f"Failed to compact {len(failed)} of {len(work)} locations: {', '.join(failed)}")
+    total_time = time.time() - start_time
+    logger.info(f"Compaction completed in {int(total_time/60)}m {int(total_time%60)}s")
+
+if __name__ == "__main__":
+    try:
+        main()
+    finally:
+        metrics.write_report("compact")
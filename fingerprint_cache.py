@@ -0,0 +1,78 @@
+import base64
+import json
+import logging
+import os
+import pyarrow as pa
+
+# Persistent record, per table of a parquet source, of the data files under
+# its prefix (ETag, size and last-modified), the schemas read from their
+# footers, and the Glue table definition last registered for it. A rerun of
+# onboard.py on an unchanged prefix then costs one LIST and no Glue calls,
+# and a changed prefix only has the footers of new or changed files read.
+
+# "local" keeps a cache under CACHE_DIR/<name>/, "s3" under <name>/ in the
+# s3_bucket of cymballic.json, and "none" disables it. Besides the
+# fingerprints, table_statistics.py keeps its per-file statistics this way.
+FINGERPRINT_STORES = ("local", "s3", "none")
+CACHE_DIR = "cache"
+FINGERPRINT_CACHE_NAME = "fingerprints"
+
+logger = logging.getLogger(__name__)
+
+def object_fingerprint(obj):
+    """Fingerprint of an entry of a list_objects_v2 response."""
+    return {"etag": obj['ETag'].strip('"'), "size": obj['Size'], "last_modified": obj['LastModified'].isoformat()}
+
+def serialize_schema(schema):
+    return base64.b64encode(schema.serialize().to_pybytes()).decode('ascii')
+
+def deserialize_schema(text):
+    return pa.ipc.read_schema(pa.py_buffer(base64.b64decode(text)))
+
+class FingerprintCache:
+    """
+    Cache entries by source bucket and table. s3 and location (s3://bucket/
+    prefix/) are needed for the "s3" store. A missing or unreadable entry
+    loads as {}, so the table is simply processed in full.
+    """
+
+    def __init__(self, store="local", s3=None, location=None, name=FINGERPRINT_CACHE_NAME):
+        if store not in FINGERPRINT_STORES:
+            raise ValueError(f"Unknown fingerprint_cache {store}, expected one of {', '.join(FINGERPRINT_STORES)}")
+        self.store = store
+        self.s3 = s3
+        self.directory = f"{CACHE_DIR}/{name}"
+        if store == "s3":
+            bucket_name, _, prefix = location.removeprefix("s3://").partition("/")
+            self.bucket_name = bucket_name
+            self.prefix = f"{prefix.rstrip('/') + '/' if prefix else ''}{name}/"
+
+    def _name(self, bucket_name, table_name):
+        return f"{bucket_name}/{table_name}.json"
+
+    def load(self, bucket_name, table_name):
+        try:
+            if self.store == "s3":
+                response = self.s3.get_object(Bucket=self.bucket_name, Key=f"{self.prefix}{self._name(bucket_name, table_name)}")
+                return json.loads(response['Body'].read())
+            path = f"{self.directory}/{self._name(bucket_name, table_name)}"
+            if not os.path.exists(path):
+                return {}
+            with open(path, 'r') as file:
+                return json.load(file)
+        except Exception as e:
+            if self.store != "s3" or 'NoSuchKey' not in str(e):
+                logger.warning(f"Ignoring the {self.directory} cache of {table_name}: {str(e)}")
+            return {}
+
+    def save(self, bucket_name, table_name, entry):
+        body = json.dumps(entry, indent=2, default=str)
+        if self.store == "s3":
+            self.s3.put_object(Bucket=self.bucket_name, Key=f"{self.prefix}{self._name(bucket_name, table_name)}",
+                               Body=body.encode('utf-8'))
+            return
+        path = f"{self.directory}/{self._name(bucket_name, table_name)}"
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(f"{path}.tmp", 'w') as file:
+            file.write(body)
+        os.replace(f"{path}.tmp", path)
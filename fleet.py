@@ -0,0 +1,187 @@
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from aws_context import SEPARATOR, get_account_id
+
+# Customers processed at the same time, and at most how many of them may
+# share one source AWS account
+DEFAULT_JOBS = 4
+DEFAULT_PER_ACCOUNT = 2
+
+# Configure logging
+logging.basicConfig(
+    format="%(asctime)s - %(levelname)s - %(message)s",
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+def fail_fast(msg):
+    logger.error(msg)
+    exit(1)
+
+def find_customer_configs(paths):
+    configs = []
+    for path in paths:
+        if os.path.isdir(path):
+            configs.extend(os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith(".json"))
+        else:
+            configs.append(path)
+
+    customers = []
+    seen = set()
+    for config_path in configs:
+        if os.path.realpath(config_path) in seen:
+            logger.warning(f"Skipping {config_path}: listed more than once")
+            continue
+        seen.add(os.path.realpath(config_path))
+        try:
+            with open(config_path, 'r') as file:
+                config = json.load(file)
+        except Exception as e:
+            logger.warning(f"Skipping {config_path}: {str(e)}")
+            continue
+        # cymballic.json and other non-customer files have no customer
+        if not isinstance(config, dict) or "customer" not in config or "aws_profile" not in config:
+            logger.info(f"Skipping {config_path}: not a customer config")
+            continue
+        customers.append((config_path, config))
+    return customers
+
+def log_names(customers):
+    """
+    Log file name of each customer config. A customer can have several
+    configs (e.g. a postgres and a parquet one), so the config name is part
+    of it, and names that still collide are numbered.
+    """
+    names = []
+    for config_path, config in customers:
+        stem = os.path.splitext(os.path.basename(config_path))[0]
+        name = f"{config['customer'].lower()}-{stem.lower()}"
+        unique, count = name, 1
+        while unique in names:
+            count += 1
+            unique = f"{name}-{count}"
+        names.append(unique)
+    return names
+
+def run_step(name, command, log_file):
+    start_time = time.time()
+    log_file.write(f"{SEPARATOR}\n$ {' '.join(command)}\n")
+    log_file.flush()
+    result = subprocess.run(command, stdout=log_file, stderr=subprocess.STDOUT)
+    return {
+        "step": name,
+        "returncode": result.returncode,
+        "seconds": round(time.time() - start_time, 1)
+    }
+
+def run_customer(config_path, config, account_slots, log_path, onboard_args):
+    """
+    Run onboard.py for one customer in its own process, so a fail_fast in
+    one customer does not affect the others.
+    """
+    customer = config["customer"]
+    account = get_account_id(config["aws_profile"]) or config["aws_profile"]
+    report = {
+        "customer": customer,
+        "config": config_path,
+        "account": account,
+        "log": log_path,
+        "status": "ok",
+        "steps": []
+    }
+    start_time = time.time()
+    with open(log_path, "w") as log_file:
+        with account_slots[account]:
+            logger.info(f"Onboarding {customer} ({config_path})")
+            step = run_step("onboard", [sys.executable, "onboard.py", "-c", config_path] + onboard_args, log_file)
+        report["steps"].append(step)
+    if step["returncode"] != 0:
+        report["status"] = f"{step['step']} failed"
+        logger.error(f"{customer}: {step['step']} failed, see {log_path}")
+    report["seconds"] = round(time.time() - start_time, 1)
+    return report
+
+def update_customers(reports, log_dir):
+    """
+    Run update.py once for every onboarded customer, so their grants are
+    committed as one batch instead of one role policy rewrite per customer.
+    """
+    onboarded = [report for report in reports if report["status"] == "ok"]
+    if not onboarded:
+        return
+    log_path = f"{log_dir}/update.log"
+    logger.info(f"Updating main account for {len(onboarded)} customers")
+    with open(log_path, "w") as log_file:
+        step = run_step("update", [sys.executable, "update.py", "-c"] + [report["config"] for report in onboarded],
+                        log_file)
+    for report in onboarded:
+        report["steps"].append({**step, "log": log_path})
+        report["seconds"] = round(report["seconds"] + step["seconds"], 1)
+        if step["returncode"] != 0:
+            report["status"] = "update failed"
+    if step["returncode"] != 0:
+        logger.error(f"update failed, see {log_path}")
+
+def main():
+    start_time = time.time()
+    parser = argparse.ArgumentParser(description="Onboard and update many customers")
+    parser.add_argument("configs", nargs="+", help="Customer config files or directories containing them")
+    parser.add_argument("-j", "--jobs", type=int, default=DEFAULT_JOBS, help="Customers processed concurrently")
+    parser.add_argument("-a", "--per-account", type=int, default=DEFAULT_PER_ACCOUNT,
+                        help="Customers processed concurrently within one source AWS account")
+    parser.add_argument("-t", "--table", nargs="*", default=[], help="Tables passed to onboard.py (default all)")
+    parser.add_argument("--table-jobs", type=int, help="Tables onboarded concurrently per customer (onboard.py -j)")
+    args = parser.parse_args()
+
+    customers = find_customer_configs(args.configs)
+    if not customers:
+        fail_fast("No customer configs found")
+
+    onboard_args = []
+    if args.table:
+        onboard_args += ["-t"] + args.table
+    if args.table_jobs:
+        onboard_args += ["-j", str(args.table_jobs)]
+
+    timestamp = time.strftime("%Y%m%d_%H%M%S")
+    log_dir = f"log/fleet_{timestamp}"
+    os.makedirs(log_dir, exist_ok=True)
+
+    account_slots = defaultdict(lambda: threading.BoundedSemaphore(args.per_account))
+    # Create them all up front; defaultdict is not safe to fill from threads
+    for _, config in customers:
+        account_slots[get_account_id(config["aws_profile"]) or config["aws_profile"]]
+
+    logger.info(f"Processing {len(customers)} customers, {args.jobs} at a time, logs in {log_dir}")
+    with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+        reports = list(pool.map(
+            lambda customer, name: run_customer(customer[0], customer[1], account_slots, f"{log_dir}/{name}.log",
+                                                onboard_args),
+            customers, log_names(customers)))
+    update_customers(reports, log_dir)
+
+    report_path = f"{log_dir}/report.json"
+    with open(report_path, "w") as f:
+        json.dump({"started": timestamp, "seconds": round(time.time() - start_time, 1), "customers": reports}, f, indent=2)
+
+    logger.info(SEPARATOR)
+    for report in reports:
+        logger.info(f"{report['customer']:<30} {report['status']:<16} {int(report['seconds']/60):>4}m{int(report['seconds']%60):02d}s")
+    logger.info(SEPARATOR)
+    logger.info(f"Report saved to {report_path}")
+
+    failed = [report['customer'] for report in reports if report['status'] != "ok"]
+    if failed:
+        fail_fast(f"{len(failed)} of {len(reports)} customers failed: {', '.join(failed)}")
+
+if __name__ == "__main__":
+    main()
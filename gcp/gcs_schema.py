@@ -0,0 +1,78 @@
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+import pyarrow.parquet as pq
+from google.auth.credentials import AnonymousCredentials
+from google.cloud import storage
+from google.oauth2 import service_account
+
+# Share the footer reader with onboard.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from glue_types import glue_columns_from_arrow_schema
+from parquet_footer import DEFAULT_SCHEMA_SAMPLE_FILES, is_data_file, merge_arrow_schemas, read_arrow_schema
+
+# Footer-based schema inference for gs:// sources, shared by
+# infer-parquet-schema.py and onboard-gcs.py.
+
+# Tables inferred at the same time; each one only costs a LIST and a ranged
+# GET or two per sampled file, so this is bound by request latency
+DEFAULT_WORKERS = 16
+
+def make_client(key_file=None, project=None, key_info=None):
+    if key_info:
+        # Key held in memory, e.g. read from Secrets Manager, never written to disk
+        credentials = service_account.Credentials.from_service_account_info(key_info)
+        return storage.Client(project=project or key_info.get("project_id"), credentials=credentials)
+    if key_file:
+        return storage.Client.from_service_account_json(key_file, project=project)
+    if os.environ.get("STORAGE_EMULATOR_HOST"):
+        # Local emulator (e.g. fake-gcs-server): no credentials needed
+        return storage.Client(project=project or "test", credentials=AnonymousCredentials())
+    return storage.Client(project=project)
+
+def parse_gcs_uri(uri):
+    if not uri.startswith("gs://"):
+        raise ValueError(f"Not a gs:// URI: {uri}")
+    bucket_name, _, path = uri[len("gs://"):].partition("/")
+    return bucket_name, path
+
+def list_table_prefixes(client, bucket_name):
+    """Top-level prefixes of the bucket, one per table."""
+    iterator = client.list_blobs(bucket_name, delimiter="/")
+    # Prefixes are collected while the pages are read
+    for _ in iterator.pages:
+        pass
+    return sorted(prefix.rstrip("/") for prefix in iterator.prefixes if is_data_file(prefix.rstrip("/")))
+
+def list_parquet_blobs(client, bucket_name, path):
+    if path.endswith(".parquet"):
+        blob = client.bucket(bucket_name).get_blob(path)
+        if blob is not None:
+            return [blob]
+    prefix = path if not path or path.endswith("/") else f"{path}/"
+    blobs = [blob for blob in client.list_blobs(bucket_name, prefix=prefix) if blob.size and is_data_file(blob.name)]
+    return sorted(blobs, key=lambda blob: blob.name)
+
+def infer_gcs_schema(client, uri, sample_files=DEFAULT_SCHEMA_SAMPLE_FILES):
+    # Only the footers are fetched by byte range, never the data pages
+    bucket_name, path = parse_gcs_uri(uri)
+    blobs = list_parquet_blobs(client, bucket_name, path)
+    if not blobs:
+        raise FileNotFoundError(f"No parquet files found at {uri}")
+    schemas = []
+    for blob in blobs[:sample_files]:
+        # download_as_bytes treats end as inclusive
+        read_range = lambda start, end, blob=blob: blob.download_as_bytes(start=start, end=end - 1)
+        schemas.append(read_arrow_schema(read_range, blob.size))
+    return glue_columns_from_arrow_schema(merge_arrow_schemas(schemas))
+
+def infer_schema(source, client=None):
+    if source.startswith("gs://"):
+        return infer_gcs_schema(client, source)
+    # Local file: pyarrow only reads the footer as well
+    return glue_columns_from_arrow_schema(pq.read_schema(source))
+
+def infer_schemas(sources, client=None, workers=DEFAULT_WORKERS):
+    """Infer the Glue columns of every source concurrently, keyed by source."""
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(sources)))) as pool:
+        return dict(zip(sources, pool.map(lambda source: infer_schema(source, client), sources)))
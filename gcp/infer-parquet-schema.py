@@ -1,30 +1,31 @@
+import argparse
 import json
 import sys
-import pandas as pd
+from gcs_schema import DEFAULT_WORKERS, infer_schemas, make_client
+
+def main():
+    parser = argparse.ArgumentParser(description="Infer Glue columns from Parquet footers")
+    parser.add_argument("sources", nargs="+",
+                        help="gs://<bucket>/<table>/ prefix, gs:// object or local parquet file")
+    parser.add_argument("-k", "--key-file", help="Service account key (defaults to GOOGLE_APPLICATION_CREDENTIALS)")
+    parser.add_argument("-p", "--project", help="GCP project")
+    parser.add_argument("-w", "--workers", type=int, default=DEFAULT_WORKERS, help="Concurrent requests")
+    args = parser.parse_args()
 
-def infer_schema(parquet_file):
     try:
-        # Read the Parquet file... should only use as last resort.
-        df = pd.read_parquet(parquet_file)
-        
-        column_types = df.dtypes.apply(lambda x: str(x)).to_dict()
-        columns = [{"Name": col, "Type": "string" if "object" in typ else "double" if "float" in typ else "bigint" if "int" in typ else "string"} 
-                   for col, typ in column_types.items()]
-        return columns
+        client = None
+        if any(source.startswith("gs://") for source in args.sources):
+            client = make_client(args.key_file, args.project)
+        schemas = infer_schemas(args.sources, client, args.workers)
     except Exception as e:
-        print(f"Error inferring schema: {e}")
-        sys.exit(1)
-
-def main():
-    if len(sys.argv) != 2:
-        print("Usage: python script.py <parquet_file>")
+        print(f"Error inferring schema: {e}", file=sys.stderr)
         sys.exit(1)
 
-    parquet_file = sys.argv[1]
-    # TODO this is similar to inferring schema in main one... maybe check schema...
-    schema_output = infer_schema(parquet_file)
-    
-    print(json.dumps(schema_output, indent=2))
+    # A single source prints just its columns
+    if len(args.sources) == 1:
+        print(json.dumps(schemas[args.sources[0]], indent=2))
+    else:
+        print(json.dumps(schemas, indent=2))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,188 @@
+import argparse
+import fnmatch
+import glob
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+from gcs_schema import DEFAULT_WORKERS, infer_gcs_schema, list_table_prefixes, make_client
+
+# Shares the AWS session handling and Glue helpers of onboard.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from aws_context import get_client, get_session, load_cymballic_config
+from glue_types import parquet_storage_descriptor
+from reconcile import glue_table_changes, merge_table_input
+from run_metrics import metrics
+
+# Registers the Parquet tables of a customer's GCS bucket in the Glue catalog
+# of the main account, where the Athena GCS connector (create-lambda.sh)
+# reads them. Every top-level prefix gs://<bucket_name>/<table>/ is a table.
+
+# The GCS connector only serves databases with this LocationUri
+GCS_DATABASE_LOCATION = "google-cloud-storage-flag"
+# Glue calls in flight when registering tables
+DEFAULT_GLUE_JOBS = 8
+
+logging.basicConfig(
+    format="%(asctime)s - %(levelname)s - %(message)s",
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+def fail_fast(msg):
+    logger.error(msg)
+    exit(1)
+
+def load_gcp_key(session, region, secret_name):
+    """Service account key stored in Secrets Manager, kept in memory only."""
+    secrets = get_client(session, 'secretsmanager', region)
+    return json.loads(secrets.get_secret_value(SecretId=secret_name)['SecretString'])
+
+def gcs_table_input(bucket_name, table_name, columns):
+    return {
+        "Name": table_name,
+        "StorageDescriptor": parquet_storage_descriptor(columns, f"gs://{bucket_name}/{table_name}/"),
+        "PartitionKeys": [],
+        "TableType": "EXTERNAL_TABLE",
+        "Parameters": {
+            "classification": "parquet",
+            "sourceFile": f"{table_name}.parquet"
+        }
+    }
+
+def ensure_gcs_database(glue, database_name):
+    desired = {"Name": database_name, "Description": "Database for GCS data", "LocationUri": GCS_DATABASE_LOCATION}
+    try:
+        database = glue.get_database(Name=database_name)['Database']
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'EntityNotFoundException':
+            raise
+        glue.create_database(DatabaseInput=desired)
+        logger.info(f"Created Glue database {database_name}")
+        return
+    if database.get('LocationUri') != GCS_DATABASE_LOCATION:
+        glue.update_database(Name=database_name, DatabaseInput={**desired, "Parameters": database.get('Parameters', {})})
+        logger.info(f"Set the LocationUri of Glue database {database_name} for the GCS connector")
+    else:
+        logger.info(f"Glue database {database_name} already exists")
+
+def existing_glue_tables(glue, database_name):
+    # One call per 100 tables instead of one get_table per table
+    tables = {}
+    paginator = glue.get_paginator('get_tables')
+    for page in paginator.paginate(DatabaseName=database_name):
+        tables.update((table['Name'], table) for table in page['TableList'])
+    return tables
+
+def register_table(glue, database_name, table_input, existing):
+    """Create or update one Glue table; returns what was done."""
+    table_name = table_input['Name']
+    if existing is None:
+        glue.create_table(DatabaseName=database_name, TableInput=table_input)
+        logger.info(f"Created Glue table {table_name}")
+        return "created"
+    changes = glue_table_changes(existing, table_input)
+    if not changes:
+        return "unchanged"
+    glue.update_table(DatabaseName=database_name, TableInput=merge_table_input(existing, table_input), SkipArchive=True)
+    logger.info(f"Updated {', '.join(changes)} of Glue table {table_name}")
+    return "updated"
+
+def resolve_gcs_tables(patterns, config, client, bucket_name):
+    """Table names from -t (names or globs), the config's table_name, or every prefix of the bucket."""
+    patterns = [name.strip() for arg in patterns for name in arg.split(',') if name.strip()]
+    if not patterns and config.get('table_name'):
+        patterns = [config['table_name']]
+    if patterns and not any(glob.has_magic(pattern) for pattern in patterns):
+        return list(dict.fromkeys(patterns))
+    available = list_table_prefixes(client, bucket_name)
+    logger.info(f"Found {len(available)} table prefixes in gs://{bucket_name}/")
+    if not patterns:
+        return available
+    return [table for table in available if any(fnmatch.fnmatchcase(table, pattern) for pattern in patterns)]
+
+def main():
+    start_time = time.time()
+    parser = argparse.ArgumentParser(description="Register Parquet tables on GCS in Glue")
+    parser.add_argument("-c", "--config", required=True, help="Path to JSON configuration file")
+    parser.add_argument("-t", "--table", nargs="*", default=[],
+                        help="Table names or globs, space or comma separated; all prefixes of the bucket if omitted")
+    parser.add_argument("-k", "--key-file", help="Service account key file instead of the key in Secrets Manager")
+    parser.add_argument("-j", "--jobs", type=int, default=DEFAULT_WORKERS, help="Tables inferred concurrently")
+    args = parser.parse_args()
+
+    try:
+        with open(args.config, 'r') as file:
+            config = json.load(file)
+    except Exception as e:
+        fail_fast(f"Failed to load configuration: {str(e)}")
+    cymballic_config = load_cymballic_config()
+    aws_region = cymballic_config.get('aws_region', 'us-east-1')
+    session = get_session(cymballic_config['aws_account_profile'])
+    bucket_name = config['bucket_name']
+    database_name = config['customer'].lower()
+
+    try:
+        key_info = None
+        if not args.key_file and not os.environ.get("STORAGE_EMULATOR_HOST") and config.get('secret_mgr_gcp_key_name'):
+            key_info = load_gcp_key(session, aws_region, config['secret_mgr_gcp_key_name'])
+        client = make_client(args.key_file, config.get('project'), key_info)
+        tables = resolve_gcs_tables(args.table, config, client, bucket_name)
+    except Exception as e:
+        fail_fast(f"Failed to list gs://{bucket_name}/: {str(e)}")
+    if not tables:
+        fail_fast("No tables to register")
+
+    # Inference only reads footers, so it is bound by request latency
+    def infer(table_name):
+        try:
+            with metrics.stage("schema_inference", table_name):
+                return table_name, infer_gcs_schema(client, f"gs://{bucket_name}/{table_name}/"), None
+        except Exception as e:
+            return table_name, None, str(e)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(args.jobs, len(tables)))) as pool:
+        inferred = list(pool.map(infer, tables))
+    results = {table_name: error for table_name, _, error in inferred if error}
+    for table_name, error in results.items():
+        logger.error(f"Could not infer the schema of {table_name}: {error}")
+
+    glue = get_client(session, 'glue', aws_region)
+    try:
+        with metrics.stage("glue"):
+            ensure_gcs_database(glue, database_name)
+            existing = existing_glue_tables(glue, database_name)
+    except ClientError as e:
+        fail_fast(f"Failed to set up Glue database {database_name}: {str(e)}")
+
+    def register(item):
+        table_name, columns = item
+        try:
+            with metrics.stage("glue", table_name):
+                return table_name, register_table(glue, database_name, gcs_table_input(bucket_name, table_name, columns),
+                                                  existing.get(table_name))
+        except Exception as e:
+            # Only this table fails, whatever went wrong
+            return table_name, f"failed: {str(e)}"
+
+    to_register = [(table_name, columns) for table_name, columns, error in inferred if not error]
+    with ThreadPoolExecutor(max_workers=DEFAULT_GLUE_JOBS) as pool:
+        registered = dict(pool.map(register, to_register))
+
+    for table_name in tables:
+        logger.info(f"{table_name:<40} {registered.get(table_name) or 'failed: ' + results[table_name]}")
+    failed = [table_name for table_name in tables if table_name in results or registered[table_name].startswith("failed")]
+    if failed:
+        fail_fast(f"Failed to register {len(failed)} of {len(tables)} tables: {', '.join(failed)}")
+    total_time = time.time() - start_time
+    logger.info(f"Registered {len(tables)} table(s) in Glue database {database_name} in "
+                f"{int(total_time/60)}m {int(total_time%60)}s")
+
+if __name__ == "__main__":
+    try:
+        main()
+    finally:
+        metrics.write_report("onboard-gcs")
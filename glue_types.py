@@ -0,0 +1,145 @@
+import pyarrow as pa
+
+# One mapping from Postgres and Arrow types to the Glue (Hive) types Athena
+# reads, shared by the exports, the footer-based schema inference and the GCP
+# scripts. Each Postgres type is first mapped to the Arrow type the Parquet
+# writer stores, and the Glue type is derived from that Arrow type, so the
+# table definition always matches the physical type in the files.
+
+# Widest decimal Glue and Athena accept
+GLUE_MAX_DECIMAL_PRECISION = 38
+
+# Postgres types by pg_type.typname, which is also the udt_name column of
+# information_schema.columns. Array types are the element name with a
+# leading underscore (_int4 is int4[]).
+POSTGRES_ARROW_TYPES = {
+    "bool": pa.bool_(),
+    "int2": pa.int16(),
+    "int4": pa.int32(),
+    "int8": pa.int64(),
+    "oid": pa.int64(),
+    "float4": pa.float32(),
+    "float8": pa.float64(),
+    "date": pa.date32(),
+    "timestamp": pa.timestamp('us'),
+    "timestamptz": pa.timestamp('us', tz='UTC'),
+    "bytea": pa.binary(),
+}
+
+# pg_type.typname of the built-in type OIDs found in cursor descriptions
+POSTGRES_TYPE_NAMES = {
+    16: "bool", 17: "bytea", 18: "char", 19: "name", 20: "int8", 21: "int2", 23: "int4", 25: "text", 26: "oid",
+    114: "json", 700: "float4", 701: "float8", 1042: "bpchar", 1043: "varchar", 1082: "date", 1083: "time",
+    1114: "timestamp", 1184: "timestamptz", 1186: "interval", 1700: "numeric", 2950: "uuid", 3802: "jsonb",
+    1000: "_bool", 1005: "_int2", 1007: "_int4", 1009: "_text", 1015: "_varchar", 1016: "_int8", 1021: "_float4",
+    1022: "_float8", 1115: "_timestamp", 1182: "_date", 1185: "_timestamptz", 1231: "_numeric",
+}
+
+def arrow_type_from_postgres(udt_name, precision=None, scale=None):
+    """
+    Arrow type for a Postgres column. numeric needs its declared precision
+    and scale to become a decimal; unconstrained numeric and every type
+    without an Athena equivalent (json, uuid, time, interval, enums, ...)
+    are stored as their text representation.
+    """
+    if udt_name.startswith("_"):
+        # Element precision is not known for arrays; numeric[] stays text
+        return pa.list_(arrow_type_from_postgres(udt_name[1:]))
+    if udt_name == "numeric":
+        if precision and precision <= GLUE_MAX_DECIMAL_PRECISION:
+            return pa.decimal128(precision, scale or 0)
+        return pa.string()
+    return POSTGRES_ARROW_TYPES.get(udt_name, pa.string())
+
+def arrow_type_from_postgres_oid(oid, precision=None, scale=None):
+    return arrow_type_from_postgres(POSTGRES_TYPE_NAMES.get(oid, "text"), precision, scale)
+
+def glue_type_from_arrow(typ):
+    if pa.types.is_dictionary(typ):
+        return glue_type_from_arrow(typ.value_type)
+    if pa.types.is_boolean(typ):
+        return "boolean"
+    if pa.types.is_int8(typ):
+        return "tinyint"
+    if pa.types.is_int16(typ) or pa.types.is_uint8(typ):
+        return "smallint"
+    if pa.types.is_int32(typ) or pa.types.is_uint16(typ):
+        return "int"
+    if pa.types.is_integer(typ):
+        return "bigint"
+    if pa.types.is_float16(typ) or pa.types.is_float32(typ):
+        return "float"
+    if pa.types.is_floating(typ):
+        return "double"
+    if pa.types.is_decimal(typ):
+        if typ.precision > GLUE_MAX_DECIMAL_PRECISION:
+            return "string"
+        return f"decimal({typ.precision},{typ.scale})"
+    if pa.types.is_date(typ):
+        return "date"
+    if pa.types.is_timestamp(typ):
+        return "timestamp"
+    if pa.types.is_binary(typ) or pa.types.is_large_binary(typ) or pa.types.is_fixed_size_binary(typ):
+        return "binary"
+    if pa.types.is_list(typ) or pa.types.is_large_list(typ) or pa.types.is_fixed_size_list(typ):
+        return f"array<{glue_type_from_arrow(typ.value_type)}>"
+    if pa.types.is_map(typ):
+        return f"map<{glue_type_from_arrow(typ.key_type)},{glue_type_from_arrow(typ.item_type)}>"
+    if pa.types.is_struct(typ):
+        fields = [typ.field(i) for i in range(typ.num_fields)]
+        return "struct<" + ",".join(f"{field.name}:{glue_type_from_arrow(field.type)}" for field in fields) + ">"
+    # strings, and types Athena cannot read from Parquet (time, duration, null)
+    return "string"
+
+def glue_columns_from_arrow_schema(schema):
+    return [{"Name": field.name, "Type": glue_type_from_arrow(field.type)} for field in schema]
+
+def parquet_storage_descriptor(columns, location):
+    return {
+        "Columns": columns,
+        "Location": location,
+        "InputFormat": "org.apache.hadoop.hive.ql.io.parquet.MapredParquetInputFormat",
+        "OutputFormat": "org.apache.hadoop.hive.ql.io.parquet.MapredParquetOutputFormat",
+        "Compressed": True,
+        "SerdeInfo": {
+            "SerializationLibrary": "org.apache.hadoop.hive.ql.io.parquet.serde.ParquetHiveSerDe",
+            "Parameters": {}
+        }
+    }
+
+def glue_type_from_value(value):
+    # For schemas that are only known from a sample record (S3 Select JSON)
+    if isinstance(value, bool):
+        return "boolean"
+    if isinstance(value, int):
+        return "bigint"
+    if isinstance(value, float):
+        return "double"
+    if isinstance(value, list):
+        items = [item for item in value if item is not None]
+        return f"array<{glue_type_from_value(items[0]) if items else 'string'}>"
+    if isinstance(value, dict):
+        return "struct<" + ",".join(f"{name}:{glue_type_from_value(item)}" for name, item in value.items()) + ">"
+    return "string"
+
+# Athena result column types (ColumnInfo.Type) that CSV result files are
+# parsed into; everything else (varchar, varbinary, time, arrays, maps,
+# rows, timestamps with time zone, ...) is kept as the text Athena wrote
+ATHENA_ARROW_TYPES = {
+    "boolean": pa.bool_(),
+    "tinyint": pa.int8(),
+    "smallint": pa.int16(),
+    "integer": pa.int32(),
+    "int": pa.int32(),
+    "bigint": pa.int64(),
+    "float": pa.float32(),
+    "real": pa.float32(),
+    "double": pa.float64(),
+    "date": pa.date32(),
+    "timestamp": pa.timestamp('ms'),
+}
+
+def arrow_type_from_athena(athena_type, precision=None, scale=None):
+    if athena_type == "decimal" and precision:
+        return pa.decimal128(precision, scale or 0)
+    return ATHENA_ARROW_TYPES.get(athena_type, pa.string())
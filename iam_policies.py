@@ -0,0 +1,372 @@
+import json
+import logging
+import random
+import re
+import time
+from botocore.exceptions import ClientError
+from reconcile import normalize_policy
+
+# Grants of the main-account role to the Glue catalogs and buckets of the
+# onboarded customers, managed for a whole batch of customers at once.
+#
+# The customers granted, and the managed policy (shard) each one is in, are
+# kept in a registry object in the s3_bucket of cymballic.json. A batch is
+# committed with one conditional PUT of the registry, so a concurrent run
+# that committed first makes the PUT fail instead of being overwritten, and
+# the batch is applied again on top of its changes. The policies are then
+# rendered from the registry: the statements of the customers of a shard
+# are merged into one statement per set of actions, and a shard takes new
+# customers until its policy is close to the IAM size limit.
+
+REGISTRY_KEY_PREFIX = "iam/"
+# Commit attempts of a batch when other runs keep committing first
+REGISTRY_MAX_ATTEMPTS = 5
+# Customer managed policies hold at most 6,144 characters, not counting
+# whitespace; shards are filled to SHARD_FILL_RATIO of that
+MANAGED_POLICY_MAX_CHARS = 6144
+SHARD_FILL_RATIO = 0.9
+# Roles take 10 managed policies by default; leave room for others
+DEFAULT_MAX_MANAGED_POLICIES = 8
+# IAM keeps at most 5 versions of a managed policy
+MAX_POLICY_VERSIONS = 5
+
+GLUE_ACTIONS = ["glue:*", "sts:AssumeRole"]
+S3_ACTIONS = ["s3:GetObject", "s3:GetBucketLocation", "s3:ListBucket", "s3:PutObject"]
+
+# Statement ids carry the registry generation a policy was rendered from
+SID_PATTERN = re.compile(r"^CustomerGrantsG(\d+)S\d+$")
+GLUE_DATABASE_ARN = re.compile(r"^arn:aws:glue:[^:]*:(\d+):database/([^/]+)$")
+
+logger = logging.getLogger(__name__)
+
+def customer_statements(aws_region, grant):
+    """Statements of one registry entry, as update.py has always granted them."""
+    account = grant['source_account_id']
+    database_name = grant['database']
+    bucket_name = grant['bucket']
+    return [
+        {
+            "Effect": "Allow",
+            "Action": GLUE_ACTIONS,
+            "Resource": [
+                f"arn:aws:glue:{aws_region}:{account}:catalog",
+                f"arn:aws:glue:{aws_region}:{account}:database/{database_name}",
+                f"arn:aws:glue:{aws_region}:{account}:table/{database_name}/*",
+            ]
+        },
+        {
+            "Effect": "Allow",
+            "Action": S3_ACTIONS,
+            "Resource": [f"arn:aws:s3:::{bucket_name}", f"arn:aws:s3:::{bucket_name}/*"]
+        }
+    ]
+
+def _resources(statement):
+    resources = statement.get('Resource', [])
+    return [resources] if isinstance(resources, str) else resources
+
+def compact_statements(statements):
+    """
+    Merge the resources of statements with the same effect, actions and
+    condition into one statement, so shared ARNs such as the catalog of a
+    source account appear once.
+    """
+    merged = {}
+    for statement in statements:
+        actions = statement['Action'] if isinstance(statement['Action'], list) else [statement['Action']]
+        key = (statement['Effect'], tuple(sorted(actions)), json.dumps(statement.get('Condition'), sort_keys=True))
+        if key not in merged:
+            merged[key] = {**{k: v for k, v in statement.items() if k != 'Sid'}, "Action": sorted(actions), "Resource": set()}
+        merged[key]['Resource'].update(_resources(statement))
+    return [{**statement, "Resource": sorted(statement['Resource'])} for statement in merged.values()]
+
+def shard_policy(aws_region, grants, generation):
+    statements = compact_statements(statement for grant in grants for statement in customer_statements(aws_region, grant))
+    for i, statement in enumerate(statements):
+        statement['Sid'] = f"CustomerGrantsG{generation}S{i}"
+    return {"Version": "2012-10-17", "Statement": statements}
+
+def policy_size(policy):
+    # IAM does not count whitespace towards the limit
+    return len(re.sub(r"\s", "", json.dumps(policy)))
+
+def policy_generation(policy):
+    for statement in policy.get('Statement', []):
+        match = SID_PATTERN.match(statement.get('Sid', ""))
+        if match:
+            return int(match.group(1))
+    return 0
+
+def policy_content(policy):
+    """Canonical policy without statement ids, to compare what it grants."""
+    return normalize_policy({**policy, "Statement": [{k: v for k, v in s.items() if k != 'Sid'}
+                                                     for s in policy.get('Statement', [])]})
+
+def assign_shards(customers, aws_region, max_policies):
+    """
+    Set the "shard" of every registry entry. Customers keep their shard, so
+    adding one only changes the policy it goes into; a shard grown past the
+    limit by changed grants gives up its last customers to the others.
+    """
+    limit = MANAGED_POLICY_MAX_CHARS * SHARD_FILL_RATIO
+    shards = {index: [] for index in range(max_policies)}
+    unplaced = []
+    for name, grant in sorted(customers.items()):
+        shard = grant.get('shard')
+        (shards[shard] if shard in shards else unplaced).append(name)
+
+    def fits(names):
+        return policy_size(shard_policy(aws_region, [customers[name] for name in names], 0)) <= limit
+
+    for names in shards.values():
+        while len(names) > 1 and not fits(names):
+            unplaced.append(names.pop())
+    for name in unplaced:
+        index = next((index for index, names in shards.items() if fits(names + [name])), None)
+        if index is None:
+            raise ValueError(f"The grants of {len(customers)} customers do not fit in {max_policies} managed policies; "
+                             f"raise iam_max_managed_policies in cymballic.json")
+        shards[index].append(name)
+        customers[name]['shard'] = index
+    return {index: sorted(names) for index, names in shards.items() if names}
+
+def legacy_grants(policy):
+    """Registry entries for the customers of the inline policy update.py used to maintain."""
+    grants = {}
+    for statement in policy.get('Statement', []):
+        for resource in _resources(statement):
+            match = GLUE_DATABASE_ARN.match(resource)
+            if match:
+                # Database and bucket were always named after the customer
+                grants[match.group(2)] = {"source_account_id": match.group(1), "database": match.group(2),
+                                          "bucket": match.group(2)}
+    return grants
+
+def _same_grant(entry, grant):
+    return entry is not None and all(entry.get(key) == value for key, value in grant.items())
+
+class PolicyManager:
+    """
+    Customer grants of role_name in account_id. registry_location is the
+    s3:// prefix the registry is kept under, with s3 a client that can read
+    and write it.
+    """
+
+    def __init__(self, iam, s3, role_name, account_id, aws_region, registry_location,
+                 max_policies=DEFAULT_MAX_MANAGED_POLICIES):
+        self.iam = iam
+        self.s3 = s3
+        self.role_name = role_name
+        self.account_id = account_id
+        self.aws_region = aws_region
+        self.max_policies = max_policies
+        bucket_name, _, prefix = registry_location.removeprefix("s3://").partition("/")
+        self.bucket_name = bucket_name
+        self.registry_key = f"{prefix.rstrip('/') + '/' if prefix else ''}{REGISTRY_KEY_PREFIX}{role_name}-grants.json"
+        self.policy_path = f"/{role_name}-customers/"
+        self.inline_policy_name = f"{role_name}-policy"
+
+    def policy_arn(self, index):
+        return f"arn:aws:iam::{self.account_id}:policy{self.policy_path}{self.role_name}-customers-{index}"
+
+    def load_registry(self):
+        """The registry and its ETag, or (None, None) if there is none yet."""
+        try:
+            response = self.s3.get_object(Bucket=self.bucket_name, Key=self.registry_key)
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'NoSuchKey':
+                raise
+            return None, None
+        return json.loads(response['Body'].read()), response['ETag']
+
+    def load_inline_policy(self):
+        try:
+            return self.iam.get_role_policy(RoleName=self.role_name, PolicyName=self.inline_policy_name)['PolicyDocument']
+        except self.iam.exceptions.NoSuchEntityException:
+            return None
+
+    def _load_or_migrate(self):
+        """The registry and its ETag; before the first commit, the customers of the inline policy."""
+        registry, etag = self.load_registry()
+        if registry is None:
+            inline = self.load_inline_policy()
+            registry = {"generation": 0, "customers": legacy_grants(inline) if inline else {}}
+        return registry, etag
+
+    def _put_registry(self, registry, etag, attempt):
+        """Conditional write of the registry; False when another run committed first."""
+        condition = {"IfMatch": etag} if etag else {"IfNoneMatch": "*"}
+        try:
+            self.s3.put_object(Bucket=self.bucket_name, Key=self.registry_key,
+                               Body=json.dumps(registry, indent=2).encode('utf-8'), **condition)
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ('PreconditionFailed', 'ConditionalRequestConflict'):
+                raise
+            logger.info(f"Grant registry changed by another run, retrying ({attempt + 1}/{REGISTRY_MAX_ATTEMPTS})")
+            time.sleep(random.uniform(0.5, 2) * (attempt + 1))
+            return False
+        return True
+
+    def commit(self, grants):
+        """
+        Set the registry entries of a batch of customers in one conditional
+        write. When another run commits first, the batch is applied again on
+        top of what it wrote; a customer that run changed differently from
+        this batch is a conflict. Returns the committed registry.
+        """
+        base = None
+        for attempt in range(REGISTRY_MAX_ATTEMPTS):
+            registry, etag = self._load_or_migrate()
+            customers = registry['customers']
+            if base is None:
+                base = {name: customers.get(name) for name in grants}
+            conflicts = [name for name in grants
+                         if customers.get(name) != base[name] and not _same_grant(customers.get(name), grants[name])]
+            if conflicts:
+                raise RuntimeError(f"Grants of {', '.join(sorted(conflicts))} were changed by another run")
+            changed = [name for name in grants if not _same_grant(customers.get(name), grants[name])]
+            if not changed and etag is not None:
+                return registry
+            for name in changed:
+                customers[name] = {**grants[name], "shard": (customers.get(name) or {}).get('shard'),
+                                   "updated": time.strftime("%Y-%m-%dT%H:%M:%S")}
+            registry['generation'] += 1
+            assign_shards(customers, self.aws_region, self.max_policies)
+            if not self._put_registry(registry, etag, attempt):
+                continue
+            logger.info(f"Committed grants of {', '.join(changed)} as generation {registry['generation']}")
+            return registry
+        raise RuntimeError(f"Could not commit the grant registry after {REGISTRY_MAX_ATTEMPTS} attempts")
+
+    def revoke(self, names):
+        """
+        Remove the registry entries of customers in one conditional write;
+        the other customers keep their shards. Returns the committed
+        registry and the removed entries by name, which apply() takes to
+        drop their statements from the inline policy too.
+        """
+        for attempt in range(REGISTRY_MAX_ATTEMPTS):
+            registry, etag = self._load_or_migrate()
+            customers = registry['customers']
+            revoked = {name: customers.pop(name) for name in names if name in customers}
+            if not revoked and etag is not None:
+                return registry, revoked
+            registry['generation'] += 1
+            assign_shards(customers, self.aws_region, self.max_policies)
+            if not self._put_registry(registry, etag, attempt):
+                continue
+            logger.info(f"Revoked grants of {', '.join(revoked) or 'no customer'} as generation {registry['generation']}")
+            return registry, revoked
+        raise RuntimeError(f"Could not commit the grant registry after {REGISTRY_MAX_ATTEMPTS} attempts")
+
+    def render(self, registry):
+        """Policy document of each shard of the registry by index."""
+        customers = registry['customers']
+        shards = {}
+        for name, grant in customers.items():
+            shards.setdefault(grant['shard'], []).append(grant)
+        return {index: shard_policy(self.aws_region, sorted(grants, key=lambda g: g['database']), registry['generation'])
+                for index, grants in sorted(shards.items())}
+
+    def _managed_policies(self):
+        policies = {}
+        paginator = self.iam.get_paginator('list_policies')
+        for page in paginator.paginate(Scope='Local', PathPrefix=self.policy_path):
+            policies.update((policy['Arn'], policy) for policy in page['Policies'])
+        return policies
+
+    def _default_document(self, policy):
+        version = self.iam.get_policy_version(PolicyArn=policy['Arn'], VersionId=policy['DefaultVersionId'])
+        document = version['PolicyVersion']['Document']
+        return json.loads(document) if isinstance(document, str) else document
+
+    def _put_policy(self, arn, policy, document):
+        """Create or update one shard; returns what was done."""
+        name = arn.rsplit("/", 1)[-1]
+        if policy is None:
+            self.iam.create_policy(PolicyName=name, Path=self.policy_path, PolicyDocument=json.dumps(document),
+                                   Description=f"Customer grants of role {self.role_name}")
+            return "created"
+        current = self._default_document(policy)
+        if policy_content(current) == policy_content(document):
+            return "unchanged"
+        # A run that committed later may already have written this shard
+        if policy_generation(current) > policy_generation(document):
+            return "newer"
+        versions = self.iam.list_policy_versions(PolicyArn=arn)['Versions']
+        if len(versions) >= MAX_POLICY_VERSIONS:
+            oldest = min((v for v in versions if not v['IsDefaultVersion']), key=lambda v: v['CreateDate'])
+            self.iam.delete_policy_version(PolicyArn=arn, VersionId=oldest['VersionId'])
+        self.iam.create_policy_version(PolicyArn=arn, PolicyDocument=json.dumps(document), SetAsDefault=True)
+        return "updated"
+
+    def _delete_policy(self, policy, attached):
+        if policy['Arn'] in attached:
+            self.iam.detach_role_policy(RoleName=self.role_name, PolicyArn=policy['Arn'])
+        for version in self.iam.list_policy_versions(PolicyArn=policy['Arn'])['Versions']:
+            if not version['IsDefaultVersion']:
+                self.iam.delete_policy_version(PolicyArn=policy['Arn'], VersionId=version['VersionId'])
+        self.iam.delete_policy(PolicyArn=policy['Arn'])
+
+    def apply(self, registry, revoked=None):
+        """
+        Make the role's managed policies match the registry. Shards are
+        written and attached before emptied shards and the customer
+        statements of the inline policy are removed, so no grant is ever
+        missing in between; statements of revoked customers (see revoke())
+        are removed from the inline policy as well. Returns the rendered
+        documents by policy ARN.
+        """
+        documents = {self.policy_arn(index): document for index, document in self.render(registry).items()}
+        for arn, document in documents.items():
+            size = policy_size(document)
+            if size > MANAGED_POLICY_MAX_CHARS:
+                raise ValueError(f"Policy {arn} has {size} characters, more than IAM accepts")
+        existing = self._managed_policies()
+        paginator = self.iam.get_paginator('list_attached_role_policies')
+        attached = {policy['PolicyArn'] for page in paginator.paginate(RoleName=self.role_name, PathPrefix=self.policy_path)
+                    for policy in page['AttachedPolicies']}
+
+        for arn, document in documents.items():
+            result = self._put_policy(arn, existing.get(arn), document)
+            if arn not in attached:
+                self.iam.attach_role_policy(RoleName=self.role_name, PolicyArn=arn)
+                result = f"{result}, attached"
+            logger.info(f"Policy {arn.rsplit('/', 1)[-1]}: {result}")
+
+        for arn, policy in existing.items():
+            if arn in documents:
+                continue
+            if policy_generation(self._default_document(policy)) > registry['generation']:
+                continue
+            self._delete_policy(policy, attached)
+            logger.info(f"Deleted empty policy {policy['PolicyName']}")
+
+        revoked_statements = [statement for grant in (revoked or {}).values()
+                              for statement in customer_statements(self.aws_region, grant)]
+        self._prune_inline_policy([*documents.values(), {"Statement": revoked_statements}])
+        return documents
+
+    def _prune_inline_policy(self, documents):
+        # Statements of the old single inline policy now granted by the shards,
+        # or revoked
+        inline = self.load_inline_policy()
+        if inline is None:
+            return
+        granted = {(tuple(sorted(s['Action'])), resource) for document in documents for s in document['Statement']
+                   for resource in s['Resource']}
+        remaining = []
+        for statement in inline.get('Statement', []):
+            actions = statement.get('Action', [])
+            actions = tuple(sorted([actions] if isinstance(actions, str) else actions))
+            if not all((actions, resource) in granted for resource in _resources(statement)):
+                remaining.append(statement)
+        if len(remaining) == len(inline.get('Statement', [])):
+            return
+        if remaining:
+            self.iam.put_role_policy(RoleName=self.role_name, PolicyName=self.inline_policy_name,
+                                     PolicyDocument=json.dumps({**inline, "Statement": remaining}))
+            logger.info(f"Removed migrated customer statements from inline policy {self.inline_policy_name}")
+        else:
+            self.iam.delete_role_policy(RoleName=self.role_name, PolicyName=self.inline_policy_name)
+            logger.info(f"Deleted inline policy {self.inline_policy_name}, its grants are in the managed policies")
@@ -1,17 +1,95 @@
 import argparse
-import boto3
+import base64
+import hashlib
 import json
 import os
+import posixpath
 import time
 import psycopg2
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
 import logging
-from botocore.exceptions import ClientError, UnauthorizedSSOTokenError
-import configparser
+import multiprocessing
+import shutil
+import tempfile
+import threading
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
+from urllib.parse import quote, unquote
+from psycopg2.extensions import quote_ident
+from botocore.exceptions import ClientError
+import fnmatch
+import glob
+from aws_context import SEPARATOR, ensure_sso_session, get_client, get_session, load_cymballic_config, table_options
+from glue_types import (arrow_type_from_postgres, arrow_type_from_postgres_oid, glue_columns_from_arrow_schema,
+                        glue_type_from_value, parquet_storage_descriptor)
+from parquet_footer import (DEFAULT_SCHEMA_SAMPLE_FILES, is_data_file, list_data_objects, merge_arrow_schemas,
+                            parquet_file_stats, read_s3_parquet_metadata)
+from fingerprint_cache import (FINGERPRINT_CACHE_NAME, FingerprintCache, deserialize_schema, object_fingerprint,
+                               serialize_schema)
+from table_statistics import STATISTICS_CACHE_NAME, publish_table_statistics
+from reconcile import glue_table_changes, merge_table_input, policies_equal
+from parquet_layout import ParquetLayout, RowGroupWriter
+from run_metrics import metrics, peak_rss_mb, run_log_dir
+from s3_io import (DEFAULT_UPLOAD_CONCURRENCY, DEFAULT_UPLOAD_PART_SIZE_MB, MIN_UPLOAD_PART_SIZE, S3MultipartWriter,
+                   remove_stale_objects)
 
 AWS_REGION = 'us-east-1'
 
-SEPARATOR = "=" * 80
+# Rows fetched per round trip from the server-side cursor in streaming mode;
+# each batch becomes one Parquet row group. Override with "batch_size" in the
+# customer config.
+DEFAULT_BATCH_SIZE = 100000
+
+EXPORT_MODES = ("pandas", "streaming", "parallel")
+
+# Parallel mode: number of worker processes and how the table is split
+# between them ("pk" and "column" use value ranges, "ctid" uses page ranges).
+DEFAULT_PARALLEL_WORKERS = 4
+SPLIT_STRATEGIES = ("pk", "ctid", "column")
+
+# Rows sampled to fix the Arrow schema shared by all parallel part files
+SCHEMA_SAMPLE_ROWS = 10000
+
+# upload_mode "file" stages the Parquet file in a temporary directory and
+# uploads it afterwards; "stream" sends it to S3 as a multipart upload while
+# it is being written (see s3_io.py for the part size and concurrency).
+UPLOAD_MODES = ("file", "stream")
+
+# Incremental exports keep their high-water mark either in a local file under
+# WATERMARK_STATE_DIR or in the customer bucket under WATERMARK_STATE_PREFIX,
+# outside of any table location so Athena never reads it.
+WATERMARK_STATES = ("local", "s3")
+WATERMARK_STATE_DIR = "state"
+WATERMARK_STATE_PREFIX = "_cymballic_state"
+
+# Checkpointed exports split the table into chunks of about this much table
+# data in Postgres, and keep a manifest of their progress with the watermark
+# state so that a failed run can be resumed
+DEFAULT_CHECKPOINT_CHUNK_MB = 1024
+EXPORT_MANIFEST_SUFFIX = ".export"
+# S3 multipart uploads have at most this many parts
+MAX_UPLOAD_PARTS = 10000
+
+# Hive-partitioned layout: directory name used for NULL partition values, and
+# the most partitions batch_create_partition accepts per call
+HIVE_DEFAULT_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+GLUE_PARTITION_BATCH_SIZE = 100
+
+# "cursor" fetches rows as Python tuples through psycopg2 and converts them
+# with pandas; "copy" streams COPY ... TO STDOUT (CSV) straight into Arrow
+EXTRACT_ENGINES = ("cursor", "copy")
+# Bytes decoded into one Arrow record batch by the COPY engine
+COPY_BLOCK_SIZE = 8 * 1024 * 1024
+
+# Layout reports read at most this many footers per table
+LAYOUT_REPORT_MAX_FILES = 100
+
+# Tables onboarded at the same time when several are given
+DEFAULT_TABLE_JOBS = 4
 
 # TODO: Consider moving bucket_name and database_name generation to config file
 
@@ -26,40 +104,9 @@ def fail_fast(msg):
     logger.error(msg)
     exit(1)
 
-def ensure_sso_session(profile):
-    session = boto3.Session(profile_name=profile)
-    try:
-        # Try to use the session to verify it's valid
-        session.client('sts').get_caller_identity()
-        logger.info(f"Using existing AWS SSO session for profile {profile}")
-        return session, get_account_id(profile)
-    except UnauthorizedSSOTokenError:
-        fail_fast(f"AWS SSO session has expired or is invalid for profile '{profile}'.\n"
-                 f"Please run: aws sso login --profile {profile} --no-browser")
-    except ClientError:
-        fail_fast(f"No active session for profile {profile}. Please run: aws sso login --profile {profile} --no-browser")
-    return session, get_account_id(profile)
-
-def get_account_id(profile):
-    try:
-        config = configparser.ConfigParser()
-        config.read(os.path.expanduser('~/.aws/config'))
-        profile_section = f"profile {profile}"
-        if profile_section in config:
-            return config[profile_section].get('sso_account_id')
-    except Exception as e:
-        logger.warning(f"Could not read account ID from AWS config: {e}")
-    return None
-
-def load_cymballic_config():
-    with open('cymballic.json', 'r') as file:
-        config = json.load(file)
-        return config
-
-
 def ensure_s3_bucket(session, bucket_name):
 
-    s3 = session.client('s3', region_name=AWS_REGION)
+    s3 = get_client(session, 's3', AWS_REGION)
     try:
         s3.head_bucket(Bucket=bucket_name)
         logger.info(f"Bucket {bucket_name} already exists.")
@@ -75,64 +122,1014 @@ def ensure_s3_bucket(session, bucket_name):
             if 'BucketAlreadyExists' not in str(e) and 'BucketAlreadyOwnedByYou' not in str(e):
                 fail_fast(f"Failed to create bucket: {str(e)}")
 
-def export_table_to_s3_parquet(rds_info, table_name, bucket_name, session):
-    start_time = time.time()
-    try:
-        conn = psycopg2.connect(
+def arrow_schema_from_frame(df):
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    # A column that is entirely NULL in the sample has no usable type yet;
+    # store it as string like the Glue mapping does.
+    return pa.schema([
+        field.with_type(pa.string()) if pa.types.is_null(field.type) else field
+        for field in table.schema
+    ]).remove_metadata()
+
+def export_select_list(schema, conn):
+    # Columns stored as text are cast in the query, so the driver returns
+    # strings instead of dicts, UUIDs or unconstrained Decimals
+    select_list = []
+    for field in schema:
+        name = quote_ident(field.name, conn)
+        if pa.types.is_string(field.type):
+            select_list.append(f"{name}::text AS {name}")
+        elif pa.types.is_list(field.type) and pa.types.is_string(field.type.value_type):
+            select_list.append(f"{name}::text[] AS {name}")
+        else:
+            select_list.append(name)
+    return ", ".join(select_list)
+
+def table_export_schema(cur, table_name):
+    """
+    Arrow schema of a table from its column types in the Postgres catalog,
+    and the select list that returns its columns as those types. Relations
+    that information_schema does not list (materialized views) give
+    (None, "*"), and their schema is inferred from the rows instead.
+    """
+    with metrics.stage("schema_inference", table_name):
+        cur.execute("""
+            SELECT column_name, udt_name, numeric_precision, numeric_scale
+            FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = %s
+            ORDER BY ordinal_position
+        """, (table_name,))
+        rows = cur.fetchall()
+    if not rows:
+        return None, "*"
+    schema = pa.schema([
+        pa.field(name, arrow_type_from_postgres(udt_name, precision, scale))
+        for name, udt_name, precision, scale in rows
+    ])
+    return schema, export_select_list(schema, cur)
+
+def open_postgres_connection(rds_info):
+    # Table names are used unqualified, so a non-default schema is put on
+    # the search path
+    options = f"-c search_path={rds_info['schema']}" if rds_info.get('schema') else None
+    with metrics.stage("connect"):
+        return psycopg2.connect(
             host=rds_info['host'],
             port=rds_info.get('port', 5432),
             dbname=rds_info['database'],
             user=rds_info['username'],
-            password=rds_info['password']
+            password=rds_info['password'],
+            options=options
         )
+
+def connect_to_postgres(rds_info):
+    try:
+        conn = open_postgres_connection(rds_info)
         logger.info("Successfully connected to the database.")
+        return conn
     except Exception as e:
         fail_fast(f"Failed to connect to database: {str(e)}")
 
+def partition_path(partition_columns, values):
+    return "/".join(
+        f"{column}={HIVE_DEFAULT_PARTITION if value is None or value == '' else quote(str(value), safe='')}"
+        for column, value in zip(partition_columns, values)
+    )
+
+class PartitionedParquetWriter:
+    """
+    Writer for a Hive-partitioned layout: rows are routed to
+    <root_dir>/<col>=<value>/.../<file_name>, one file per partition, and the
+    partition columns are left out of the files as Athena expects.
+    """
+
+    def __init__(self, root_dir, file_name, schema, partition_columns, layout=None):
+        missing = [column for column in partition_columns if column not in schema.names]
+        if missing:
+            raise ValueError(f"Partition columns not found in table: {', '.join(missing)}")
+        self.root_dir = root_dir
+        self.file_name = file_name
+        self.partition_columns = list(partition_columns)
+        self.layout = layout or ParquetLayout({})
+        self.file_schema = pa.schema([field for field in schema if field.name not in self.partition_columns])
+        self.writers = {}
+
+    def write_table(self, table):
+        rows = defaultdict(list)
+        keys = zip(*(table.column(column).to_pylist() for column in self.partition_columns))
+        for i, key in enumerate(keys):
+            rows[key].append(i)
+        data = table.select(self.file_schema.names)
+        for key, indices in rows.items():
+            writer = self.writers.get(key)
+            if writer is None:
+                directory = os.path.join(self.root_dir, partition_path(self.partition_columns, key))
+                os.makedirs(directory, exist_ok=True)
+                writer = self.layout.open_writer(os.path.join(directory, self.file_name), self.file_schema)
+                self.writers[key] = writer
+            writer.write_table(data.take(indices))
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+
+def open_parquet_writer(parquet_path, schema, partition_columns=None, file_name=None, layout=None):
+    # With partition columns parquet_path is the root directory of the layout
+    layout = layout or ParquetLayout({})
+    if partition_columns:
+        return PartitionedParquetWriter(parquet_path, file_name, schema, partition_columns, layout)
+    return layout.open_writer(parquet_path, schema)
+
+def write_parquet_streaming(conn, query, parquet_path, batch_size, params=None, schema=None,
+                            partition_columns=None, file_name=None, layout=None):
+    """
+    Run query through a server-side (named) cursor and append each batch
+    to the Parquet file as a row group, so memory is bounded by batch_size
+    rather than by the size of the table. If schema is not given it is taken
+    from the first batch. With partition_columns, parquet_path is a directory
+    and file_name is written under each partition in it.
+    """
+    writer = None
+    row_count = 0
+    with conn.cursor(name="cymballic_export") as cur:
+        cur.itersize = batch_size
+        try:
+            start_time = time.perf_counter()
+            cur.execute(query, params)
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    metrics.add("query", seconds=time.perf_counter() - start_time)
+                    break
+                names = [desc[0] for desc in cur.description]
+                df = pd.DataFrame.from_records(rows, columns=names)
+                metrics.add("query", seconds=time.perf_counter() - start_time, rows=len(rows))
+                start_time = time.perf_counter()
+                if writer is None:
+                    if schema is None:
+                        schema = arrow_schema_from_frame(df)
+                    writer = open_parquet_writer(parquet_path, schema, partition_columns, file_name, layout)
+                table = pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+                writer.write_table(table)
+                metrics.add("encode", seconds=time.perf_counter() - start_time, rows=len(rows))
+                row_count += len(rows)
+                logger.info(f"Wrote {row_count} rows to {parquet_path} (peak RSS {peak_rss_mb():.0f} MB)")
+                start_time = time.perf_counter()
+        finally:
+            if writer is not None:
+                with metrics.stage("encode"):
+                    writer.close()
+
+        if writer is None and not partition_columns:
+            # No rows: still write a file that carries the column names
+            names = [desc[0] for desc in cur.description] if cur.description else []
+            if schema is None:
+                schema = arrow_schema_from_frame(pd.DataFrame(columns=names))
+            open_parquet_writer(parquet_path, schema, layout=layout).close()
+    columns = glue_columns_from_arrow_schema(schema) if schema is not None else None
+    return columns, row_count
+
+def copy_arrow_schema(cur, query, params=None):
+    """
+    Arrow schema of the rows query returns, from the Postgres column types,
+    and the select list that COPY uses to produce them as CSV.
+    """
+    cur.execute(f"SELECT * FROM ({query}) AS q LIMIT 0", params)
+    fields = []
+    select_list = []
+    for desc in cur.description:
+        name = quote_ident(desc.name, cur)
+        typ = arrow_type_from_postgres_oid(desc.type_code, desc.precision, desc.scale)
+        if pa.types.is_list(typ) or pa.types.is_binary(typ):
+            # CSV has no encoding Arrow can parse for these; keep the text
+            typ = pa.string()
+        fields.append(pa.field(desc.name, typ))
+        # timestamptz is written in UTC without an offset, which Arrow can
+        # parse; the time zone is put back on the Arrow side
+        select_list.append(f"{name} AT TIME ZONE 'UTC'" if pa.types.is_timestamp(typ) and typ.tz else name)
+    return pa.schema(fields), ", ".join(select_list)
+
+def write_parquet_copy(conn, query, parquet_path, params=None, partition_columns=None, file_name=None, layout=None):
+    """
+    Export query with COPY ... TO STDOUT in CSV format, decoding the stream
+    directly into typed Arrow record batches as it arrives, without Python
+    row tuples or a pandas DataFrame in between. Arguments are as for
+    write_parquet_streaming.
+    """
+    query = query.strip().rstrip(';')
+    with conn.cursor() as cur:
+        schema, select_list = copy_arrow_schema(cur, query, params)
+        copy_sql = cur.mogrify(f"COPY (SELECT {select_list} FROM ({query}) AS q) TO STDOUT WITH (FORMAT csv)",
+                               params).decode()
+    read_schema = pa.schema([
+        field.with_type(pa.timestamp('us')) if pa.types.is_timestamp(field.type) else field for field in schema
+    ])
+
+    # COPY writes into one end of a pipe from a thread while Arrow decodes
+    # the other end, so memory stays at a few blocks
+    read_fd, write_fd = os.pipe()
+    errors = []
+
+    def copy_out():
+        try:
+            with os.fdopen(write_fd, 'wb') as pipe, conn.cursor() as copy_cur:
+                copy_cur.copy_expert(copy_sql, pipe, size=COPY_BLOCK_SIZE)
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=copy_out, daemon=True)
+    thread.start()
+    writer = None
+    row_count = 0
+    try:
+        with os.fdopen(read_fd, 'rb') as pipe:
+            # open_csv rejects an empty stream, which is what COPY sends for no rows
+            reader = []
+            if pipe.peek(1):
+                reader = pa_csv.open_csv(
+                    pipe,
+                    read_options=pa_csv.ReadOptions(column_names=schema.names, block_size=COPY_BLOCK_SIZE),
+                    parse_options=pa_csv.ParseOptions(newlines_in_values=True),
+                    convert_options=pa_csv.ConvertOptions(
+                        column_types=read_schema,
+                        # COPY writes NULL unquoted and empty strings as ""
+                        strings_can_be_null=True,
+                        quoted_strings_can_be_null=False,
+                        true_values=['t'],
+                        false_values=['f']
+                    )
+                )
+            try:
+                start_time = time.perf_counter()
+                for batch in reader:
+                    metrics.add("query", seconds=time.perf_counter() - start_time, rows=batch.num_rows)
+                    start_time = time.perf_counter()
+                    table = pa.Table.from_batches([batch]).cast(schema)
+                    if writer is None:
+                        writer = open_parquet_writer(parquet_path, schema, partition_columns, file_name, layout)
+                    writer.write_table(table)
+                    metrics.add("encode", seconds=time.perf_counter() - start_time, rows=batch.num_rows)
+                    row_count += batch.num_rows
+                    logger.info(f"Wrote {row_count} rows to {parquet_path} (peak RSS {peak_rss_mb():.0f} MB)")
+                    start_time = time.perf_counter()
+                metrics.add("query", seconds=time.perf_counter() - start_time)
+            finally:
+                if writer is not None:
+                    with metrics.stage("encode"):
+                        writer.close()
+    finally:
+        # Closing the read end above makes a still running COPY fail fast
+        thread.join()
+    if errors:
+        raise errors[0]
+
+    if writer is None and not partition_columns:
+        # No rows: still write a file that carries the column names
+        open_parquet_writer(parquet_path, schema, layout=layout).close()
+    return glue_columns_from_arrow_schema(schema), row_count
+
+def write_parquet_query(conn, rds_info, query, parquet_path, batch_size, params=None, schema=None,
+                        partition_columns=None, file_name=None, layout=None):
+    # The COPY engine always takes its schema from the Postgres column types
+    if rds_info.get('extract_engine', 'cursor') == "copy":
+        return write_parquet_copy(conn, query, parquet_path, params=params, partition_columns=partition_columns,
+                                  file_name=file_name, layout=layout)
+    return write_parquet_streaming(conn, query, parquet_path, batch_size, params=params, schema=schema,
+                                   partition_columns=partition_columns, file_name=file_name, layout=layout)
+
+def get_primary_key_column(cur, table_name):
+    cur.execute("""
+        SELECT a.attname
+        FROM pg_index i
+        JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+        WHERE i.indrelid = %s::regclass AND i.indisprimary
+    """, (table_name,))
+    rows = cur.fetchall()
+    # Only single-column keys can be split into simple ranges
+    if len(rows) != 1:
+        return None
+    return rows[0][0]
+
+def ranges_from_bounds(expr, bounds, cast="", include_nulls=False):
+    """
+    Turn sorted interior split points into (where_clause, params) pairs that
+    together cover every row: (-inf, b1), [b1, b2), ..., [bn, +inf).
+    """
+    edges = [None] + list(bounds) + [None]
+    ranges = []
+    for lo, hi in zip(edges, edges[1:]):
+        clauses = []
+        params = []
+        if lo is not None:
+            clauses.append(f"{expr} >= %s{cast}")
+            params.append(lo)
+        if hi is not None:
+            clauses.append(f"{expr} < %s{cast}")
+            params.append(hi)
+        ranges.append((" AND ".join(clauses) or "TRUE", params))
+    if include_nulls:
+        where, params = ranges[0]
+        ranges[0] = (f"({where}) OR {expr} IS NULL", params)
+    return ranges
+
+def compute_split_ranges(cur, table_name, strategy, workers, split_column=None):
+    if strategy == "ctid":
+        cur.execute("SELECT pg_relation_size(%s::regclass) / current_setting('block_size')::bigint", (table_name,))
+        pages = cur.fetchone()[0]
+        step = max(1, -(-pages // workers))
+        bounds = [f"({page},0)" for page in range(step, pages, step)]
+        return ranges_from_bounds("ctid", bounds, cast="::tid")
+
+    expr = quote_ident(split_column, cur)
+    cur.execute(f"SELECT min({expr}), max({expr}) FROM {table_name}")
+    lo, hi = cur.fetchone()
+    if lo is None:
+        return [("TRUE", [])]
+    if isinstance(lo, int) and isinstance(hi, int) and not isinstance(lo, bool):
+        step = (hi - lo + 1) / workers
+        bounds = sorted(set(lo + int(step * i) for i in range(1, workers)) - {lo})
+    else:
+        # Non-integer columns (timestamps, text, ...) are split at quantiles
+        fractions = [i / workers for i in range(1, workers)]
+        cur.execute(f"SELECT percentile_disc(%s::float8[]) WITHIN GROUP (ORDER BY {expr}) FROM {table_name}", (fractions,))
+        bounds = sorted(set(v for v in (cur.fetchone()[0] or []) if v is not None and v != lo))
+    return ranges_from_bounds(expr, bounds, include_nulls=(strategy == "column"))
+
+def plan_split_ranges(cur, rds_info, table_name, workers, target_size=None):
+    """
+    Return the split column (None for ctid) and the (where, params) ranges
+    the table is exported in: at least workers ranges, and enough to keep
+    each one around target_size bytes of the on-disk table size.
+    """
+    strategy = rds_info.get('split_strategy', 'pk')
+    if strategy not in SPLIT_STRATEGIES:
+        raise ValueError(f"Unknown split_strategy {strategy}, expected one of {', '.join(SPLIT_STRATEGIES)}")
+    split_column = None
+    if strategy == "pk":
+        split_column = get_primary_key_column(cur, table_name)
+        if not split_column:
+            raise ValueError(f"Table {table_name} has no single-column primary key; use split_strategy ctid or column")
+    elif strategy == "column":
+        split_column = rds_info.get('split_column')
+        if not split_column:
+            raise ValueError("split_strategy column requires split_column in the config")
+    range_count = workers
+    if target_size:
+        # Parquet is usually smaller than the table on disk, so parts err small
+        cur.execute("SELECT pg_table_size(%s::regclass)", (table_name,))
+        range_count = max(workers, -(-cur.fetchone()[0] // target_size))
+    return split_column, compute_split_ranges(cur, table_name, strategy, range_count, split_column)
+
+def fixed_export_schema(cur, rds_info, table_name, batch_size):
+    """Arrow schema fixed up front, so every part file agrees on column types."""
+    schema, select_list = table_export_schema(cur, table_name)
+    if rds_info.get('extract_engine', 'cursor') == "copy":
+        schema, _ = copy_arrow_schema(cur, f"SELECT {select_list} FROM {table_name}")
+    elif schema is None:
+        cur.execute(f"SELECT * FROM {table_name} LIMIT %s", (min(batch_size, SCHEMA_SAMPLE_ROWS),))
+        sample = pd.DataFrame.from_records(cur.fetchall(), columns=[desc[0] for desc in cur.description])
+        schema = arrow_schema_from_frame(sample)
+    return schema
+
+def export_range_worker(rds_info, table_name, where, params, snapshot_id, part_path, batch_size, schema, bucket_name=None):
+    # Runs in a pool process: open a separate connection that reads from
+    # the coordinator's exported snapshot, if there is one.
+    conn = open_postgres_connection(rds_info)
     try:
-        query = f"SELECT * FROM {table_name};"
-        df = pd.read_sql(query, conn)
-        
-        # Get column types from DataFrame
-        column_types = df.dtypes.apply(lambda x: str(x)).to_dict()
-        columns = [{"Name": col, "Type": "string" if "object" in typ else "double" if "float" in typ else "bigint" if "int" in typ else "string"} 
-                  for col, typ in column_types.items()]
-        
-        parquet_path = f"/tmp/{table_name}.parquet"
-        df.to_parquet(parquet_path, engine="pyarrow", index=False)
+        conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+        if snapshot_id:
+            with conn.cursor() as cur:
+                cur.execute("SET TRANSACTION SNAPSHOT %s", (snapshot_id,))
+        layout = ParquetLayout(rds_info)
+        query = f"SELECT {export_select_list(schema, conn)} FROM {table_name} WHERE {where}{layout.order_by(conn)};"
+        part_name = os.path.basename(part_path)
+        partition_columns = rds_info.get('partition_columns')
+        if partition_columns:
+            # Partitioned parts are written into the staging directory layout
+            _, row_count = write_parquet_query(conn, rds_info, query, os.path.dirname(part_path), batch_size, params=params,
+                                               schema=schema, partition_columns=partition_columns, file_name=part_name,
+                                               layout=layout)
+            return part_name, row_count, metrics.drain()
+        if bucket_name:
+            session = get_session(rds_info.get('aws_profile'))
+            sink = open_s3_stream(session, bucket_name, f"{table_name}/{part_name}", rds_info)
+        else:
+            sink = nullcontext(part_path)
+        with sink as target:
+            _, row_count = write_parquet_query(conn, rds_info, query, target, batch_size, params=params, schema=schema,
+                                               layout=layout)
+        return part_name, row_count, metrics.drain()
+    finally:
+        conn.close()
+
+def init_export_worker(aws_region):
+    global AWS_REGION
+    AWS_REGION = aws_region
+
+def export_process_pool(workers):
+    # Workers are spawned, not forked: tables are exported from a thread
+    # pool, and a child forked while another thread holds a lock (logging,
+    # boto, urllib3 pools) can deadlock. They get the region main() set.
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                               initializer=init_export_worker, initargs=(AWS_REGION,))
+
+def export_table_parallel(rds_info, table_name, parquet_dir, batch_size, bucket_name=None,
+                          where="TRUE", params=None, part_prefix="part"):
+    """
+    Split the table into ranges and export each range to its own Parquet part
+    file from a pool of worker processes. All workers read the snapshot
+    exported by a coordinating transaction, so the parts are consistent with
+    each other. If bucket_name is given the parts are streamed straight to
+    s3://<bucket_name>/<table_name>/ instead of being written to parquet_dir.
+    Only rows matching where/params are exported.
+    """
+    workers = int(rds_info.get('workers', DEFAULT_PARALLEL_WORKERS))
+    strategy = rds_info.get('split_strategy', 'pk')
+
+    conn = connect_to_postgres(rds_info)
+    try:
+        # The coordinator's transaction must stay open until every worker has
+        # imported the snapshot, so it is only closed once all parts are done.
+        conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_export_snapshot()")
+            snapshot_id = cur.fetchone()[0]
+
+            split_column, ranges = plan_split_ranges(cur, rds_info, table_name, workers,
+                                                     ParquetLayout(rds_info).target_file_size)
+            schema = fixed_export_schema(cur, rds_info, table_name, batch_size)
+            columns = glue_columns_from_arrow_schema(schema)
+        logger.info(f"Exporting {table_name} in {len(ranges)} ranges split by {split_column or strategy} with {workers} workers (snapshot {snapshot_id})")
+
+        if not bucket_name:
+            os.makedirs(parquet_dir, exist_ok=True)
+        parts = []
+        with export_process_pool(workers) as pool:
+            futures = [
+                pool.submit(export_range_worker, rds_info, table_name, f"({range_where}) AND ({where})",
+                            list(range_params) + list(params or []), snapshot_id,
+                            f"{parquet_dir}/{part_prefix}-{i:05d}.parquet", batch_size, schema, bucket_name)
+                for i, (range_where, range_params) in enumerate(ranges)
+            ]
+            for future in as_completed(futures):
+                part_name, row_count, worker_metrics = future.result()
+                # Each worker process measures its own query, encode and upload
+                metrics.merge(worker_metrics)
+                logger.info(f"Finished part {part_name} with {row_count} rows")
+                parts.append((part_name, row_count))
+    finally:
+        conn.close()
+    return columns, sorted(parts)
+
+def open_s3_stream(session, bucket_name, s3_key, rds_info):
+    s3 = get_client(session, 's3', AWS_REGION)
+    return S3MultipartWriter(
+        s3, bucket_name, s3_key,
+        part_size=int(rds_info.get('upload_part_size_mb', DEFAULT_UPLOAD_PART_SIZE_MB)) * 1024 * 1024,
+        max_in_flight=int(rds_info.get('upload_concurrency', DEFAULT_UPLOAD_CONCURRENCY))
+    )
+
+def upload_file_resumable(s3, local_path, bucket_name, key, rds_info, upload_id=None, on_create=None):
+    """
+    Upload local_path as a multipart upload that can be picked up after a
+    failure: given the upload_id of an unfinished upload, parts S3 already
+    has with the same MD5 are not sent again. on_create(upload_id) is called
+    when a new upload is started, so the caller can record it. Returns the
+    number of bytes uploaded.
+    """
+    size = os.path.getsize(local_path)
+    part_size = max(int(float(rds_info.get('upload_part_size_mb', DEFAULT_UPLOAD_PART_SIZE_MB)) * 1024 * 1024),
+                    MIN_UPLOAD_PART_SIZE, -(-size // MAX_UPLOAD_PARTS))
+    uploaded = {}
+    if upload_id:
+        try:
+            for page in s3.get_paginator('list_parts').paginate(Bucket=bucket_name, Key=key, UploadId=upload_id):
+                uploaded.update((part['PartNumber'], part['ETag'].strip('"')) for part in page.get('Parts', []))
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'NoSuchUpload':
+                raise
+            logger.info(f"Multipart upload {upload_id} to s3://{bucket_name}/{key} no longer exists, starting over")
+            upload_id = None
+    if not upload_id:
+        upload_id = s3.create_multipart_upload(Bucket=bucket_name, Key=key)['UploadId']
+        if on_create:
+            on_create(upload_id)
+
+    parts = []
+    sent = 0
+    with open(local_path, 'rb') as file:
+        for part_number, offset in enumerate(range(0, max(size, 1), part_size), start=1):
+            body = file.read(part_size)
+            if uploaded.get(part_number) == hashlib.md5(body).hexdigest():
+                parts.append({'PartNumber': part_number, 'ETag': uploaded[part_number]})
+                continue
+            with metrics.stage("upload"):
+                response = s3.upload_part(Bucket=bucket_name, Key=key, UploadId=upload_id,
+                                          PartNumber=part_number, Body=body)
+            metrics.add("upload", bytes=len(body))
+            sent += len(body)
+            parts.append({'PartNumber': part_number, 'ETag': response['ETag']})
+    s3.complete_multipart_upload(Bucket=bucket_name, Key=key, UploadId=upload_id, MultipartUpload={'Parts': parts})
+    if sent < size:
+        logger.info(f"Resumed multipart upload to s3://{bucket_name}/{key}, {size - sent} of {size} bytes were already uploaded")
+    return sent
+
+def state_path(bucket_name, name):
+    return f"{WATERMARK_STATE_DIR}/{bucket_name}/{name}.json"
+
+def load_state(session, storage, bucket_name, name):
+    """Load the state document name kept locally or in the bucket, or None if there is none."""
+    if storage == "s3":
+        s3 = get_client(session, 's3', AWS_REGION)
+        try:
+            response = s3.get_object(Bucket=bucket_name, Key=f"{WATERMARK_STATE_PREFIX}/{name}.json")
+            return json.loads(response['Body'].read())
+        except s3.exceptions.NoSuchKey:
+            return None
+    path = state_path(bucket_name, name)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as file:
+        return json.load(file)
+
+def save_state(session, storage, bucket_name, name, state):
+    """Save a state document and return where it was saved."""
+    # Values such as dates and decimals of split bounds are stored as text
+    body = json.dumps(state, indent=2, default=str)
+    if storage == "s3":
+        s3 = get_client(session, 's3', AWS_REGION)
+        s3_key = f"{WATERMARK_STATE_PREFIX}/{name}.json"
+        s3.put_object(Bucket=bucket_name, Key=s3_key, Body=body.encode('utf-8'))
+        return f"s3://{bucket_name}/{s3_key}"
+    path = state_path(bucket_name, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Written to a temporary file first so a crash never leaves half a document
+    with open(f"{path}.tmp", 'w') as file:
+        file.write(body)
+    os.replace(f"{path}.tmp", path)
+    return path
+
+def delete_state(session, storage, bucket_name, name):
+    if storage == "s3":
+        get_client(session, 's3', AWS_REGION).delete_object(Bucket=bucket_name, Key=f"{WATERMARK_STATE_PREFIX}/{name}.json")
+    elif os.path.exists(state_path(bucket_name, name)):
+        os.remove(state_path(bucket_name, name))
+
+def load_watermark_state(session, rds_info, bucket_name, table_name):
+    return load_state(session, rds_info.get('watermark_state', 'local'), bucket_name, table_name)
+
+def save_watermark_state(session, rds_info, bucket_name, table_name, state):
+    location = save_state(session, rds_info.get('watermark_state', 'local'), bucket_name, table_name, state)
+    logger.info(f"Saved watermark {state['watermark']} to {location}")
+
+def get_high_water_mark(conn, table_name, watermark_column, last_watermark):
+    """Return the largest watermark value newer than last_watermark, or None if there is none."""
+    expr = quote_ident(watermark_column, conn)
+    with conn.cursor() as cur:
+        if last_watermark is None:
+            cur.execute(f"SELECT max({expr}) FROM {table_name}")
+        else:
+            # The stored watermark is text; Postgres casts it to the column type
+            cur.execute(f"SELECT max({expr}) FROM {table_name} WHERE {expr} > %s", (last_watermark,))
+        return cur.fetchone()[0]
+
+def list_local_files(directory):
+    return sorted(os.path.join(root, name) for root, _, names in os.walk(directory) for name in names)
+
+def plan_checkpointed_export(rds_info, table_name, batch_size):
+    """
+    New export manifest: the chunks the table is exported in, the fixed Arrow
+    schema and the hidden prefix under <table>/ the parts are uploaded to.
+    """
+    workers = int(rds_info.get('workers', DEFAULT_PARALLEL_WORKERS))
+    chunk_size = int(float(rds_info.get('checkpoint_chunk_mb', DEFAULT_CHECKPOINT_CHUNK_MB)) * 1024 * 1024)
+    conn = connect_to_postgres(rds_info)
+    try:
+        with conn.cursor() as cur:
+            split_column, ranges = plan_split_ranges(cur, rds_info, table_name, workers, chunk_size)
+            schema = fixed_export_schema(cur, rds_info, table_name, batch_size)
+    finally:
+        conn.close()
+    export_id = time.strftime('%Y%m%d%H%M%S')
+    return {
+        "table": table_name,
+        "export_id": export_id,
+        # Athena skips directories starting with "_", so the parts stay
+        # invisible until the Glue table is pointed at them
+        "prefix": f"{table_name}/_export_{export_id}/",
+        "split": split_column or "ctid",
+        "schema": base64.b64encode(schema.serialize().to_pybytes()).decode('ascii'),
+        "chunks": [
+            {"part": f"part-{i:05d}.parquet", "where": where, "params": list(params), "status": "pending"}
+            for i, (where, params) in enumerate(ranges)
+        ],
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S")
+    }
+
+def export_table_checkpointed(rds_info, table_name, bucket_name, session):
+    """
+    Export the table in chunks whose progress is recorded in a manifest, so
+    a failed run can be resumed: rerunning skips finished chunks, uploads
+    chunk files that were written but not uploaded, and resumes unfinished
+    multipart uploads. Returns (columns, location, keys); the new data only
+    becomes visible once the Glue table location is switched to location.
+    """
+    if rds_info.get('watermark_column') or rds_info.get('partition_columns'):
+        fail_fast("checkpoint cannot be combined with watermark_column or partition_columns")
+    if rds_info.get('split_strategy') == "ctid":
+        # Chunks finished in different runs are read from different
+        # snapshots, and page ranges move when rows are updated
+        fail_fast("checkpoint requires split_strategy pk or column")
+    if rds_info.get('upload_mode') == "stream":
+        logger.warning(f"Checkpointed export of {table_name} is staged locally, ignoring upload_mode stream")
+    storage = rds_info.get('checkpoint_state', 'local')
+    if storage not in WATERMARK_STATES:
+        fail_fast(f"Unknown checkpoint_state {storage}, expected one of {', '.join(WATERMARK_STATES)}")
+    extract_engine = rds_info.get('extract_engine', 'cursor')
+    if extract_engine not in EXTRACT_ENGINES:
+        fail_fast(f"Unknown extract_engine {extract_engine}, expected one of {', '.join(EXTRACT_ENGINES)}")
+    start_time = time.time()
+    batch_size = int(rds_info.get('batch_size', DEFAULT_BATCH_SIZE))
+    workers = int(rds_info.get('workers', DEFAULT_PARALLEL_WORKERS))
+    manifest_name = f"{table_name}{EXPORT_MANIFEST_SUFFIX}"
+    s3 = get_client(session, 's3', AWS_REGION)
+    lock = threading.Lock()
+
+    def update(chunk, **changes):
+        # Chunks are updated from worker results and upload threads alike
+        with lock:
+            chunk.update(changes)
+            save_state(session, storage, bucket_name, manifest_name, manifest)
+
+    try:
+        manifest = load_state(session, storage, bucket_name, manifest_name)
+        if manifest:
+            done = sum(1 for chunk in manifest['chunks'] if chunk['status'] == "done")
+            logger.info(f"Resuming export {manifest['export_id']} of {table_name}: {done} of {len(manifest['chunks'])} chunks done")
+        else:
+            manifest = plan_checkpointed_export(rds_info, table_name, batch_size)
+            location = save_state(session, storage, bucket_name, manifest_name, manifest)
+            logger.info(f"Planned export {manifest['export_id']} of {table_name} in {len(manifest['chunks'])} chunks "
+                        f"split by {manifest['split']}, manifest saved to {location}")
+        schema = pa.ipc.read_schema(pa.py_buffer(base64.b64decode(manifest['schema'])))
+        prefix = manifest['prefix']
+        # Kept across runs so written chunks can be uploaded on resume; the
+        # bucket keeps customers with the same table names apart
+        staging_dir = os.path.join(tempfile.gettempdir(), f"cymballic-{bucket_name}",
+                                   f"{table_name}-export-{manifest['export_id']}")
+        os.makedirs(staging_dir, exist_ok=True)
+
+        def upload_chunk(chunk):
+            local_path = f"{staging_dir}/{chunk['part']}"
+            upload_file_resumable(s3, local_path, bucket_name, f"{prefix}{chunk['part']}", rds_info, chunk.get('upload_id'),
+                                  on_create=lambda upload_id: update(chunk, upload_id=upload_id))
+            update(chunk, status="done", upload_id=None)
+            os.remove(local_path)
+            logger.info(f"Uploaded chunk {chunk['part']} of {table_name} to s3://{bucket_name}/{prefix}{chunk['part']}")
+
+        def staged(chunk):
+            local_path = f"{staging_dir}/{chunk['part']}"
+            return chunk['status'] == "written" and os.path.exists(local_path) and os.path.getsize(local_path) == chunk['size']
+
+        pending = [chunk for chunk in manifest['chunks'] if chunk['status'] != "done"]
+        to_upload = [chunk for chunk in pending if staged(chunk)]
+        to_export = [chunk for chunk in pending if not staged(chunk)]
+        for chunk in to_export:
+            if chunk.get('upload_id'):
+                # The chunk is read again, so parts of its old file are useless
+                try:
+                    s3.abort_multipart_upload(Bucket=bucket_name, Key=f"{prefix}{chunk['part']}", UploadId=chunk['upload_id'])
+                except ClientError as e:
+                    logger.warning(f"Could not abort multipart upload {chunk['upload_id']}: {str(e)}")
+                update(chunk, upload_id=None)
+        logger.info(f"Exporting {len(to_export)} and uploading {len(to_upload)} remaining chunks of {table_name}")
+
+        # A failing chunk does not stop the others, so the next run has less to do
+        errors = []
+        with ThreadPoolExecutor(max_workers=int(rds_info.get('upload_concurrency', DEFAULT_UPLOAD_CONCURRENCY))) as uploads, \
+                export_process_pool(workers) as pool:
+            upload_futures = [uploads.submit(upload_chunk, chunk) for chunk in to_upload]
+            futures = {
+                pool.submit(export_range_worker, rds_info, table_name, chunk['where'], chunk['params'], None,
+                            f"{staging_dir}/{chunk['part']}", batch_size, schema): chunk
+                for chunk in to_export
+            }
+            for future in as_completed(futures):
+                chunk = futures[future]
+                try:
+                    part_name, row_count, worker_metrics = future.result()
+                except Exception as e:
+                    errors.append(f"chunk {chunk['part']}: {str(e)}")
+                    continue
+                metrics.merge(worker_metrics)
+                update(chunk, status="written", rows=row_count, size=os.path.getsize(f"{staging_dir}/{part_name}"))
+                logger.info(f"Finished chunk {part_name} of {table_name} with {row_count} rows")
+                upload_futures.append(uploads.submit(upload_chunk, chunk))
+            for future in upload_futures:
+                try:
+                    future.result()
+                except Exception as e:
+                    errors.append(str(e))
+        if errors:
+            fail_fast(f"Checkpointed export of {table_name} stopped with {len(errors)} failed chunks, rerun to resume: "
+                      f"{'; '.join(errors[:5])}")
+    except Exception as e:
+        fail_fast(f"Checkpointed export of {table_name} failed, rerun to resume: {str(e)}")
+    shutil.rmtree(staging_dir, ignore_errors=True)
+
+    row_count = sum(chunk.get('rows', 0) for chunk in manifest['chunks'])
+    elapsed_time = time.time() - start_time
+    logger.info(f"Exported {row_count} rows of {table_name} to s3://{bucket_name}/{prefix} in "
+                f"{int(elapsed_time/60)}m {int(elapsed_time%60)}s, peak RSS {peak_rss_mb():.0f} MB")
+    keys = [f"{prefix}{chunk['part']}" for chunk in manifest['chunks']]
+    return glue_columns_from_arrow_schema(schema), f"s3://{bucket_name}/{prefix}", keys
+
+def staging_directory(bucket_name, table_name):
+    """New directory of its own for staging one export before the upload."""
+    return tempfile.mkdtemp(prefix=f"cymballic-{bucket_name}-{table_name}-")
+
+def publish_checkpointed_export(session, rds_info, bucket_name, table_name, keys):
+    """
+    Once the Glue table points at the new export, remove the files of
+    earlier exports and the manifest.
+    """
+    s3 = get_client(session, 's3', AWS_REGION)
+    try:
+        remove_stale_objects(s3, bucket_name, f"{table_name}/", set(keys))
+        delete_state(session, rds_info.get('checkpoint_state', 'local'), bucket_name, f"{table_name}{EXPORT_MANIFEST_SUFFIX}")
+    except Exception as e:
+        fail_fast(f"Published {table_name} but failed to clean up earlier exports: {str(e)}")
+    try:
+        report_parquet_layout(s3, bucket_name, table_name, keys)
+    except Exception as e:
+        logger.warning(f"Could not report the Parquet layout of {table_name}: {str(e)}")
+
+def export_table_to_s3_parquet(rds_info, table_name, bucket_name, session):
+    start_time = time.time()
+    export_mode = rds_info.get('export_mode', 'pandas')
+    if export_mode not in EXPORT_MODES:
+        fail_fast(f"Unknown export_mode {export_mode}, expected one of {', '.join(EXPORT_MODES)}")
+    upload_mode = rds_info.get('upload_mode', 'file')
+    if upload_mode not in UPLOAD_MODES:
+        fail_fast(f"Unknown upload_mode {upload_mode}, expected one of {', '.join(UPLOAD_MODES)}")
+    stream = upload_mode == "stream"
+    batch_size = int(rds_info.get('batch_size', DEFAULT_BATCH_SIZE))
+    extract_engine = rds_info.get('extract_engine', 'cursor')
+    if extract_engine not in EXTRACT_ENGINES:
+        fail_fast(f"Unknown extract_engine {extract_engine}, expected one of {', '.join(EXTRACT_ENGINES)}")
+    try:
+        layout = ParquetLayout(rds_info)
+    except ValueError as e:
+        fail_fast(str(e))
+
+    # Incremental exports only read rows past the stored high-water mark and
+    # add them as new files next to the ones already under <table>/
+    watermark_column = rds_info.get('watermark_column')
+    state = None
+    high_water_mark = None
+    where = "TRUE"
+    params = []
+    file_stem = table_name
+    if watermark_column:
+        if rds_info.get('watermark_state', 'local') not in WATERMARK_STATES:
+            fail_fast(f"Unknown watermark_state {rds_info['watermark_state']}, expected one of {', '.join(WATERMARK_STATES)}")
+        try:
+            state = load_watermark_state(session, rds_info, bucket_name, table_name)
+        except Exception as e:
+            fail_fast(f"Failed to load watermark state for {table_name}: {str(e)}")
+        last_watermark = state.get('watermark') if state else None
+        conn = connect_to_postgres(rds_info)
+        try:
+            high_water_mark = get_high_water_mark(conn, table_name, watermark_column, last_watermark)
+            expr = quote_ident(watermark_column, conn)
+        except Exception as e:
+            fail_fast(f"Failed to read watermark column {watermark_column} of {table_name}: {str(e)}")
+        finally:
+            conn.close()
+        if state and high_water_mark is None:
+            logger.info(f"No rows in {table_name} newer than {watermark_column} {last_watermark}, nothing to export")
+            return state.get('columns')
+        if high_water_mark is not None:
+            if last_watermark is None:
+                where, params = f"{expr} <= %s OR {expr} IS NULL", [high_water_mark]
+            else:
+                where, params = f"{expr} > %s AND {expr} <= %s", [last_watermark, high_water_mark]
+        file_stem = f"{table_name}-{time.strftime('%Y%m%d%H%M%S')}"
+        logger.info(f"Incremental export of {table_name} for {watermark_column} in ({last_watermark}, {high_water_mark}]")
+
+    partition_columns = rds_info.get('partition_columns') or []
+    if partition_columns and stream:
+        # One multipart upload per partition would hold too many buffers in memory
+        logger.warning(f"Partitioned export of {table_name} is staged locally, ignoring upload_mode stream")
+        stream = False
+
+    # Other processes (e.g. fleet.py onboarding customers with the same
+    # table names) stage their exports at the same time, so every export gets
+    # its own directory
+    parquet_dir = staging_directory(bucket_name, table_name)
+    # (local path, S3 key) of every file staged in parquet_dir, and S3 keys
+    # of every file written by this export
+    uploads = []
+    table_keys = []
+    try:
+        if partition_columns:
+            # Files land in <col>=<value>/ directories under the staging
+            # directory, which is uploaded as a whole
+            destination = parquet_dir
+            logger.info(f"Partitioning {table_name} by {', '.join(partition_columns)}")
+        if export_mode == "parallel":
+            columns, parts = export_table_parallel(rds_info, table_name, parquet_dir, batch_size,
+                                                   bucket_name if stream else None, where, params,
+                                                   part_prefix=f"{file_stem}-part" if watermark_column else "part")
+            row_count = sum(rows for _, rows in parts)
+            table_keys = [f"{table_name}/{part_name}" for part_name, _ in parts]
+            if not stream:
+                uploads = [(f"{parquet_dir}/{part_name}", f"{table_name}/{part_name}") for part_name, _ in parts]
+            destination = f"s3://{bucket_name}/{table_name}/" if stream else parquet_dir
+        else:
+            parquet_path = f"{parquet_dir}/{file_stem}.parquet"
+            s3_key = f"{table_name}/{file_stem}.parquet"
+            table_keys = [s3_key]
+            if not stream:
+                uploads = [(parquet_path, s3_key)]
+            destination = f"s3://{bucket_name}/{s3_key}" if stream else parquet_path
+            if partition_columns:
+                parquet_path = destination = parquet_dir
+            conn = connect_to_postgres(rds_info)
+            try:
+                with conn.cursor() as cur:
+                    schema, select_list = table_export_schema(cur, table_name)
+                query = f"SELECT {select_list} FROM {table_name} WHERE {where}{layout.order_by(conn)};"
+                sink = open_s3_stream(session, bucket_name, s3_key, rds_info) if stream else nullcontext(parquet_path)
+                with sink as target:
+                    if export_mode == "streaming" or extract_engine == "copy":
+                        logger.info(f"Streaming table {table_name} with the {extract_engine} engine")
+                        columns, row_count = write_parquet_query(conn, rds_info, query, target, batch_size, params=params,
+                                                                 schema=schema, partition_columns=partition_columns,
+                                                                 file_name=f"{file_stem}.parquet", layout=layout)
+                    else:
+                        with metrics.stage("query"):
+                            # numeric values stay Decimal for the decimal128 columns of the schema
+                            df = pd.read_sql(query, conn, params=params, coerce_float=False)
+                        row_count = len(df)
+                        metrics.add("query", rows=row_count)
+                        with metrics.stage("encode"):
+                            if schema is None:
+                                schema = arrow_schema_from_frame(df)
+                            table = pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+                            columns = glue_columns_from_arrow_schema(schema)
+                            writer = open_parquet_writer(target, table.schema, partition_columns, f"{file_stem}.parquet", layout)
+                            try:
+                                writer.write_table(table)
+                            finally:
+                                writer.close()
+                        metrics.add("encode", rows=row_count)
+            finally:
+                conn.close()
+        if partition_columns:
+            uploads = [(path, f"{table_name}/{os.path.relpath(path, parquet_dir)}") for path in list_local_files(parquet_dir)]
+            table_keys = [s3_key for _, s3_key in uploads]
         os.makedirs("out", exist_ok=True)
         elapsed_time = time.time() - start_time
-        logger.info(f"Exported data from table {table_name} to {parquet_path} in {int(elapsed_time/60)}m {int(elapsed_time%60)}s.")
+        logger.info(f"Exported data from table {table_name} to {destination} in {int(elapsed_time/60)}m {int(elapsed_time%60)}s.")
+        logger.info(f"Exported {row_count} rows at {row_count / max(elapsed_time, 1e-6):.0f} rows/s, peak RSS {peak_rss_mb():.0f} MB")
     except Exception as e:
+        shutil.rmtree(parquet_dir, ignore_errors=True)
         fail_fast(f"Failed to export data: {str(e)}")
-    finally:
-        conn.close()
 
-    s3 = session.client('s3', region_name=AWS_REGION)
-    s3_key = f"{table_name}/{table_name}.parquet"
+    s3 = get_client(session, 's3', AWS_REGION)
     upload_start = time.time()
     try:
-        s3.upload_file(parquet_path, bucket_name, s3_key)
+        for local_path, s3_key in uploads:
+            with metrics.stage("upload", table_name):
+                s3.upload_file(local_path, bucket_name, s3_key)
+            metrics.add("upload", table_name, bytes=os.path.getsize(local_path))
+            logger.info(f"Uploaded {local_path} to s3://{bucket_name}/{s3_key}")
+        # Earlier increments stay; only a full export replaces what is there
+        if not state:
+            remove_stale_objects(s3, bucket_name, f"{table_name}/", set(table_keys))
         upload_time = time.time() - upload_start
-        logger.info(f"Uploaded data to s3://{bucket_name}/{s3_key} in {int(upload_time/60)}m {int(upload_time%60)}s")
+        if uploads:
+            logger.info(f"Uploaded data to s3://{bucket_name}/{table_name}/ in {int(upload_time/60)}m {int(upload_time%60)}s")
     except Exception as e:
         fail_fast(f"Failed to upload file to S3: {str(e)}")
+    finally:
+        shutil.rmtree(parquet_dir, ignore_errors=True)
+
+    try:
+        report_parquet_layout(s3, bucket_name, table_name, table_keys)
+    except Exception as e:
+        logger.warning(f"Could not report the Parquet layout of {table_name}: {str(e)}")
+
+    if watermark_column:
+        # Only advance the watermark once the new files are in place
+        state = {
+            "watermark_column": watermark_column,
+            "watermark": str(high_water_mark) if high_water_mark is not None else None,
+            "columns": columns,
+            "updated": time.strftime("%Y-%m-%dT%H:%M:%S")
+        }
+        try:
+            save_watermark_state(session, rds_info, bucket_name, table_name, state)
+        except Exception as e:
+            fail_fast(f"Exported {table_name} but failed to save watermark state: {str(e)}")
 
     return columns
 
+def report_parquet_layout(s3, bucket_name, table_name, keys):
+    """
+    Log the row-group layout of the files just written, read back from their
+    footers, and save the per-file statistics to out/<table>-layout.json.
+    """
+    keys = set(keys)
+    if not keys:
+        return
+    # The directory holding all of them, e.g. the _export_<id>/ of a checkpointed export
+    prefix = posixpath.commonpath([posixpath.dirname(key) for key in keys]) + "/"
+    objects = [(key, size) for key, size in list_table_objects(s3, bucket_name, table_name, prefix) if key in keys]
+    files = [parquet_file_stats(read_s3_parquet_metadata(s3, bucket_name, key, size), key, size)
+             for key, size in objects[:LAYOUT_REPORT_MAX_FILES]]
+    if not files:
+        return
+    rows = sum(f['rows'] for f in files)
+    row_groups = sum(f['row_groups'] for f in files)
+    compressed = sum(f['compressed_bytes'] for f in files)
+    uncompressed = sum(f['uncompressed_bytes'] for f in files)
+    codecs = sorted({codec for f in files for codec in f['codecs']})
+    logger.info(f"Parquet layout of {table_name}: {len(files)} files, {rows} rows in {row_groups} row groups "
+                f"(avg {rows // max(row_groups, 1)} rows, {compressed / max(row_groups, 1) / 1024 / 1024:.1f} MB), "
+                f"{compressed / 1024 / 1024:.1f} MB compressed from {uncompressed / 1024 / 1024:.1f} MB with {', '.join(codecs)}")
+    os.makedirs("out", exist_ok=True)
+    report_path = f"out/{table_name}-layout.json"
+    with open(report_path, "w") as f:
+        json.dump({"table": table_name, "files": files}, f, indent=2)
+    logger.info(f"Parquet layout report saved to {report_path}")
+
+def list_table_data_objects(s3, bucket_name, table_name, prefix=None):
+    # Files Athena would read with the table location at prefix (default <table_name>/)
+    return list_data_objects(s3, bucket_name, prefix or f"{table_name}/")
+
+def list_table_objects(s3, bucket_name, table_name, prefix=None):
+    """Return (key, size) of the data files under s3://<bucket_name>/<table_name>/ (or prefix), sorted by key."""
+    return sorted((obj['Key'], obj['Size']) for obj in list_table_data_objects(s3, bucket_name, table_name, prefix))
+
 def verify_parquet_exists(session, bucket_name, table_name):
-    s3 = session.client('s3', region_name=AWS_REGION)
+    """Fingerprints of the data files under the table prefix by key; fails if there are none."""
+    s3 = get_client(session, 's3', AWS_REGION)
     try:
-        s3.head_object(Bucket=bucket_name, Key=f"{table_name}/{table_name}.parquet")
-        logger.info(f"Verified parquet file exists at s3://{bucket_name}/{table_name}/{table_name}.parquet")
-        return True
-    except ClientError:
-        fail_fast(f"Parquet file not found at s3://{bucket_name}/{table_name}/{table_name}.parquet")
+        fingerprints = {obj['Key']: object_fingerprint(obj) for obj in list_table_data_objects(s3, bucket_name, table_name)}
+    except ClientError as e:
+        fail_fast(f"Could not list s3://{bucket_name}/{table_name}/: {str(e)}")
+    if not fingerprints:
+        fail_fast(f"Parquet file not found under s3://{bucket_name}/{table_name}/")
+    logger.info(f"Verified {len(fingerprints)} parquet file(s) exist under s3://{bucket_name}/{table_name}/")
+    return dict(sorted(fingerprints.items()))
 
-def create_glue_table(session, database_name, table_name, bucket_name, columns=None):
-    glue = session.client('glue', region_name=AWS_REGION)
-    
-    # Create database if it doesn't exist
+def open_fingerprint_cache(options, name=FINGERPRINT_CACHE_NAME):
+    store = options.get('fingerprint_cache', 'local')
+    if store == "none":
+        return None
+    if store == "s3":
+        # The cache lives in the main account's metadata bucket
+        cymballic_config = load_cymballic_config()
+        session = get_session(cymballic_config['aws_account_profile'])
+        return FingerprintCache(store, get_client(session, 's3', AWS_REGION), cymballic_config['s3_bucket'], name)
+    return FingerprintCache(store, name=name)
+
+def cached_footer_columns(s3, bucket_name, fingerprints, entry):
+    """
+    Glue columns merged from the footers of the first files of the table,
+    reusing the schemas cached for files whose fingerprint is unchanged.
+    Returns the columns and the schemas to cache, or (None, {}) if a footer
+    cannot be read.
+    """
+    cached = entry.get('schemas', {})
+    schemas = {}
+    try:
+        for key, fingerprint in list(fingerprints.items())[:DEFAULT_SCHEMA_SAMPLE_FILES]:
+            if cached.get(key, {}).get('fingerprint') == fingerprint:
+                schemas[key] = cached[key]
+                continue
+            metadata = read_s3_parquet_metadata(s3, bucket_name, key, fingerprint['size'])
+            schemas[key] = {"fingerprint": fingerprint, "schema": serialize_schema(metadata.schema.to_arrow_schema())}
+        merged = merge_arrow_schemas(deserialize_schema(item['schema']) for item in schemas.values())
+        return glue_columns_from_arrow_schema(merged), schemas
+    except Exception as e:
+        logger.info(f"Could not read schema from parquet footers: {str(e)}")
+        return None, {}
+
+def ensure_glue_database(session, database_name):
+    glue = get_client(session, 'glue', AWS_REGION)
+
+    try:
+        glue.get_database(Name=database_name)
+        logger.info(f"Glue database {database_name} already exists")
+        return
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'EntityNotFoundException':
+            fail_fast(f"Failed to read Glue database {database_name}: {str(e)}")
+
+    # Another run may create it in the meantime
     try:
         glue.create_database(DatabaseInput={'Name': database_name})
         logger.info(f"Created Glue database {database_name}")
@@ -141,31 +1138,55 @@ def create_glue_table(session, database_name, table_name, bucket_name, columns=N
             fail_fast(f"Failed to create Glue database: {str(e)}")
         logger.info(f"Glue database {database_name} already exists")
 
-    def read_schema_using_pandas(bucket_name, table_name):
-        # TODO is the best way to infer schema actually?
-        # pyarrow? pandas? fastparquet
-        # pyarrow/fastparquet appears to be using schema; pandas analyzing it
+def split_partition_keys(columns, partition_columns):
+    """
+    Separate the partition columns from the data columns. Partition columns
+    that are not among the columns (e.g. not stored in the files) are strings.
+    """
+    types = {column['Name']: column['Type'] for column in columns or []}
+    partition_keys = [{"Name": name, "Type": types.get(name, "string")} for name in partition_columns]
+    if columns is not None:
+        columns = [column for column in columns if column['Name'] not in partition_columns]
+    return columns, partition_keys
+
+def partition_projection_parameters(projection):
+    """
+    Athena partition projection table parameters from per-column settings,
+    e.g. {"dt": {"type": "date", "range": "2020-01-01,NOW", "format": "yyyy-MM-dd"}}.
+    """
+    parameters = {"projection.enabled": "true"}
+    for column, settings in projection.items():
+        for name, value in settings.items():
+            parameters[f"projection.{column}.{name}"] = str(value)
+    return parameters
+
+def create_glue_table(session, database_name, table_name, bucket_name, columns=None, partition_keys=None, parameters=None,
+                      location=None):
+    glue = get_client(session, 'glue', AWS_REGION)
+    s3 = get_client(session, 's3', AWS_REGION)
+
+    def read_schema_from_footers(objects):
+        # Only the Parquet footers are fetched, with ranged GETs, so this
+        # costs a few KB per file regardless of the file size
         try:
-            s3_path = f"s3://{bucket_name}/{table_name}/{table_name}.parquet"
-            logger.info(f"Attempting to read schema using pandas from {s3_path}")
-            df = pd.read_parquet(s3_path)
-            column_types = df.dtypes.apply(lambda x: str(x)).to_dict()
-            columns = [{"Name": col, "Type": "string" if "object" in typ else "double" if "float" in typ else "bigint" if "int" in typ else "string"} 
-                      for col, typ in column_types.items()]
-            logger.info("Successfully inferred schema using pandas")
+            schemas = []
+            for key, size in objects[:DEFAULT_SCHEMA_SAMPLE_FILES]:
+                logger.info(f"Attempting to read schema from the footer of s3://{bucket_name}/{key}")
+                schemas.append(read_s3_parquet_metadata(s3, bucket_name, key, size).schema.to_arrow_schema())
+            columns = glue_columns_from_arrow_schema(merge_arrow_schemas(schemas))
+            logger.info(f"Successfully inferred schema from {len(schemas)} parquet footer(s)")
             return columns
         except Exception as e:
-            logger.info(f"Could not read schema using pandas: {str(e)}")
+            logger.info(f"Could not read schema from parquet footers: {str(e)}")
             return None
 
-    def read_schema_using_boto3(bucket_name, table_name):
+    def read_schema_using_boto3(key):
         try:
-            s3 = session.client('s3')
             # TODO find where this is not the case and why
-            logger.info(f"Attempting to read schema using boto3 select_object_content from s3://{bucket_name}/{table_name}/{table_name}.parquet")
+            logger.info(f"Attempting to read schema using boto3 select_object_content from s3://{bucket_name}/{key}")
             response = s3.select_object_content(
                 Bucket=bucket_name,
-                Key=f"{table_name}/{table_name}.parquet",
+                Key=key,
                 ExpressionType='SQL',
                 Expression='SELECT * FROM s3object LIMIT 1',
                 InputSerialization={'Parquet': {}},
@@ -175,53 +1196,139 @@ def create_glue_table(session, database_name, table_name, bucket_name, columns=N
             for event in response['Payload']:
                 if 'Records' in event:
                     record = json.loads(event['Records']['Payload'].decode('utf-8'))
-                    columns = [{"Name": col, "Type": "string"} for col in record.keys()]
+                    columns = [{"Name": col, "Type": glue_type_from_value(value)} for col, value in record.items()]
                     logger.info("Successfully inferred schema using boto3")
                     return columns
         except Exception as e:
             logger.info(f"Could not read schema using boto3: {str(e)}")
             return None
 
+    try:
+        existing = glue.get_table(DatabaseName=database_name, Name=table_name)['Table']
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'EntityNotFoundException':
+            fail_fast(f"Failed to read Glue table {table_name}: {str(e)}")
+        existing = None
+
     # If columns not provided, infer from existing parquet file
     if not columns:
-        columns = read_schema_using_pandas(bucket_name, table_name)
-        if not columns:
-            columns = read_schema_using_boto3(bucket_name, table_name)
-        if not columns:
-            logger.info("Could not read schema using pandas or boto3 (this is expected in cross-account setups). Creating table with empty schema to let Glue infer it.")
-            columns = []
+        with metrics.stage("schema_inference", table_name):
+            try:
+                objects = list_table_objects(s3, bucket_name, table_name)
+            except ClientError as e:
+                logger.info(f"Could not list s3://{bucket_name}/{table_name}/: {str(e)}")
+                objects = []
+            if objects:
+                columns = read_schema_from_footers(objects)
+                if not columns:
+                    columns = read_schema_using_boto3(objects[0][0])
+            if not columns and existing:
+                logger.info(f"Could not read schema from parquet footers or boto3, keeping the columns of Glue table {table_name}")
+                columns = existing.get('StorageDescriptor', {}).get('Columns', [])
+            if not columns:
+                logger.info("Could not read schema from parquet footers or boto3 (this is expected in cross-account setups). Creating table with empty schema to let Glue infer it.")
+                columns = []
+        # Glue rejects a partition key that is also a column
+        partition_names = {key['Name'] for key in partition_keys or []}
+        columns = [column for column in columns if column['Name'] not in partition_names]
 
     table_input = {
         "Name": table_name,
-        "StorageDescriptor": {
-            "Columns": columns,
-            "Location": f"s3://{bucket_name}/{table_name}/",
-            "InputFormat": "org.apache.hadoop.hive.ql.io.parquet.MapredParquetInputFormat",
-            "OutputFormat": "org.apache.hadoop.hive.ql.io.parquet.MapredParquetOutputFormat",
-            "Compressed": True,
-            "SerdeInfo": {
-                "SerializationLibrary": "org.apache.hadoop.hive.ql.io.parquet.serde.ParquetHiveSerDe",
-                "Parameters": {}
-            }
-        },
+        "StorageDescriptor": parquet_storage_descriptor(columns, location or f"s3://{bucket_name}/{table_name}/"),
+        "PartitionKeys": partition_keys or [],
         "TableType": "EXTERNAL_TABLE"
     }
+    if parameters:
+        table_input["Parameters"] = parameters
 
+    # Only call Glue when the table is missing or differs, and update it in
+    # place so it stays queryable
     try:
-        glue.create_table(DatabaseName=database_name, TableInput=table_input)
-        logger.info(f"Created Glue table {table_name}")
+        if existing is None:
+            glue.create_table(DatabaseName=database_name, TableInput=table_input)
+            logger.info(f"Created Glue table {table_name}")
+            return table_input
+        changes = glue_table_changes(existing, table_input)
+        if not changes:
+            logger.info(f"Glue table {table_name} is up to date")
+            return table_input
+        glue.update_table(DatabaseName=database_name, TableInput=merge_table_input(existing, table_input),
+                          SkipArchive=True)
+        logger.info(f"Updated {', '.join(changes)} of Glue table {table_name}")
+        return table_input
     except ClientError as e:
-        if 'AlreadyExistsException' in str(e):
-            glue.update_table(DatabaseName=database_name, TableInput=table_input)
-            logger.info(f"Updated existing Glue table {table_name}")
-        else:
-            fail_fast(f"Failed to create/update Glue table: {str(e)}")
+        fail_fast(f"Failed to create/update Glue table: {str(e)}")
+
+def partition_values_from_key(relative_key, partition_names):
+    """Partition directory and values of a key like dt=2024-01-01/part.parquet, or None."""
+    directories = relative_key.split("/")[:-1]
+    if len(directories) < len(partition_names):
+        return None
+    values = []
+    for directory, name in zip(directories, partition_names):
+        column, _, value = directory.partition("=")
+        if column != name:
+            return None
+        values.append(unquote(value))
+    return "/".join(directories[:len(partition_names)]), values
+
+def register_glue_partitions(session, database_name, table_name, bucket_name, columns, partition_keys):
+    """
+    Register every <col>=<value>/ directory under the table prefix as a Glue
+    partition, in batches of GLUE_PARTITION_BATCH_SIZE. Existing partitions
+    are listed first and left alone, so a rerun only creates new ones.
+    """
+    s3 = get_client(session, 's3', AWS_REGION)
+    glue = get_client(session, 'glue', AWS_REGION)
+    partition_names = [key['Name'] for key in partition_keys]
+
+    partitions = {}
+    for key, _ in list_table_objects(s3, bucket_name, table_name):
+        found = partition_values_from_key(key[len(table_name) + 1:], partition_names)
+        if found:
+            directory, values = found
+            partitions[directory] = values
+    if not partitions:
+        logger.info(f"No partitions found under s3://{bucket_name}/{table_name}/")
+        return
+
+    existing = set()
+    try:
+        paginator = glue.get_paginator('get_partitions')
+        for page in paginator.paginate(DatabaseName=database_name, TableName=table_name, ExcludeColumnSchema=True):
+            existing.update(tuple(partition['Values']) for partition in page['Partitions'])
+    except ClientError as e:
+        fail_fast(f"Failed to list partitions of {table_name}: {str(e)}")
+    missing = {directory: values for directory, values in partitions.items() if tuple(values) not in existing}
+    if not missing:
+        logger.info(f"All {len(partitions)} partitions of Glue table {table_name} are registered")
+        return
+
+    if columns is None:
+        columns = glue.get_table(DatabaseName=database_name, Name=table_name)['Table']['StorageDescriptor']['Columns']
+    partition_inputs = [
+        {"Values": values,
+         "StorageDescriptor": parquet_storage_descriptor(columns, f"s3://{bucket_name}/{table_name}/{directory}/")}
+        for directory, values in sorted(missing.items())
+    ]
+    created = 0
+    for i in range(0, len(partition_inputs), GLUE_PARTITION_BATCH_SIZE):
+        batch = partition_inputs[i:i + GLUE_PARTITION_BATCH_SIZE]
+        try:
+            response = glue.batch_create_partition(DatabaseName=database_name, TableName=table_name,
+                                                   PartitionInputList=batch)
+        except ClientError as e:
+            fail_fast(f"Failed to register partitions of {table_name}: {str(e)}")
+        errors = [error for error in response.get('Errors', [])
+                  if error['ErrorDetail']['ErrorCode'] != 'AlreadyExistsException']
+        if errors:
+            fail_fast(f"Failed to register {len(errors)} partitions of {table_name}: {errors[0]['ErrorDetail']['ErrorMessage']}")
+        created += len(batch) - len(response.get('Errors', []))
+    logger.info(f"Registered {created} new of {len(partitions)} partitions for Glue table {table_name}")
 
 def setup_permissions(session, source_account_id, database_name, bucket_name):
     cymballic_config = load_cymballic_config()
-    timestamp = time.strftime("%Y%m%d_%H%M")
-    log_dir = f"log/run_{timestamp}"
-    os.makedirs(log_dir, exist_ok=True)
+    log_dir = run_log_dir()
 
     def save_policy(policy_dict, policy_name):
         policy_file = f"{log_dir}/{policy_name}.json"
@@ -231,7 +1338,7 @@ def setup_permissions(session, source_account_id, database_name, bucket_name):
     target_service_role = cymballic_config.get('iam_service_role')
     target_sso_role = cymballic_config.get("iam_sso_role")
 
-    s3 = session.client('s3', region_name=AWS_REGION)
+    s3 = get_client(session, 's3', AWS_REGION)
 
     bucket_policy = {
         "Version": "2012-10-17",
@@ -253,14 +1360,23 @@ def setup_permissions(session, source_account_id, database_name, bucket_name):
     save_policy(bucket_policy, f"s3_bucket_policy_{bucket_name}")
 
     try:
-        s3.put_bucket_policy(Bucket=bucket_name, Policy=json.dumps(bucket_policy))
-        logger.info(f"Updated bucket policy for {bucket_name}")
+        try:
+            current_policy = s3.get_bucket_policy(Bucket=bucket_name)['Policy']
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'NoSuchBucketPolicy':
+                raise
+            current_policy = None
+        if policies_equal(current_policy, bucket_policy):
+            logger.info(f"Bucket policy for {bucket_name} is up to date")
+        else:
+            s3.put_bucket_policy(Bucket=bucket_name, Policy=json.dumps(bucket_policy))
+            logger.info(f"Updated bucket policy for {bucket_name}")
     except ClientError as e:
         fail_fast(f"Failed to update bucket policy for {bucket_name}. Policy saved at {log_dir}/s3_bucket_policy_{bucket_name}.json\nError: {str(e)}")
 
 
     # Set up Glue policy
-    glue = session.client('glue', region_name=AWS_REGION)
+    glue = get_client(session, 'glue', AWS_REGION)
     target_resources = [
         f"arn:aws:glue:{AWS_REGION}:{source_account_id}:catalog",
         f"arn:aws:glue:{AWS_REGION}:{source_account_id}:database/{database_name}",
@@ -297,16 +1413,178 @@ def setup_permissions(session, source_account_id, database_name, bucket_name):
     save_policy(glue_policy, f"glue_policy_{database_name}")
 
     try:
-        glue.put_resource_policy(PolicyInJson=json.dumps(glue_policy))
-        logger.info("Updated Glue resource policy")
+        try:
+            current = glue.get_resource_policy()
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'EntityNotFoundException':
+                raise
+            current = {}
+        if policies_equal(current.get('PolicyInJson'), glue_policy):
+            logger.info("Glue resource policy is up to date")
+        else:
+            # Fail rather than overwrite a policy changed since it was read
+            condition = {"PolicyHashCondition": current['PolicyHash']} if current.get('PolicyHash') else {"PolicyExistsCondition": "NOT_EXIST"}
+            glue.put_resource_policy(PolicyInJson=json.dumps(glue_policy), **condition)
+            logger.info("Updated Glue resource policy")
     except ClientError as e:
         fail_fast(f"Failed to update Glue policy for {database_name}. Policy saved at {log_dir}/glue_policy_{database_name}.json\nError: {str(e)}")
 
+def discover_tables(config, session, bucket_name):
+    if config.get("type") == "postgres":
+        schema = config.get('schema', 'public')
+        conn = connect_to_postgres(config)
+        try:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT table_name FROM information_schema.tables
+                    WHERE table_schema = %s AND table_type = 'BASE TABLE'
+                    ORDER BY table_name
+                """, (schema,))
+                tables = [row[0] for row in cur.fetchall()]
+        finally:
+            conn.close()
+        logger.info(f"Found {len(tables)} tables in schema {schema}")
+        return tables
+
+    # parquet: every top-level prefix of the bucket is a table
+    s3 = get_client(session, 's3', AWS_REGION)
+    tables = []
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Delimiter='/'):
+        tables.extend(prefix['Prefix'].rstrip('/') for prefix in page.get('CommonPrefixes', []))
+    tables = [table for table in tables if is_data_file(table)]
+    logger.info(f"Found {len(tables)} table prefixes in s3://{bucket_name}/")
+    return tables
+
+def resolve_tables(patterns, config, session, bucket_name):
+    """
+    Expand table arguments into table names. Arguments may be comma
+    separated and may be globs; with no arguments every table is used.
+    """
+    patterns = [name.strip() for arg in patterns for name in arg.split(',') if name.strip()]
+    if patterns and not any(glob.has_magic(pattern) for pattern in patterns):
+        return list(dict.fromkeys(patterns))
+    available = discover_tables(config, session, bucket_name)
+    if not patterns:
+        return available
+    tables = []
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            tables.extend(table for table in available if fnmatch.fnmatchcase(table, pattern))
+        else:
+            tables.append(pattern)
+    return list(dict.fromkeys(tables))
+
+def onboard_table(config, table_name, database_name, bucket_name):
+    start_time = time.time()
+    session = get_session(config.get("aws_profile"))
+    options = table_options(config, table_name)
+    data_type = config.get("type")
+    columns = None
+    location = None
+    fingerprints = None
+    with metrics.stage("export", table_name):
+        if data_type == "postgres" and options.get('checkpoint'):
+            columns, location, keys = export_table_checkpointed(options, table_name, bucket_name, session)
+        elif data_type == "postgres":
+            columns = export_table_to_s3_parquet(options, table_name, bucket_name, session)
+        elif data_type == "parquet":
+            fingerprints = verify_parquet_exists(session, bucket_name, table_name)
+
+    # Parquet sources whose files and options are unchanged since the table
+    # was last registered need no footer reads and no Glue calls
+    cache = open_fingerprint_cache(options) if fingerprints else None
+    definition = {option: options.get(option) for option in ("partition_columns", "partition_projection")}
+    if cache:
+        entry = cache.load(bucket_name, table_name)
+        if (not options.get('refresh') and entry.get('table_input') and entry.get('objects') == fingerprints
+                and entry.get('options') == definition):
+            logger.info(f"Files of {table_name} are unchanged since it was registered on {entry.get('updated')}, skipping Glue")
+            return table_result(table_name, start_time, [(key, f['size']) for key, f in fingerprints.items()])
+        with metrics.stage("schema_inference", table_name):
+            columns, schemas = cached_footer_columns(get_client(session, 's3', AWS_REGION), bucket_name, fingerprints, entry)
+    columns, partition_keys = split_partition_keys(columns, options.get('partition_columns') or [])
+    projection = options.get('partition_projection')
+    parameters = partition_projection_parameters(projection) if partition_keys and projection else None
+    with metrics.stage("glue", table_name):
+        # A checkpointed export becomes visible when the location is switched
+        table_input = create_glue_table(session, database_name, table_name, bucket_name, columns, partition_keys,
+                                        parameters, location)
+        # With partition projection Athena works out the partitions itself
+        if partition_keys and not parameters:
+            register_glue_partitions(session, database_name, table_name, bucket_name, columns, partition_keys)
+    if location:
+        publish_checkpointed_export(session, options, bucket_name, table_name, keys)
+    if options.get('table_statistics', True) and table_input['StorageDescriptor']['Columns']:
+        # Statistics help Athena plan but are not needed to query the table
+        with metrics.stage("statistics", table_name):
+            try:
+                publish_table_statistics(get_client(session, 'glue', AWS_REGION), get_client(session, 's3', AWS_REGION),
+                                         database_name, table_input, open_fingerprint_cache(options, STATISTICS_CACHE_NAME),
+                                         options.get('refresh', False))
+            except Exception as e:
+                logger.warning(f"Could not publish the statistics of {table_name}: {str(e)}")
+    if fingerprints:
+        # Tables registered without columns are inferred again next time
+        if cache and table_input['StorageDescriptor']['Columns']:
+            entry = {"objects": fingerprints, "schemas": schemas, "options": definition, "table_input": table_input,
+                     "updated": time.strftime("%Y-%m-%dT%H:%M:%S")}
+            try:
+                cache.save(bucket_name, table_name, entry)
+            except Exception as e:
+                logger.warning(f"Could not save the fingerprint cache of {table_name}: {str(e)}")
+        return table_result(table_name, start_time, [(key, f['size']) for key, f in fingerprints.items()])
+    prefix = location.removeprefix(f"s3://{bucket_name}/") if location else None
+    return table_result(table_name, start_time, list_table_objects(get_client(session, 's3', AWS_REGION), bucket_name,
+                                                                   table_name, prefix))
+
+def table_result(table_name, start_time, objects):
+    return {
+        "table": table_name,
+        "status": "ok",
+        "seconds": time.time() - start_time,
+        "files": len(objects),
+        "bytes": sum(size for _, size in objects)
+    }
+
+def onboard_tables(config, tables, database_name, bucket_name, jobs):
+    """
+    Export and register tables with at most jobs running at once. A failing
+    table is reported in the results instead of stopping the others.
+    """
+    def run(table_name):
+        start_time = time.time()
+        try:
+            return onboard_table(config, table_name, database_name, bucket_name)
+        except (Exception, SystemExit) as e:
+            # fail_fast exits; within a worker that only ends this table
+            if not isinstance(e, SystemExit):
+                logger.error(f"Failed to onboard table {table_name}: {str(e)}")
+            return {"table": table_name, "status": "failed", "seconds": time.time() - start_time,
+                    "files": 0, "bytes": 0}
+
+    with ThreadPoolExecutor(max_workers=max(1, min(jobs, len(tables)))) as pool:
+        return list(pool.map(run, tables))
+
+def log_table_summary(results):
+    logger.info(SEPARATOR)
+    logger.info(f"{'Table':<40} {'Status':<8} {'Time':>8} {'Files':>6} {'Size (MB)':>10}")
+    for result in results:
+        elapsed_time = result['seconds']
+        logger.info(f"{result['table']:<40} {result['status']:<8} {int(elapsed_time/60):>4}m{int(elapsed_time%60):02d}s "
+                    f"{result['files']:>6} {result['bytes'] / 1024 / 1024:>10.1f}")
+    logger.info(SEPARATOR)
+
 def main():
     start_time = time.time()
     parser = argparse.ArgumentParser(description="Onboard data to Athena")
     parser.add_argument("-c", "--config", required=True, help="Path to JSON configuration file")
-    parser.add_argument("-t", "--table", required=True, help="Table name")
+    parser.add_argument("-t", "--table", nargs="*", default=[],
+                        help="Table names or globs, space or comma separated; all tables if omitted")
+    parser.add_argument("-s", "--schema", help="Postgres schema to find tables in (default public)")
+    parser.add_argument("-j", "--jobs", type=int, default=DEFAULT_TABLE_JOBS, help="Tables onboarded concurrently")
+    parser.add_argument("--refresh", action="store_true",
+                        help="Infer and register parquet tables even if their files are unchanged")
     args = parser.parse_args()
 
     cymballic_config = load_cymballic_config()
@@ -317,8 +1595,14 @@ def main():
             config = json.load(file)
     except Exception as e:
         fail_fast(f"Failed to load configuration: {str(e)}")
+    if args.schema:
+        config['schema'] = args.schema
+    if args.refresh:
+        config['refresh'] = True
 
     data_type = config.get("type")
+    if data_type not in ("postgres", "parquet"):
+        fail_fast(f"Unknown data type {data_type}")
 
     profile = config.get("aws_profile")
     customer = config.get("customer")
@@ -329,22 +1613,34 @@ def main():
     if not source_account_id:
         fail_fast("Could not determine AWS account ID from profile configuration")
 
+    # Per-customer setup happens once, however many tables there are
     if data_type == "postgres":
         ensure_s3_bucket(session, bucket_name)
-        columns = export_table_to_s3_parquet(config, args.table, bucket_name, session)
-        create_glue_table(session, database_name, args.table, bucket_name, columns)
-    elif data_type == "parquet":
-        verify_parquet_exists(session, bucket_name, args.table)
-        create_glue_table(session, database_name, args.table, bucket_name)
-    else:
-        fail_fast(f"Unknown data type {data_type}")
+    with metrics.stage("glue"):
+        ensure_glue_database(session, database_name)
+
+    tables = resolve_tables(args.table, config, session, bucket_name)
+    if not tables:
+        fail_fast("No tables to onboard")
+    logger.info(f"Onboarding {len(tables)} table(s): {', '.join(tables)}")
+    results = onboard_tables(config, tables, database_name, bucket_name, args.jobs)
+
+    with metrics.stage("permissions"):
+        setup_permissions(session, source_account_id, database_name, bucket_name)
+
+    log_table_summary(results)
+    failed = [result['table'] for result in results if result['status'] != "ok"]
+    if failed:
+        fail_fast(f"Failed to onboard {len(failed)} of {len(results)} tables: {', '.join(failed)}")
 
-    setup_permissions(session, source_account_id, database_name, bucket_name)
-    
     total_time = time.time() - start_time
     logger.info(f"\nData onboarding completed successfully in {int(total_time/60)}m {int(total_time%60)}s!")
     cymballic_config = load_cymballic_config()
     logger.info(f"Please run:\n1. aws sso login --profile {cymballic_config['aws_account_profile']}\n2. python update.py -c {args.config}")
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    finally:
+        # Also written when the run fails, to show how far it got
+        metrics.write_report("onboard")
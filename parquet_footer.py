@@ -0,0 +1,155 @@
+import datetime
+import struct
+from decimal import Decimal
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# A Parquet file ends with <metadata><4-byte little-endian metadata length>PAR1
+PARQUET_MAGIC = b"PAR1"
+FOOTER_TRAILER_SIZE = 8
+
+# The first ranged read takes this many bytes from the end of the object. It
+# covers the footer of most files, so they need a single request; larger
+# footers cost one more request for exactly the missing bytes.
+DEFAULT_FOOTER_READ_SIZE = 64 * 1024
+
+# Multi-file table prefixes: how many footers to read and merge
+DEFAULT_SCHEMA_SAMPLE_FILES = 3
+
+
+def read_parquet_metadata(read_range, size, initial_read_size=DEFAULT_FOOTER_READ_SIZE):
+    """
+    Read the FileMetaData of a remote Parquet object without downloading the
+    data pages. read_range(start, end) must return bytes [start, end) of the
+    object and size is the object size in bytes.
+    """
+    if size < len(PARQUET_MAGIC) + FOOTER_TRAILER_SIZE:
+        raise ValueError(f"Object of {size} bytes is too small to be a Parquet file")
+
+    tail_size = min(size, max(initial_read_size, FOOTER_TRAILER_SIZE))
+    tail = read_range(size - tail_size, size)
+    if tail[-4:] != PARQUET_MAGIC:
+        raise ValueError("Object does not end with the Parquet magic bytes")
+
+    metadata_size = struct.unpack("<I", tail[-FOOTER_TRAILER_SIZE:-4])[0]
+    footer_size = metadata_size + FOOTER_TRAILER_SIZE
+    if footer_size > size - len(PARQUET_MAGIC):
+        raise ValueError(f"Parquet footer length {metadata_size} does not fit in object of {size} bytes")
+    if footer_size > len(tail):
+        tail = read_range(size - footer_size, size - len(tail)) + tail
+
+    # pyarrow only looks at the end of the buffer, so the footer behind a
+    # leading magic is enough for it to parse the metadata
+    footer = PARQUET_MAGIC + tail[-footer_size:]
+    return pq.read_metadata(pa.BufferReader(footer))
+
+
+def read_s3_parquet_metadata(s3, bucket_name, key, size):
+    def read_range(start, end):
+        response = s3.get_object(Bucket=bucket_name, Key=key, Range=f"bytes={start}-{end - 1}")
+        return response['Body'].read()
+    return read_parquet_metadata(read_range, size)
+
+
+def read_arrow_schema(read_range, size, initial_read_size=DEFAULT_FOOTER_READ_SIZE):
+    return read_parquet_metadata(read_range, size, initial_read_size).schema.to_arrow_schema()
+
+
+def merge_arrow_schemas(schemas):
+    """
+    Combine the schemas of several files of one table. Columns missing from
+    some files are kept, and a column that is all NULL in one file takes its
+    type from the others.
+    """
+    return pa.unify_schemas(list(schemas))
+
+
+def parquet_file_stats(metadata, key=None, size=None):
+    """Row-group layout statistics of one file from its FileMetaData."""
+    row_groups = [metadata.row_group(i) for i in range(metadata.num_row_groups)]
+    chunks = [row_group.column(j) for row_group in row_groups for j in range(row_group.num_columns)]
+    return {
+        "key": key,
+        "size": size,
+        "rows": metadata.num_rows,
+        "row_groups": metadata.num_row_groups,
+        "row_group_rows": [row_group.num_rows for row_group in row_groups],
+        "compressed_bytes": sum(chunk.total_compressed_size for chunk in chunks),
+        "uncompressed_bytes": sum(chunk.total_uncompressed_size for chunk in chunks),
+        "codecs": sorted({chunk.compression for chunk in chunks}),
+        "dictionary_columns": sorted({chunk.path_in_schema for chunk in chunks if chunk.has_dictionary_page})
+    }
+
+
+def _statistic_value(value):
+    # Only values Glue keeps column statistics for, in a JSON-friendly form
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, datetime.date) and not isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return None
+
+
+def parquet_column_stats(metadata):
+    """
+    Null count, min and max of each top-level primitive column of one file,
+    combined over its row groups from the footer statistics. "nulls" is None
+    if a row group does not record it, and "min"/"max" are None if a row
+    group with values has no min/max or the type is not numeric or date.
+    """
+    names = set(metadata.schema.to_arrow_schema().names)
+    columns = {}
+    for i in range(metadata.num_row_groups):
+        row_group = metadata.row_group(i)
+        for j in range(row_group.num_columns):
+            chunk = row_group.column(j)
+            if chunk.path_in_schema not in names:
+                continue
+            column = columns.setdefault(chunk.path_in_schema, {"nulls": 0, "min": None, "max": None, "bounded": True})
+            stats = chunk.statistics if chunk.is_stats_set else None
+            if stats is None or not stats.has_null_count:
+                column["nulls"] = None
+                column["bounded"] = False
+                continue
+            if column["nulls"] is not None:
+                column["nulls"] += stats.null_count
+            if not stats.has_min_max:
+                # A row group of NULLs has nothing to bound
+                column["bounded"] = column["bounded"] and stats.null_count == row_group.num_rows
+                continue
+            column["min"] = stats.min if column["min"] is None else min(column["min"], stats.min)
+            column["max"] = stats.max if column["max"] is None else max(column["max"], stats.max)
+    return {
+        name: {
+            "nulls": column["nulls"],
+            "min": _statistic_value(column["min"]) if column["bounded"] else None,
+            "max": _statistic_value(column["max"]) if column["bounded"] else None
+        }
+        for name, column in columns.items()
+    }
+
+
+def is_data_file(key):
+    # Skip markers and hidden files such as _SUCCESS or .crc that Spark and
+    # Hadoop writers leave next to the data, the way Athena does
+    name = key.rsplit("/", 1)[-1]
+    return bool(name) and not name.startswith(("_", "."))
+
+
+def list_data_objects(s3, bucket_name, prefix):
+    """
+    Data files under s3://<bucket_name>/<prefix>, skipping hidden files and
+    anything in a hidden directory below prefix (e.g. the _export_ and
+    _compact_ generations of a checkpointed export or compaction), as Athena
+    does when the table location is prefix.
+    """
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            directories = obj['Key'][len(prefix):].split("/")[:-1]
+            if obj['Size'] > 0 and is_data_file(obj['Key']) and not any(d.startswith(("_", ".")) for d in directories):
+                yield obj
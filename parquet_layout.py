@@ -0,0 +1,80 @@
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Physical layout of the Parquet files the scripts write: onboard.py for
+# exports and compact.py for merged files.
+
+# Parquet physical layout defaults, overridable per table
+PARQUET_COMPRESSIONS = ("snappy", "gzip", "brotli", "zstd", "lz4", "none")
+DEFAULT_PARQUET_COMPRESSION = "snappy"
+
+class ParquetLayout:
+    """
+    Physical layout of the Parquet files written for one table, from the
+    compression, compression_level, row_group_size, dictionary_columns,
+    sort_columns and target_file_size_mb options.
+    """
+
+    def __init__(self, options):
+        self.compression = options.get('compression', DEFAULT_PARQUET_COMPRESSION)
+        if self.compression not in PARQUET_COMPRESSIONS:
+            raise ValueError(f"Unknown compression {self.compression}, expected one of {', '.join(PARQUET_COMPRESSIONS)}")
+        self.compression_level = options.get('compression_level')
+        self.row_group_size = int(options['row_group_size']) if options.get('row_group_size') else None
+        self.dictionary_columns = options.get('dictionary_columns')
+        self.sort_columns = options.get('sort_columns') or []
+        self.target_file_size = int(float(options['target_file_size_mb']) * 1024 * 1024) if options.get('target_file_size_mb') else None
+
+    def writer_options(self):
+        options = {"compression": self.compression}
+        if self.compression_level is not None:
+            options["compression_level"] = int(self.compression_level)
+        if self.dictionary_columns is not None:
+            # Only the listed columns are dictionary encoded
+            options["use_dictionary"] = list(self.dictionary_columns)
+        return options
+
+    def open_writer(self, where, schema):
+        return RowGroupWriter(pq.ParquetWriter(where, schema, **self.writer_options()), self.row_group_size)
+
+    def order_by(self, conn):
+        # Sorted output gives each row group narrow min/max statistics, so
+        # Athena can skip row groups on filters over these columns
+        if not self.sort_columns:
+            return ""
+        # Only exports have a connection, so only they need psycopg2
+        from psycopg2.extensions import quote_ident
+        return " ORDER BY " + ", ".join(quote_ident(column, conn) for column in self.sort_columns)
+
+class RowGroupWriter:
+    """
+    Wraps a ParquetWriter so that row groups have row_group_size rows no
+    matter how small the tables passed to write_table are.
+    """
+
+    def __init__(self, writer, row_group_size=None):
+        self.writer = writer
+        self.row_group_size = row_group_size
+        self.pending = []
+        self.pending_rows = 0
+
+    def write_table(self, table):
+        if not self.row_group_size:
+            self.writer.write_table(table)
+            return
+        self.pending.append(table)
+        self.pending_rows += table.num_rows
+        if self.pending_rows >= self.row_group_size:
+            self._flush(self.pending_rows - self.pending_rows % self.row_group_size)
+
+    def _flush(self, rows):
+        table = pa.concat_tables(self.pending)
+        self.writer.write_table(table.slice(0, rows), row_group_size=self.row_group_size)
+        rest = table.slice(rows)
+        self.pending = [rest] if rest.num_rows else []
+        self.pending_rows = rest.num_rows
+
+    def close(self):
+        if self.pending_rows:
+            self._flush(self.pending_rows)
+        self.writer.close()
@@ -0,0 +1,91 @@
+import json
+
+# Diffs between the catalog and policy state that exists in AWS and the state
+# onboard.py and update.py want, so that reruns only issue the calls needed
+# to close the gap and make no mutating calls when nothing changed.
+
+# Statement keys that take either a single string or a list of strings
+POLICY_LIST_KEYS = ("Action", "NotAction", "Resource", "NotResource")
+
+# Keys accepted in a Glue TableInput; get_table returns more than these
+GLUE_TABLE_INPUT_KEYS = ("Name", "Description", "Owner", "Retention", "StorageDescriptor", "PartitionKeys",
+                         "ViewOriginalText", "ViewExpandedText", "TableType", "Parameters", "TargetTable")
+
+def _canonical(value):
+    # Lists are compared as sets: AWS does not keep their order
+    if isinstance(value, dict):
+        return {key: _canonical(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return sorted((_canonical(item) for item in value), key=lambda item: json.dumps(item, sort_keys=True))
+    return value
+
+def _canonical_statement(statement):
+    statement = dict(statement)
+    for key in POLICY_LIST_KEYS:
+        if isinstance(statement.get(key), str):
+            statement[key] = [statement[key]]
+    if isinstance(statement.get("Principal"), dict):
+        statement["Principal"] = {kind: [ids] if isinstance(ids, str) else ids
+                                  for kind, ids in statement["Principal"].items()}
+    return _canonical(statement)
+
+def normalize_policy(policy):
+    """Canonical form of an IAM, bucket or resource policy (dict or JSON string)."""
+    if isinstance(policy, str):
+        policy = json.loads(policy)
+    statements = policy.get("Statement", [])
+    if isinstance(statements, dict):
+        statements = [statements]
+    return {
+        "Version": policy.get("Version"),
+        "Statement": _canonical([_canonical_statement(statement) for statement in statements])
+    }
+
+def policies_equal(current, desired):
+    if current is None:
+        return False
+    return normalize_policy(current) == normalize_policy(desired)
+
+def _column_signature(columns):
+    # Glue stores names and types in lower case
+    return [(column['Name'].lower(), column['Type'].lower().replace(" ", "")) for column in columns or []]
+
+def glue_table_changes(table, table_input):
+    """Names of the parts of table_input that differ from the Glue table."""
+    changes = []
+    current = table.get('StorageDescriptor', {})
+    desired = table_input['StorageDescriptor']
+    if _column_signature(current.get('Columns')) != _column_signature(desired.get('Columns')):
+        changes.append("Columns")
+    for key in ("Location", "InputFormat", "OutputFormat", "Compressed"):
+        if current.get(key) != desired.get(key):
+            changes.append(key)
+    if current.get('SerdeInfo', {}).get('SerializationLibrary') != desired['SerdeInfo']['SerializationLibrary']:
+        changes.append("SerdeInfo")
+    if _column_signature(table.get('PartitionKeys')) != _column_signature(table_input.get('PartitionKeys')):
+        changes.append("PartitionKeys")
+    if table.get('TableType') != table_input.get('TableType'):
+        changes.append("TableType")
+    current_parameters = table.get('Parameters', {})
+    if any(current_parameters.get(key) != value for key, value in table_input.get('Parameters', {}).items()):
+        changes.append("Parameters")
+    return changes
+
+def merge_table_input(table, table_input):
+    """
+    TableInput for update_table: the existing table with the desired fields
+    applied, so parameters and settings added by others are kept.
+    """
+    merged = {key: table[key] for key in GLUE_TABLE_INPUT_KEYS if key in table}
+    merged.update({key: value for key, value in table_input.items() if key not in ("StorageDescriptor", "Parameters")})
+    merged['StorageDescriptor'] = {**table.get('StorageDescriptor', {}), **table_input['StorageDescriptor']}
+    merged['Parameters'] = {**table.get('Parameters', {}), **table_input.get('Parameters', {})}
+    return merged
+
+def data_catalog_changes(catalog, desired):
+    """Names of the fields of an Athena data catalog that differ from desired."""
+    changes = [key for key in ("Type", "Description") if catalog.get(key) != desired.get(key)]
+    current_parameters = catalog.get('Parameters', {})
+    if any(current_parameters.get(key) != value for key, value in desired.get('Parameters', {}).items()):
+        changes.append("Parameters")
+    return changes
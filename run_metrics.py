@@ -0,0 +1,282 @@
+import json
+import logging
+import os
+import resource
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+
+# Structured metrics of one onboard.py or update.py run: time, rows and bytes
+# per stage, and every AWS API call with its latency, retries and throttles,
+# counted through botocore event hooks. The report is saved as JSON in the
+# run's log directory, next to the policies the run saves there.
+
+# Several runs can share a run directory (same minute, or fleet.py running
+# customers side by side), so file names carry the command and process id
+REPORT_NAME = "metrics_{command}_{pid}.json"
+OPENMETRICS_NAME = "metrics_{command}_{pid}.prom"
+METRIC_PREFIX = "cymballic"
+
+# Error codes AWS uses when it throttles a caller
+THROTTLE_ERROR_CODES = {
+    "Throttling", "ThrottlingException", "ThrottledException", "RequestThrottledException", "TooManyRequestsException",
+    "ProvisionedThroughputExceededException", "RequestLimitExceeded", "SlowDown", "RequestThrottled",
+    "PriorRequestNotComplete", "EC2ThrottledException", "BandwidthLimitExceeded", "LimitExceededException"
+}
+
+logger = logging.getLogger(__name__)
+
+@lru_cache(maxsize=None)
+def run_log_dir():
+    """log/run_<timestamp>/ of this run, created on first use."""
+    log_dir = f"log/run_{time.strftime('%Y%m%d_%H%M')}"
+    os.makedirs(log_dir, exist_ok=True)
+    return log_dir
+
+def peak_rss_mb():
+    # ru_maxrss is reported in kilobytes on Linux. Include finished worker
+    # processes so parallel exports report the largest process.
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024
+
+def _new_stage():
+    return {"count": 0, "seconds": 0.0, "rows": 0, "bytes": 0}
+
+def _new_call():
+    return {"calls": 0, "errors": 0, "retries": 0, "throttles": 0, "seconds": 0.0, "max_seconds": 0.0}
+
+class RunMetrics:
+    """
+    Thread-safe totals of one run. Stage seconds are summed over threads, so
+    with several tables in flight they can add up to more than the run.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.started = time.time()
+        self.stages = {}
+        self.tables = {}
+        self.calls = {}
+
+    @contextmanager
+    def stage(self, name, table=None):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, table, seconds=time.perf_counter() - start_time, count=1)
+
+    def add(self, name, table=None, seconds=0.0, rows=0, bytes=0, count=0):
+        with self.lock:
+            targets = [self.stages.setdefault(name, _new_stage())]
+            if table:
+                targets.append(self.tables.setdefault(table, {}).setdefault(name, _new_stage()))
+            for stage in targets:
+                stage["count"] += count
+                stage["seconds"] += seconds
+                stage["rows"] += rows
+                stage["bytes"] += bytes
+
+    def record_call(self, service, operation, seconds, error_code=None, retries=0):
+        with self.lock:
+            call = self.calls.setdefault(f"{service}.{operation}", _new_call())
+            call["calls"] += 1
+            call["seconds"] += seconds
+            call["max_seconds"] = max(call["max_seconds"], seconds)
+            call["retries"] += retries
+            if error_code:
+                call["errors"] += 1
+
+    def record_throttle(self, service, operation):
+        # Counted per attempt, so throttles that retries got past show up
+        with self.lock:
+            self.calls.setdefault(f"{service}.{operation}", _new_call())["throttles"] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return json.loads(json.dumps({"stages": self.stages, "tables": self.tables, "calls": self.calls}))
+
+    def drain(self):
+        """Snapshot and reset, so a pool worker hands over each task's totals once."""
+        with self.lock:
+            snapshot = json.loads(json.dumps({"stages": self.stages, "tables": self.tables, "calls": self.calls}))
+            self.reset()
+        return snapshot
+
+    def merge(self, snapshot):
+        """Add the totals of a worker process's snapshot."""
+        with self.lock:
+            for name, values in snapshot["stages"].items():
+                self._merge_into(self.stages.setdefault(name, _new_stage()), values)
+            for table, stages in snapshot["tables"].items():
+                for name, values in stages.items():
+                    self._merge_into(self.tables.setdefault(table, {}).setdefault(name, _new_stage()), values)
+            for name, values in snapshot["calls"].items():
+                call = self.calls.setdefault(name, _new_call())
+                max_seconds = max(call["max_seconds"], values["max_seconds"])
+                self._merge_into(call, values)
+                call["max_seconds"] = max_seconds
+
+    @staticmethod
+    def _merge_into(target, values):
+        for key, value in values.items():
+            target[key] = target.get(key, 0) + value
+
+    def report(self, command):
+        snapshot = self.snapshot()
+        calls = snapshot["calls"]
+        services = {}
+        for name, call in calls.items():
+            service = services.setdefault(name.split(".", 1)[0], _new_call())
+            max_seconds = max(service["max_seconds"], call["max_seconds"])
+            self._merge_into(service, call)
+            service["max_seconds"] = max_seconds
+        return {
+            "command": command,
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+            "seconds": round(time.time() - self.started, 3),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+            "rows": sum(stage["rows"] for name, stage in snapshot["stages"].items() if name == "query"),
+            "bytes": sum(stage["bytes"] for name, stage in snapshot["stages"].items() if name == "upload"),
+            "stages": snapshot["stages"],
+            "tables": snapshot["tables"],
+            "aws_services": services,
+            # Slowest operations first
+            "aws_calls": dict(sorted(calls.items(), key=lambda item: -item[1]["seconds"]))
+        }
+
+    def write_report(self, command, settings=None):
+        """
+        Save the report in the run directory and send it to the emitters
+        enabled in settings (cymballic.json by default). Never raises, so it
+        can run while a failed run is exiting.
+        """
+        try:
+            if settings is None:
+                from aws_context import load_cymballic_config
+                try:
+                    settings = load_cymballic_config()
+                except (OSError, ValueError):
+                    settings = {}
+            return self._write_report(command, settings)
+        except Exception as e:
+            logger.warning(f"Could not write the metrics report: {e}")
+            return None
+
+    def _write_report(self, command, settings):
+        report = self.report(command)
+        report_path = f"{run_log_dir()}/{REPORT_NAME.format(command=command, pid=os.getpid())}"
+        with open(report_path, "w") as f:
+            json.dump(report, f, indent=2)
+        for name, stage in sorted(report["stages"].items(), key=lambda item: -item[1]["seconds"]):
+            logger.info(f"{name:<18} {stage['seconds']:>10.1f}s {stage['count']:>6}x {stage['rows']:>12} rows "
+                        f"{stage['bytes'] / 1024 / 1024:>10.1f} MB")
+        api_calls = sum(call["calls"] for call in report["aws_calls"].values())
+        throttles = sum(call["throttles"] for call in report["aws_calls"].values())
+        retries = sum(call["retries"] for call in report["aws_calls"].values())
+        logger.info(f"{api_calls} AWS API calls, {retries} retries, {throttles} throttled attempts")
+        logger.info(f"Metrics report saved to {report_path}")
+        if settings.get("metrics_openmetrics"):
+            path = f"{run_log_dir()}/{OPENMETRICS_NAME.format(command=command, pid=os.getpid())}"
+            with open(path, "w") as f:
+                f.write(openmetrics_text(report))
+            logger.info(f"OpenMetrics saved to {path}")
+        if settings.get("metrics_statsd"):
+            try:
+                send_statsd(report, settings["metrics_statsd"])
+            except OSError as e:
+                logger.warning(f"Could not send metrics to StatsD at {settings['metrics_statsd']}: {e}")
+        return report
+
+def _metric_name(name):
+    return "".join(c if c.isalnum() else "_" for c in name)
+
+def openmetrics_text(report):
+    command = report["command"]
+    lines = [
+        f"# TYPE {METRIC_PREFIX}_run_seconds gauge",
+        f'{METRIC_PREFIX}_run_seconds{{command="{command}"}} {report["seconds"]}',
+        f"# TYPE {METRIC_PREFIX}_peak_rss_megabytes gauge",
+        f'{METRIC_PREFIX}_peak_rss_megabytes{{command="{command}"}} {report["peak_rss_mb"]}',
+    ]
+    for field in ("seconds", "rows", "bytes"):
+        lines.append(f"# TYPE {METRIC_PREFIX}_stage_{field} gauge")
+        lines.extend(f'{METRIC_PREFIX}_stage_{field}{{command="{command}",stage="{name}"}} {stage[field]}'
+                     for name, stage in report["stages"].items())
+    for field in ("calls", "errors", "retries", "throttles", "seconds"):
+        lines.append(f"# TYPE {METRIC_PREFIX}_aws_{field} gauge")
+        for name, call in report["aws_calls"].items():
+            service, operation = name.split(".", 1)
+            lines.append(f'{METRIC_PREFIX}_aws_{field}{{command="{command}",service="{service}",'
+                         f'operation="{operation}"}} {call[field]}')
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+def send_statsd(report, address):
+    """Send the report to a StatsD daemon at host:port over UDP."""
+    host, _, port = address.rpartition(":")
+    prefix = f"{METRIC_PREFIX}.{_metric_name(report['command'])}"
+    lines = [f"{prefix}.run.seconds:{report['seconds'] * 1000:.0f}|ms",
+             f"{prefix}.run.peak_rss_mb:{report['peak_rss_mb']}|g"]
+    for name, stage in report["stages"].items():
+        name = _metric_name(name)
+        lines += [f"{prefix}.stage.{name}.seconds:{stage['seconds'] * 1000:.0f}|ms",
+                  f"{prefix}.stage.{name}.rows:{stage['rows']}|c",
+                  f"{prefix}.stage.{name}.bytes:{stage['bytes']}|c"]
+    for name, call in report["aws_calls"].items():
+        name = ".".join(_metric_name(part) for part in name.split(".", 1))
+        lines += [f"{prefix}.aws.{name}.{field}:{call[field]}|c" for field in ("calls", "errors", "retries", "throttles")]
+        lines.append(f"{prefix}.aws.{name}.seconds:{call['seconds'] * 1000:.0f}|ms")
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        # One line per datagram keeps every packet well under the MTU
+        for line in lines:
+            sock.sendto(line.encode(), (host or "localhost", int(port)))
+
+metrics = RunMetrics()
+
+def _before_call(model, context, **kwargs):
+    context["cymballic_call"] = (model.service_model.service_name, model.name, time.perf_counter())
+
+def _after_call(parsed, context, **kwargs):
+    call = context.get("cymballic_call")
+    if call is None:
+        return
+    service, operation, start_time = call
+    metrics.record_call(service, operation, time.perf_counter() - start_time,
+                        error_code=parsed.get("Error", {}).get("Code"),
+                        retries=parsed.get("ResponseMetadata", {}).get("RetryAttempts", 0))
+
+def _after_call_error(exception, context, **kwargs):
+    # The request never got a response, e.g. connection errors after retries
+    call = context.get("cymballic_call")
+    if call is not None:
+        service, operation, start_time = call
+        metrics.record_call(service, operation, time.perf_counter() - start_time, error_code=type(exception).__name__)
+
+def _needs_retry(response=None, operation=None, **kwargs):
+    # Runs before botocore's retry handler for every attempt
+    if response is None or operation is None:
+        return None
+    code = response[1].get("Error", {}).get("Code") if response[1] else None
+    if code in THROTTLE_ERROR_CODES:
+        metrics.record_throttle(operation.service_model.service_name, operation.name)
+    return None
+
+def instrument_session(session):
+    """Count the AWS calls of every client created from session afterwards."""
+    session.events.register("before-call", _before_call)
+    session.events.register("after-call", _after_call)
+    session.events.register("after-call-error", _after_call_error)
+    session.events.register_first("needs-retry", _needs_retry)
+
+def _reset_after_fork():
+    # Worker processes report only their own work, merged by the parent
+    metrics.lock = threading.Lock()
+    metrics.reset()
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,179 @@
+import io
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+from run_metrics import metrics
+
+# S3 object I/O shared by onboard.py and compact.py: multipart uploads
+# written like a file, ranged reads seen as a seekable file, and cleanup of
+# the objects a rewrite leaves behind.
+
+DEFAULT_UPLOAD_PART_SIZE_MB = 16
+DEFAULT_UPLOAD_CONCURRENCY = 4
+# S3 rejects multipart parts smaller than this, except for the last one
+MIN_UPLOAD_PART_SIZE = 5 * 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+class S3MultipartWriter:
+    """
+    Write-only file object that streams everything written to it into an S3
+    multipart upload. Full parts are uploaded from a thread pool while the
+    caller keeps writing, and at most max_in_flight parts are held in memory.
+    Used as a context manager the upload is completed on success and aborted
+    on any error, so no orphaned multipart uploads are left behind.
+    """
+
+    def __init__(self, s3, bucket_name, key, part_size, max_in_flight):
+        self.s3 = s3
+        self.bucket_name = bucket_name
+        self.key = key
+        self.part_size = max(part_size, MIN_UPLOAD_PART_SIZE)
+        self.buffer = bytearray()
+        self.position = 0
+        self.parts = []
+        self.error = None
+        self.closed = False
+        self.slots = threading.BoundedSemaphore(max_in_flight)
+        self.pool = ThreadPoolExecutor(max_workers=max_in_flight)
+        self.upload_id = s3.create_multipart_upload(Bucket=bucket_name, Key=key)['UploadId']
+
+    def __repr__(self):
+        return f"s3://{self.bucket_name}/{self.key}"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def write(self, data):
+        if self.error:
+            raise self.error
+        self.buffer.extend(data)
+        self.position += len(data)
+        while len(self.buffer) >= self.part_size:
+            self._submit_part(bytes(self.buffer[:self.part_size]))
+            del self.buffer[:self.part_size]
+        return len(data)
+
+    def _submit_part(self, body):
+        # Blocks once max_in_flight parts are queued, which keeps memory bounded
+        self.slots.acquire()
+        future = self.pool.submit(self._upload_part, len(self.parts) + 1, body)
+        future.add_done_callback(self._part_done)
+        self.parts.append(future)
+
+    def _part_done(self, future):
+        self.slots.release()
+        if not future.cancelled() and future.exception() and not self.error:
+            self.error = future.exception()
+
+    def _upload_part(self, part_number, body):
+        with metrics.stage("upload"):
+            response = self.s3.upload_part(Bucket=self.bucket_name, Key=self.key, UploadId=self.upload_id,
+                                           PartNumber=part_number, Body=body)
+        metrics.add("upload", bytes=len(body))
+        return {'PartNumber': part_number, 'ETag': response['ETag']}
+
+    def close(self):
+        if self.closed:
+            return
+        if self.buffer or not self.parts:
+            self._submit_part(bytes(self.buffer))
+            self.buffer.clear()
+        try:
+            parts = [future.result() for future in self.parts]
+            self.s3.complete_multipart_upload(Bucket=self.bucket_name, Key=self.key, UploadId=self.upload_id,
+                                              MultipartUpload={'Parts': parts})
+        except BaseException:
+            self.abort()
+            raise
+        self.closed = True
+        self.pool.shutdown()
+        logger.info(f"Completed multipart upload of {self.position} bytes in {len(parts)} parts to {self}")
+
+    def abort(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.pool.shutdown(cancel_futures=True)
+        try:
+            self.s3.abort_multipart_upload(Bucket=self.bucket_name, Key=self.key, UploadId=self.upload_id)
+            logger.info(f"Aborted multipart upload to {self}")
+        except ClientError as e:
+            logger.warning(f"Could not abort multipart upload {self.upload_id} to {self}: {str(e)}")
+
+class S3ObjectReader(io.RawIOBase):
+    """
+    Read-only, seekable file object over one S3 object of size bytes. Every
+    read is a ranged GET of just the bytes asked for, so pyarrow can read a
+    Parquet file's row groups one at a time without downloading the object.
+    """
+
+    def __init__(self, s3, bucket_name, key, size):
+        self.s3 = s3
+        self.bucket_name = bucket_name
+        self.key = key
+        self.size = size
+        self.position = 0
+
+    def __repr__(self):
+        return f"s3://{self.bucket_name}/{self.key}"
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self.position = max(0, offset)
+        return self.position
+
+    def readinto(self, buffer):
+        end = min(self.position + len(buffer), self.size)
+        if end <= self.position:
+            return 0
+        with metrics.stage("download"):
+            body = self.s3.get_object(Bucket=self.bucket_name, Key=self.key,
+                                      Range=f"bytes={self.position}-{end - 1}")['Body'].read()
+        metrics.add("download", bytes=len(body))
+        buffer[:len(body)] = body
+        self.position += len(body)
+        return len(body)
+
+def remove_stale_objects(s3, bucket_name, prefix, keep_keys):
+    """Delete every object under prefix that is not in keep_keys, e.g. the files of earlier exports."""
+    stale = []
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+        stale.extend(obj['Key'] for obj in page.get('Contents', []) if obj['Key'] not in keep_keys)
+    for i in range(0, len(stale), 1000):
+        s3.delete_objects(Bucket=bucket_name, Delete={'Objects': [{'Key': key} for key in stale[i:i + 1000]]})
+    if stale:
+        logger.info(f"Removed {len(stale)} stale objects under s3://{bucket_name}/{prefix}")
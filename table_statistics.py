@@ -0,0 +1,231 @@
+import datetime
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from botocore.exceptions import ClientError
+from fingerprint_cache import object_fingerprint
+from parquet_footer import list_data_objects, parquet_column_stats, read_s3_parquet_metadata
+from reconcile import merge_table_input
+
+# Table and column statistics for Athena's cost-based optimizer, taken from
+# the Parquet footers of a table's files only: row counts, and the null
+# counts and min/max each row group records, without reading data pages.
+# The per-file statistics are cached by fingerprint (see fingerprint_cache.py),
+# so a refresh only reads the footers of files that are new or changed.
+
+STATISTICS_CACHE_NAME = "statistics"
+# Footers read concurrently; each is one or two ranged GETs
+DEFAULT_STATISTICS_WORKERS = 16
+# Most columns update_column_statistics_for_table accepts per call
+GLUE_COLUMN_STATISTICS_BATCH_SIZE = 25
+# Glue LONG statistics are 64-bit
+LONG_MIN, LONG_MAX = -2 ** 63, 2 ** 63 - 1
+
+logger = logging.getLogger(__name__)
+
+def split_location(location):
+    bucket_name, _, prefix = location.removeprefix("s3://").partition("/")
+    return bucket_name, prefix
+
+def list_location_objects(s3, location):
+    """Data files under an s3:// location, as Athena reads them."""
+    bucket_name, prefix = split_location(location)
+    return list_data_objects(s3, bucket_name, prefix)
+
+def collect_file_statistics(s3, location, cached=None, workers=DEFAULT_STATISTICS_WORKERS):
+    """
+    Statistics of each data file under location by key. Files whose
+    fingerprint matches their entry in cached keep it; the footers of the
+    others are read. Returns the statistics and the number of footers read.
+    """
+    bucket_name, _ = split_location(location)
+    cached = cached or {}
+    files = {}
+    pending = []
+    for obj in list_location_objects(s3, location):
+        fingerprint = object_fingerprint(obj)
+        if cached.get(obj['Key'], {}).get('fingerprint') == fingerprint:
+            files[obj['Key']] = cached[obj['Key']]
+        else:
+            pending.append((obj['Key'], fingerprint))
+
+    def read(item):
+        key, fingerprint = item
+        metadata = read_s3_parquet_metadata(s3, bucket_name, key, fingerprint['size'])
+        return key, {"fingerprint": fingerprint, "rows": metadata.num_rows, "columns": parquet_column_stats(metadata)}
+
+    if pending:
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(pending)))) as pool:
+            files.update(pool.map(read, pending))
+    return dict(sorted(files.items())), len(pending)
+
+def table_parameters(files):
+    # The Hive statistics parameters, and recordCount as Glue crawlers write it
+    rows = sum(f['rows'] for f in files.values())
+    return {
+        "numRows": str(rows),
+        "recordCount": str(rows),
+        "numFiles": str(len(files)),
+        "totalSize": str(sum(f['fingerprint']['size'] for f in files.values()))
+    }
+
+def _statistics_type(glue_type):
+    """Glue statistics type of a column type and the parser of its cached values, or (None, None)."""
+    glue_type = glue_type.lower().replace(" ", "")
+    if glue_type in ("tinyint", "smallint", "int", "integer", "bigint"):
+        return "LONG", int
+    if glue_type in ("float", "double"):
+        return "DOUBLE", float
+    if glue_type.startswith("decimal("):
+        return "DECIMAL", Decimal
+    if glue_type == "date":
+        return "DATE", datetime.date.fromisoformat
+    # Strings, binaries and booleans need lengths or true counts footers do not have
+    return None, None
+
+def column_summary(column, files):
+    """
+    Statistics of one Glue column over files as {"type", "nulls", "distinct",
+    "min", "max"} with the bounds as strings, or None if the footers do not
+    fully describe it. Footers have no distinct counts, so "distinct" is the
+    largest the counts and the range allow.
+    """
+    kind, parse = _statistics_type(column['Type'])
+    if kind is None:
+        return None
+    nulls = 0
+    low = high = None
+    try:
+        for f in files.values():
+            # Glue keeps names in lower case
+            stats = next((s for name, s in f['columns'].items() if name.lower() == column['Name'].lower()), None)
+            if stats is None:
+                # Files written before the column was added read it as NULL
+                nulls += f['rows']
+                continue
+            if stats['nulls'] is None:
+                return None
+            nulls += stats['nulls']
+            if stats['nulls'] == f['rows']:
+                continue
+            if stats['min'] is None or stats['max'] is None:
+                return None
+            low = parse(stats['min']) if low is None else min(low, parse(stats['min']))
+            high = parse(stats['max']) if high is None else max(high, parse(stats['max']))
+    except (ValueError, TypeError, ArithmeticError):
+        # Bounds of another type than the column, e.g. after a type change
+        return None
+    if kind == "LONG" and low is not None and (low < LONG_MIN or high > LONG_MAX):
+        return None
+    if kind == "DOUBLE" and low is not None and (low != low or high != high):
+        return None
+    values = sum(f['rows'] for f in files.values()) - nulls
+    distinct = values
+    if low is not None and kind == "LONG":
+        distinct = min(values, high - low + 1)
+    elif low is not None and kind == "DATE":
+        distinct = min(values, (high - low).days + 1)
+    elif low is not None and low == high:
+        distinct = min(values, 1)
+    return {
+        "type": column['Type'],
+        "nulls": nulls,
+        "distinct": distinct,
+        "min": str(low) if low is not None else None,
+        "max": str(high) if high is not None else None
+    }
+
+def column_summaries(columns, files):
+    summaries = {column['Name']: column_summary(column, files) for column in columns}
+    return {name: summary for name, summary in summaries.items() if summary is not None}
+
+def _decimal_value(value, glue_type):
+    scale = int(glue_type.replace(" ", "").rstrip(")").split(",")[1])
+    unscaled = int(Decimal(value).scaleb(scale))
+    return {"UnscaledValue": unscaled.to_bytes(unscaled.bit_length() // 8 + 1, "big", signed=True), "Scale": scale}
+
+def glue_column_statistics(name, summary, analyzed_time):
+    """ColumnStatistics entry of update_column_statistics_for_table for one column summary."""
+    kind, parse = _statistics_type(summary['type'])
+    data = {"NumberOfNulls": summary['nulls'], "NumberOfDistinctValues": summary['distinct']}
+    if summary['min'] is not None:
+        bounds = {"MinimumValue": parse(summary['min']), "MaximumValue": parse(summary['max'])}
+        if kind == "DECIMAL":
+            bounds = {key: _decimal_value(value, summary['type']) for key, value in bounds.items()}
+        elif kind == "DATE":
+            bounds = {key: datetime.datetime.combine(value, datetime.time(), datetime.timezone.utc)
+                      for key, value in bounds.items()}
+        data.update(bounds)
+    return {
+        "ColumnName": name,
+        "ColumnType": summary['type'],
+        "AnalyzedTime": analyzed_time,
+        "StatisticsData": {"Type": kind, f"{kind.capitalize()}ColumnStatisticsData": data}
+    }
+
+def publish_table_statistics(glue, s3, database_name, table_input, cache=None, refresh=False):
+    """
+    Set the statistics parameters and column statistics of a Glue table from
+    the footers of the files at its location. Nothing is written to Glue when
+    they match what was last published according to the cache. Columns Glue
+    rejects are cached with the summary it rejected, and only sent again when
+    that summary changes. The cache is left as it was if a Glue call fails,
+    so everything is tried again next time.
+    """
+    table_name = table_input['Name']
+    location = table_input['StorageDescriptor']['Location']
+    bucket_name, _ = split_location(location)
+    entry = cache.load(bucket_name, table_name) if cache else {}
+    # A checkpointed export moves the table to a new location with new files
+    cached_files = entry.get('files') if entry.get('location') == location else None
+    files, read = collect_file_statistics(s3, location, cached_files)
+    parameters = table_parameters(files)
+    summaries = column_summaries(table_input['StorageDescriptor']['Columns'], files)
+    logger.info(f"Statistics of {table_name}: {parameters['numRows']} rows in {parameters['numFiles']} files, "
+                f"{len(summaries)} column(s), {read} footer(s) read")
+
+    published = entry.get('published', {}) if cached_files is not None else {}
+    # Glue keeps rejecting a column while its statistics stay the same
+    rejected = {name for name, summary in published.get('rejected', {}).items()
+                if not refresh and summaries.get(name) == summary}
+    if (not refresh and published.get('parameters') == parameters
+            and {**published.get('columns', {}), **published.get('rejected', {})} == summaries):
+        logger.info(f"Statistics of Glue table {table_name} are up to date")
+    else:
+        table = glue.get_table(DatabaseName=database_name, Name=table_name)['Table']
+        if any(table.get('Parameters', {}).get(key) != value for key, value in parameters.items()):
+            glue.update_table(DatabaseName=database_name, SkipArchive=True,
+                              TableInput=merge_table_input(table, {"StorageDescriptor": {}, "Parameters": parameters}))
+        analyzed_time = datetime.datetime.now(datetime.timezone.utc)
+        statistics = [glue_column_statistics(name, summary, analyzed_time) for name, summary in summaries.items()
+                      if name not in rejected]
+        for i in range(0, len(statistics), GLUE_COLUMN_STATISTICS_BATCH_SIZE):
+            response = glue.update_column_statistics_for_table(
+                DatabaseName=database_name, TableName=table_name,
+                ColumnStatisticsList=statistics[i:i + GLUE_COLUMN_STATISTICS_BATCH_SIZE])
+            for error in response.get('Errors', []):
+                rejected.add(error['ColumnStatistics']['ColumnName'])
+                logger.warning(f"Glue rejected the statistics of {table_name}.{error['ColumnStatistics']['ColumnName']}: "
+                               f"{error['Error'].get('ErrorMessage')}")
+        # Columns that lost their bounds or type keep no stale statistics
+        for name in set(published.get('columns', {})) - set(summaries):
+            try:
+                glue.delete_column_statistics_for_table(DatabaseName=database_name, TableName=table_name, ColumnName=name)
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'EntityNotFoundException':
+                    raise
+        logger.info(f"Published statistics of {len(summaries) - len(rejected)} column(s) to Glue table {table_name}")
+
+    if cache:
+        cache.save(bucket_name, table_name, {
+            "location": location,
+            "files": files,
+            "published": {
+                "parameters": parameters,
+                "columns": {name: summary for name, summary in summaries.items() if name not in rejected},
+                "rejected": {name: summary for name, summary in summaries.items() if name in rejected}
+            },
+            "updated": time.strftime("%Y-%m-%dT%H:%M:%S")
+        })
+    return parameters
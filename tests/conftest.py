@@ -0,0 +1,113 @@
+import json
+import os
+import sys
+import pytest
+
+# The scripts are flat modules run from the repository root
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "gcp"))
+
+import aws_context
+import run_metrics
+
+AWS_REGION = "us-east-1"
+MAIN_ACCOUNT_ID = "123456789012"
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Run in an empty directory, as the scripts write out/, log/ and cache/ next to them."""
+    monkeypatch.chdir(tmp_path)
+    # The run directory is relative to the cwd and kept for the process
+    run_metrics.run_log_dir.cache_clear()
+    return tmp_path
+
+
+@pytest.fixture
+def cymballic_config(workdir):
+    """Write a cymballic.json for the test; returns it so tests can add keys before the first load."""
+    config = {
+        "aws_account_profile": None,
+        "aws_account_id": MAIN_ACCOUNT_ID,
+        "aws_region": AWS_REGION,
+        "iam_service_role": "main-role",
+        "s3_bucket": "s3://metadata/"
+    }
+
+    def write(**changes):
+        config.update(changes)
+        with open(workdir / aws_context.CYMBALLIC_CONFIG_PATH, "w") as file:
+            json.dump(config, file)
+        aws_context.load_cymballic_config.cache_clear()
+        aws_context.client_config.cache_clear()
+        return config
+
+    write()
+    yield write
+    aws_context.load_cymballic_config.cache_clear()
+    aws_context.client_config.cache_clear()
+
+
+@pytest.fixture
+def aws(monkeypatch, tmp_path):
+    """moto in place of AWS, reached through the shared sessions of aws_context with profile None."""
+    moto = pytest.importorskip("moto")
+    for name in ("AWS_PROFILE", "AWS_DEFAULT_PROFILE", "AWS_SESSION_TOKEN"):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", AWS_REGION)
+    monkeypatch.setenv("AWS_CONFIG_FILE", str(tmp_path / "aws-config"))
+    monkeypatch.setenv("AWS_SHARED_CREDENTIALS_FILE", str(tmp_path / "aws-credentials"))
+    with moto.mock_aws():
+        aws_context._sessions.clear()
+        aws_context._clients.clear()
+        yield aws_context.get_session(None)
+    aws_context._sessions.clear()
+    aws_context._clients.clear()
+
+
+@pytest.fixture(scope="session")
+def postgres_server(tmp_path_factory):
+    pgserver = pytest.importorskip("pgserver")
+    server = pgserver.get_server(str(tmp_path_factory.mktemp("postgres")), cleanup_mode="stop")
+    yield server
+    server.cleanup()
+
+
+@pytest.fixture
+def rds_info(postgres_server):
+    """Customer config of a postgres source on the local server."""
+    uri = postgres_server.get_uri()
+    return {
+        "type": "postgres",
+        "customer": "Bench",
+        "host": uri.split("host=", 1)[1],
+        "port": 5432,
+        "database": "postgres",
+        "username": "postgres",
+        "password": ""
+    }
+
+
+@pytest.fixture
+def postgres(rds_info):
+    """Connection for setting up tables; they are dropped at the end of the test."""
+    import psycopg2
+    conn = psycopg2.connect(host=rds_info["host"], port=rds_info["port"], dbname=rds_info["database"],
+                            user=rds_info["username"], password=rds_info["password"])
+    conn.autocommit = True
+    created = []
+
+    def execute(sql, table_name=None):
+        with conn.cursor() as cur:
+            cur.execute(sql)
+        if table_name:
+            created.append(table_name)
+
+    yield execute
+    with conn.cursor() as cur:
+        for table_name in created:
+            cur.execute(f"DROP TABLE IF EXISTS {table_name}")
+    conn.close()
@@ -0,0 +1,79 @@
+import threading
+
+# In-memory stand-in for the parts of google.cloud.storage.Client the GCS
+# scripts use. Every download is recorded, so tests can check that only
+# footers are read.
+
+
+class FakeBlob:
+    def __init__(self, client, bucket_name, name, data):
+        self.client = client
+        self.bucket_name = bucket_name
+        self.name = name
+        self.data = data
+
+    @property
+    def size(self):
+        return len(self.data)
+
+    def download_as_bytes(self, start=None, end=None):
+        # Like the real client, end is inclusive
+        with self.client.lock:
+            self.client.downloads.append((self.bucket_name, self.name, start, end))
+        if start is None and end is None:
+            return self.data
+        return self.data[start or 0:None if end is None else end + 1]
+
+
+class FakeBucket:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def get_blob(self, name):
+        data = self.client.objects.get(self.name, {}).get(name)
+        return None if data is None else FakeBlob(self.client, self.name, name, data)
+
+
+class FakeBlobIterator:
+    """Blobs of one listing; prefixes are filled in as the pages are read, as in the real client."""
+
+    def __init__(self, blobs, prefixes):
+        self._blobs = blobs
+        self._prefixes = prefixes
+        self.prefixes = set()
+
+    @property
+    def pages(self):
+        self.prefixes.update(self._prefixes)
+        yield list(self._blobs)
+
+    def __iter__(self):
+        for page in self.pages:
+            yield from page
+
+
+class FakeGCSClient:
+    def __init__(self):
+        self.objects = {}
+        self.downloads = []
+        self.lock = threading.Lock()
+
+    def upload(self, bucket_name, name, data):
+        self.objects.setdefault(bucket_name, {})[name] = bytes(data)
+
+    def bucket(self, name):
+        return FakeBucket(self, name)
+
+    def list_blobs(self, bucket_name, prefix="", delimiter=None):
+        blobs = []
+        prefixes = set()
+        for name, data in sorted(self.objects.get(bucket_name, {}).items()):
+            if not name.startswith(prefix):
+                continue
+            rest = name[len(prefix):]
+            if delimiter and delimiter in rest:
+                prefixes.add(prefix + rest.split(delimiter, 1)[0] + delimiter)
+                continue
+            blobs.append(FakeBlob(self, bucket_name, name, data))
+        return FakeBlobIterator(blobs, prefixes)
@@ -0,0 +1,55 @@
+import os
+import subprocess
+import sys
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+import compact
+from aws_context import get_client
+from conftest import AWS_REGION, ROOT
+
+BUCKET = "customer"
+
+
+def test_compact_does_not_load_the_export_script():
+    check = "import sys, compact; print(sorted({'onboard', 'psycopg2', 'pandas'} & set(sys.modules)))"
+    result = subprocess.run([sys.executable, "-c", check], cwd=ROOT, capture_output=True, text=True,
+                            env={**os.environ, "PYTHONPATH": ROOT})
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == "[]"
+
+
+@pytest.fixture
+def s3(aws):
+    s3 = get_client(aws, 's3', AWS_REGION)
+    s3.create_bucket(Bucket=BUCKET)
+    return s3
+
+
+def upload(s3, key, table, row_group_size):
+    sink = pa.BufferOutputStream()
+    pq.write_table(table, sink, row_group_size=row_group_size)
+    body = sink.getvalue().to_pybytes()
+    s3.put_object(Bucket=BUCKET, Key=key, Body=body)
+    return key, len(body)
+
+
+def test_source_row_groups_are_read_with_ranged_gets(s3):
+    sources = [
+        upload(s3, "orders/part-0.parquet", pa.table({"id": pa.array(range(1000), pa.int64())}), 100),
+        upload(s3, "orders/part-1.parquet", pa.table({"id": pa.array(range(1000, 1500), pa.int64()),
+                                                      "note": pa.array(["x"] * 500)}), 250)
+    ]
+    ranges = []
+    get_object = s3.get_object
+    s3.get_object = lambda **kwargs: (ranges.append(kwargs.get('Range')), get_object(**kwargs))[1]
+
+    rows = compact.merge_files(s3, BUCKET, sources, "orders/_compact_1/merged.parquet", {})
+
+    assert rows == 1500
+    assert ranges and None not in ranges
+    body = get_object(Bucket=BUCKET, Key="orders/_compact_1/merged.parquet")['Body'].read()
+    merged = pq.read_table(pa.BufferReader(body))
+    assert merged.column_names == ["id", "note"]
+    assert merged.column("id").to_pylist() == list(range(1500))
+    assert merged.column("note").null_count == 1000
@@ -0,0 +1,54 @@
+import pyarrow as pa
+import pyarrow.parquet as pq
+import onboard
+
+
+def test_empty_table_writes_a_file_with_the_columns(postgres, rds_info, workdir):
+    postgres("CREATE TABLE copy_empty (id bigint PRIMARY KEY, name text, price numeric(10,2))", "copy_empty")
+    conn = onboard.open_postgres_connection(rds_info)
+    try:
+        columns, rows = onboard.write_parquet_copy(conn, "SELECT * FROM copy_empty", str(workdir / "empty.parquet"))
+    finally:
+        conn.close()
+
+    assert rows == 0
+    assert columns == [{"Name": "id", "Type": "bigint"}, {"Name": "name", "Type": "string"},
+                       {"Name": "price", "Type": "decimal(10,2)"}]
+    table = pq.read_table(workdir / "empty.parquet")
+    assert table.num_rows == 0
+    assert table.schema.names == ["id", "name", "price"]
+    assert table.schema.field("price").type == pa.decimal128(10, 2)
+
+
+def test_empty_ranges_of_a_parallel_export_write_empty_parts(postgres, rds_info, workdir):
+    # Keys 1-10 and 991-1000 leave the middle ranges of a pk split empty
+    postgres("CREATE TABLE copy_gaps (id bigint PRIMARY KEY, name text)", "copy_gaps")
+    postgres("INSERT INTO copy_gaps SELECT i, 'row ' || i FROM generate_series(1, 10) AS i")
+    postgres("INSERT INTO copy_gaps SELECT i, 'row ' || i FROM generate_series(991, 1000) AS i")
+    options = {**rds_info, "export_mode": "parallel", "extract_engine": "copy", "workers": 4, "split_strategy": "pk"}
+
+    columns, parts = onboard.export_table_parallel(options, "copy_gaps", str(workdir / "copy_gaps"), 1000)
+
+    assert len(parts) == 4
+    assert 0 in {rows for _, rows in parts}
+    assert sum(rows for _, rows in parts) == 20
+    for part_name, _ in parts:
+        assert pq.read_schema(workdir / "copy_gaps" / part_name).names == ["id", "name"]
+
+
+def test_rows_keep_nulls_empty_strings_and_types(postgres, rds_info, workdir):
+    postgres("CREATE TABLE copy_values (id int, name text, active boolean, price numeric(10,2), day date)", "copy_values")
+    postgres("INSERT INTO copy_values VALUES (1, '', true, 12.50, '2024-02-29'), (2, NULL, false, -0.01, NULL), "
+             "(3, 'multi\nline, \"quoted\"', NULL, NULL, '1999-12-31')")
+    conn = onboard.open_postgres_connection(rds_info)
+    try:
+        _, rows = onboard.write_parquet_copy(conn, "SELECT * FROM copy_values ORDER BY id", str(workdir / "values.parquet"))
+    finally:
+        conn.close()
+
+    assert rows == 3
+    table = pq.read_table(workdir / "values.parquet").to_pydict()
+    assert table["name"] == ["", None, 'multi\nline, "quoted"']
+    assert table["active"] == [True, False, None]
+    assert [str(price) if price is not None else None for price in table["price"]] == ["12.50", "-0.01", None]
+    assert [str(day) if day else None for day in table["day"]] == ["2024-02-29", None, "1999-12-31"]
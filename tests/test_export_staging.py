@@ -0,0 +1,44 @@
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import onboard
+from aws_context import get_client
+from conftest import AWS_REGION
+
+
+@pytest.fixture
+def tmp_dir(tmp_path, monkeypatch):
+    """Staging area of the test, with a stray /tmp/<table> of another process in it."""
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path / "tmp"))
+    (tmp_path / "tmp" / "orders").mkdir(parents=True)
+    (tmp_path / "tmp" / "orders" / "other.parquet").write_bytes(b"in use")
+    return tmp_path / "tmp"
+
+
+@pytest.mark.parametrize("options", [
+    {"export_mode": "pandas"},
+    {"export_mode": "streaming", "partition_columns": ["region"]},
+    {"export_mode": "parallel", "workers": 2}
+])
+def test_customers_exporting_the_same_table_do_not_share_staging_files(postgres, rds_info, aws, workdir, tmp_dir,
+                                                                       options):
+    postgres("CREATE TABLE orders (id bigint PRIMARY KEY, region text)", "orders")
+    postgres("INSERT INTO orders SELECT i, CASE WHEN i % 2 = 0 THEN 'eu' ELSE 'us' END "
+             "FROM generate_series(1, 2000) AS i")
+    s3 = get_client(aws, 's3', AWS_REGION)
+    buckets = ["customer-a", "customer-b"]
+    for bucket_name in buckets:
+        s3.create_bucket(Bucket=bucket_name)
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        list(pool.map(lambda bucket_name: onboard.export_table_to_s3_parquet({**rds_info, **options}, "orders",
+                                                                              bucket_name, aws), buckets))
+
+    for bucket_name in buckets:
+        keys = [obj['Key'] for obj in s3.list_objects_v2(Bucket=bucket_name, Prefix="orders/")['Contents']]
+        rows = sum(onboard.read_s3_parquet_metadata(s3, bucket_name, key, s3.head_object(Bucket=bucket_name, Key=key)
+                                                    ['ContentLength']).num_rows for key in keys)
+        assert rows == 2000
+    # Staging directories are removed, and nothing else is touched
+    assert sorted(path.name for path in tmp_dir.iterdir()) == ["orders"]
+    assert (tmp_dir / "orders" / "other.parquet").read_bytes() == b"in use"
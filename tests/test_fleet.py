@@ -0,0 +1,29 @@
+import json
+import os
+import subprocess
+import sys
+import fleet
+from conftest import ROOT
+
+
+def test_fleet_does_not_load_the_export_dependencies():
+    # fleet.py only starts onboard.py and update.py in their own processes
+    check = "import sys, fleet; print(sorted({'onboard', 'pandas', 'pyarrow', 'psycopg2'} & set(sys.modules)))"
+    result = subprocess.run([sys.executable, "-c", check], cwd=ROOT, capture_output=True, text=True,
+                            env={**os.environ, "PYTHONPATH": ROOT})
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == "[]"
+
+
+def test_every_customer_config_gets_its_own_log(tmp_path):
+    for directory, name, customer in (("a", "acme.json", "Acme"), ("a", "acme-parquet.json", "ACME"),
+                                      ("b", "acme.json", "acme")):
+        (tmp_path / directory).mkdir(exist_ok=True)
+        (tmp_path / directory / name).write_text(json.dumps({"customer": customer, "aws_profile": "p"}))
+    # The same file listed twice is onboarded once
+    customers = fleet.find_customer_configs([str(tmp_path / "a"), str(tmp_path / "b" / "acme.json"),
+                                             str(tmp_path / "a" / "acme.json")])
+
+    assert [os.path.relpath(path, tmp_path) for path, _ in customers] == ["a/acme-parquet.json", "a/acme.json",
+                                                                          "b/acme.json"]
+    assert fleet.log_names(customers) == ["acme-acme-parquet", "acme-acme", "acme-acme-2"]
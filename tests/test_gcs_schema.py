@@ -0,0 +1,94 @@
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from fake_gcs import FakeGCSClient
+from gcs_schema import infer_gcs_schema, infer_schema, infer_schemas, list_table_prefixes
+from parquet_footer import DEFAULT_FOOTER_READ_SIZE
+
+
+def parquet_bytes(table, **options):
+    sink = pa.BufferOutputStream()
+    pq.write_table(table, sink, **options)
+    return sink.getvalue().to_pybytes()
+
+
+@pytest.fixture
+def client():
+    return FakeGCSClient()
+
+
+def test_schema_is_read_from_the_footer_only(client):
+    table = pa.table({
+        "id": pa.array(range(200000), pa.int64()),
+        "amount": pa.array([i / 7 for i in range(200000)], pa.float64()),
+        "day": pa.array([i % 3650 for i in range(200000)], pa.date32())
+    })
+    data = parquet_bytes(table, compression="none")
+    client.upload("bucket", "orders/part-0.parquet", data)
+
+    columns = infer_gcs_schema(client, "gs://bucket/orders/")
+
+    assert columns == [{"Name": "id", "Type": "bigint"}, {"Name": "amount", "Type": "double"},
+                       {"Name": "day", "Type": "date"}]
+    assert all(start is not None and end is not None for _, _, start, end in client.downloads)
+    downloaded = sum(end - start + 1 for _, _, start, end in client.downloads)
+    assert downloaded <= DEFAULT_FOOTER_READ_SIZE < len(data)
+
+
+def test_footer_larger_than_the_first_read_takes_one_more_range(client):
+    table = pa.table({f"column_with_a_long_name_{i}": pa.array([i], pa.int32()) for i in range(1500)})
+    data = parquet_bytes(table)
+    client.upload("bucket", "wide/wide.parquet", data)
+
+    columns = infer_gcs_schema(client, "gs://bucket/wide/wide.parquet")
+
+    assert len(columns) == 1500
+    assert len(client.downloads) == 2
+
+
+def test_schemas_of_the_files_of_a_prefix_are_merged(client):
+    client.upload("bucket", "events/a.parquet", parquet_bytes(pa.table({"id": pa.array([1], pa.int32()),
+                                                                         "note": pa.nulls(1)})))
+    client.upload("bucket", "events/b.parquet", parquet_bytes(pa.table({"id": pa.array([2], pa.int32()),
+                                                                         "note": pa.array(["x"]),
+                                                                         "added": pa.array([True])})))
+    # Markers next to the data are not read as Parquet
+    client.upload("bucket", "events/_SUCCESS", b"")
+    client.upload("bucket", "events/.part.crc", b"crc")
+
+    columns = infer_gcs_schema(client, "gs://bucket/events")
+
+    assert columns == [{"Name": "id", "Type": "int"}, {"Name": "note", "Type": "string"},
+                       {"Name": "added", "Type": "boolean"}]
+    assert {name for _, name, _, _ in client.downloads} == {"events/a.parquet", "events/b.parquet"}
+
+
+def test_missing_table_raises(client):
+    with pytest.raises(FileNotFoundError):
+        infer_gcs_schema(client, "gs://bucket/missing/")
+
+
+def test_many_tables_are_inferred_at_once(client):
+    sources = []
+    for i in range(40):
+        client.upload("bucket", f"table_{i}/data.parquet", parquet_bytes(pa.table({f"c{i}": pa.array([i], pa.int64())})))
+        sources.append(f"gs://bucket/table_{i}/")
+
+    schemas = infer_schemas(sources, client, workers=8)
+
+    assert list(schemas) == sources
+    assert all(schemas[f"gs://bucket/table_{i}/"] == [{"Name": f"c{i}", "Type": "bigint"}] for i in range(40))
+
+
+def test_table_prefixes_skip_hidden_directories(client):
+    for name in ("orders/a.parquet", "users/b.parquet", "_tmp/c.parquet", "top.parquet"):
+        client.upload("bucket", name, b"PAR1")
+
+    assert list_table_prefixes(client, "bucket") == ["orders", "users"]
+
+
+def test_local_files_are_inferred_without_a_client(tmp_path):
+    path = tmp_path / "local.parquet"
+    pq.write_table(pa.table({"name": pa.array(["a"]), "price": pa.array([1], pa.decimal128(10, 2))}), path)
+
+    assert infer_schema(str(path)) == [{"Name": "name", "Type": "string"}, {"Name": "price", "Type": "decimal(10,2)"}]
@@ -0,0 +1,189 @@
+import json
+import pytest
+import update
+from aws_context import get_client
+from conftest import AWS_REGION, MAIN_ACCOUNT_ID
+from iam_policies import (MANAGED_POLICY_MAX_CHARS, SHARD_FILL_RATIO, PolicyManager, assign_shards,
+                          customer_statements, policy_size, shard_policy)
+
+ROLE = "main-role"
+REGISTRY_BUCKET = "metadata"
+LIMIT = MANAGED_POLICY_MAX_CHARS * SHARD_FILL_RATIO
+
+
+def grant(i):
+    # Every customer in its own source account, so nothing merges across customers
+    return {"source_account_id": f"{100000000000 + i}", "database": f"customer{i:02d}", "bucket": f"customer{i:02d}"}
+
+
+def customers(count):
+    return {f"customer{i:02d}": grant(i) for i in range(count)}
+
+
+def shard_size(registry, names):
+    return policy_size(shard_policy(AWS_REGION, [registry[name] for name in names], 0))
+
+
+@pytest.fixture
+def iam(aws):
+    iam = get_client(aws, 'iam')
+    iam.create_role(RoleName=ROLE, AssumeRolePolicyDocument=json.dumps({"Version": "2012-10-17", "Statement": []}))
+    get_client(aws, 's3', AWS_REGION).create_bucket(Bucket=REGISTRY_BUCKET)
+    return iam
+
+
+@pytest.fixture
+def manager(aws, iam):
+    return PolicyManager(iam, get_client(aws, 's3', AWS_REGION), ROLE, MAIN_ACCOUNT_ID, AWS_REGION,
+                         f"s3://{REGISTRY_BUCKET}/")
+
+
+def attached_policies(iam):
+    return sorted(policy['PolicyName'] for policy in iam.list_attached_role_policies(RoleName=ROLE)['AttachedPolicies'])
+
+
+def test_shards_are_packed_up_to_the_size_limit():
+    registry = customers(61)
+
+    shards = assign_shards(registry, AWS_REGION, 8)
+
+    assert list(shards) == [0, 1, 2]
+    assert sorted(name for names in shards.values() for name in names) == sorted(registry)
+    assert all(shard_size(registry, names) <= LIMIT for names in shards.values())
+    # A shard is only left for the next one when the next customer does not fit
+    for index in (0, 1):
+        assert shard_size(registry, shards[index] + [shards[index + 1][0]]) > LIMIT
+    assert all(registry[name]['shard'] == index for index, names in shards.items() for name in names)
+
+
+def test_too_many_customers_for_the_policies_raise():
+    with pytest.raises(ValueError, match="iam_max_managed_policies"):
+        assign_shards(customers(61), AWS_REGION, 2)
+
+
+def test_customers_keep_their_shards_when_one_is_removed():
+    registry = customers(61)
+    shards = assign_shards(registry, AWS_REGION, 8)
+    removed = shards[0][3]
+
+    del registry[removed]
+    after = assign_shards(registry, AWS_REGION, 8)
+
+    assert after == {**shards, 0: [name for name in shards[0] if name != removed]}
+    # The freed room goes to the next new customer rather than to a move
+    registry["customer99"] = grant(99)
+    assert assign_shards(registry, AWS_REGION, 8)[0] == sorted(after[0] + ["customer99"])
+
+
+def test_revoking_a_customer_rewrites_only_its_shard(manager, iam):
+    registry = manager.commit(customers(61))
+    manager.apply(registry)
+    documents = {index: manager._default_document(manager._managed_policies()[manager.policy_arn(index)])
+                 for index in range(3)}
+    removed = next(name for name, entry in registry['customers'].items() if entry['shard'] == 1)
+
+    registry, revoked = manager.revoke([removed, "unknown"])
+    manager.apply(registry, revoked)
+
+    assert list(revoked) == [removed]
+    assert removed not in manager.load_registry()[0]['customers']
+    policies = manager._managed_policies()
+    assert attached_policies(iam) == [f"{ROLE}-customers-{index}" for index in range(3)]
+    for index in (0, 2):
+        assert manager._default_document(policies[manager.policy_arn(index)]) == documents[index]
+    rewritten = json.dumps(manager._default_document(policies[manager.policy_arn(1)]))
+    assert f"database/{removed}" not in rewritten
+    assert len(iam.list_policy_versions(PolicyArn=manager.policy_arn(1))['Versions']) == 2
+    # Nothing left to revoke: no new generation
+    assert manager.revoke([removed])[0]['generation'] == registry['generation']
+
+
+def test_revoking_every_customer_of_a_shard_deletes_its_policy(aws, iam, cymballic_config, workdir, monkeypatch):
+    monkeypatch.setattr(update, "get_account_id", lambda profile: grant(60)['source_account_id'])
+    manager = update.policy_manager()
+    manager.apply(manager.commit(customers(61)))
+    last_shard = [name for name, entry in manager.load_registry()[0]['customers'].items() if entry['shard'] == 2]
+
+    update.revoke_policy([name.upper() for name in last_shard])
+
+    assert attached_policies(iam) == [f"{ROLE}-customers-0", f"{ROLE}-customers-1"]
+    assert manager.policy_arn(2) not in manager._managed_policies()
+    assert sorted(manager.load_registry()[0]['customers']) == sorted(set(customers(61)) - set(last_shard))
+
+
+def test_revoking_a_customer_of_the_inline_policy_removes_its_statements(iam, manager):
+    legacy = customers(3)
+    statements = [s for entry in legacy.values() for s in customer_statements(AWS_REGION, entry)]
+    iam.put_role_policy(RoleName=ROLE, PolicyName=f"{ROLE}-policy",
+                        PolicyDocument=json.dumps({"Version": "2012-10-17", "Statement": statements}))
+
+    registry, revoked = manager.revoke(["customer01"])
+    manager.apply(registry, revoked)
+
+    assert sorted(registry['customers']) == ["customer00", "customer02"]
+    assert manager.load_inline_policy() is None
+    granted = json.dumps(manager.render(registry))
+    assert "database/customer01" not in granted and "database/customer02" in granted
+
+
+def test_commit_is_a_no_op_for_granted_customers(manager):
+    registry = manager.commit(customers(3))
+
+    assert manager.commit({"customer01": grant(1)}) == registry
+    assert manager.load_registry()[0]['generation'] == 1
+
+
+def test_inline_policy_is_migrated_to_managed_policies(aws, iam, cymballic_config, workdir, monkeypatch):
+    # The inline policy update.py used to append each customer's statements to
+    legacy = customers(60)
+    other = {"Effect": "Allow", "Action": ["athena:*"], "Resource": ["*"]}
+    statements = [s for entry in legacy.values() for s in customer_statements(AWS_REGION, entry)]
+    iam.put_role_policy(RoleName=ROLE, PolicyName=f"{ROLE}-policy",
+                        PolicyDocument=json.dumps({"Version": "2012-10-17", "Statement": statements + [other]}))
+    monkeypatch.setattr(update, "get_account_id", lambda profile: grant(60)['source_account_id'])
+
+    update.update_policy([("customer60-profile", "Customer60")])
+
+    registry = json.loads(get_client(aws, 's3', AWS_REGION).get_object(
+        Bucket=REGISTRY_BUCKET, Key=f"iam/{ROLE}-grants.json")['Body'].read())
+    assert sorted(registry['customers']) == sorted(customers(61))
+    assert registry['customers']['customer07'] == {**legacy['customer07'], "shard": 0}
+    assert attached_policies(iam) == [f"{ROLE}-customers-{index}" for index in range(3)]
+    # Only the statement that is not a customer grant stays inline
+    inline = iam.get_role_policy(RoleName=ROLE, PolicyName=f"{ROLE}-policy")['PolicyDocument']
+    assert inline['Statement'] == [other]
+
+    # A rerun finds everything granted and changes nothing
+    versions = {index: iam.get_policy(PolicyArn=f"arn:aws:iam::{MAIN_ACCOUNT_ID}:policy/{ROLE}-customers/"
+                                                f"{ROLE}-customers-{index}")['Policy']['DefaultVersionId']
+                for index in range(3)}
+    update.update_policy([("customer60-profile", "Customer60")])
+    assert {index: iam.get_policy(PolicyArn=f"arn:aws:iam::{MAIN_ACCOUNT_ID}:policy/{ROLE}-customers/"
+                                            f"{ROLE}-customers-{index}")['Policy']['DefaultVersionId']
+            for index in range(3)} == versions
+
+
+def test_concurrent_commits_are_merged_and_conflicts_raise(aws, manager, monkeypatch):
+    other = PolicyManager(manager.iam, manager.s3, ROLE, MAIN_ACCOUNT_ID, AWS_REGION, f"s3://{REGISTRY_BUCKET}/")
+    other.commit(customers(2))
+    load_registry = manager.load_registry
+    interleaved = []
+
+    def load_then_commit_elsewhere():
+        loaded = load_registry()
+        if not interleaved:
+            # Another run commits between this run's read and its conditional write
+            interleaved.append(other.commit({"customer05": grant(5)}))
+        return loaded
+
+    monkeypatch.setattr(manager, "load_registry", load_then_commit_elsewhere)
+    monkeypatch.setattr("iam_policies.time.sleep", lambda seconds: None)
+    registry = manager.commit({"customer03": grant(3)})
+
+    assert sorted(registry['customers']) == ["customer00", "customer01", "customer03", "customer05"]
+    assert registry['generation'] == 3
+
+    interleaved.clear()
+    monkeypatch.setattr(other, "commit", lambda grants: PolicyManager.commit(other, {"customer07": grant(8)}))
+    with pytest.raises(RuntimeError, match="customer07 were changed by another run"):
+        manager.commit({"customer07": grant(7)})
@@ -0,0 +1,169 @@
+import importlib.util
+import json
+import logging
+import os
+import sys
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from aws_context import get_client
+from conftest import AWS_REGION, ROOT
+from fake_gcs import FakeGCSClient
+
+# The script's file name is not a module name
+spec = importlib.util.spec_from_file_location("onboard_gcs", os.path.join(ROOT, "gcp", "onboard-gcs.py"))
+onboard_gcs = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(onboard_gcs)
+
+BUCKET = "customer3"
+DATABASE = "customer3"
+
+
+def parquet_bytes(table):
+    sink = pa.BufferOutputStream()
+    pq.write_table(table, sink)
+    return sink.getvalue().to_pybytes()
+
+
+@pytest.fixture
+def client():
+    client = FakeGCSClient()
+    client.upload(BUCKET, "orders/part-0.parquet", parquet_bytes(pa.table({"id": pa.array([1], pa.int64()),
+                                                                           "total": pa.array([2.5])})))
+    client.upload(BUCKET, "users/part-0.parquet", parquet_bytes(pa.table({"name": pa.array(["a"])})))
+    client.upload(BUCKET, "_staging/part-0.parquet", parquet_bytes(pa.table({"x": pa.array([1])})))
+    return client
+
+
+@pytest.fixture
+def glue(aws):
+    return get_client(aws, 'glue', AWS_REGION)
+
+
+@pytest.fixture
+def run(aws, client, cymballic_config, workdir, monkeypatch):
+    """Run the script's main() on a customer config, with the fake client for any credentials."""
+    keys = []
+
+    def make_client(key_file=None, project=None, key_info=None):
+        keys.append(key_info or key_file)
+        return client
+
+    monkeypatch.setattr(onboard_gcs, "make_client", make_client)
+
+    def run(*args, **config):
+        config = {"customer": "Customer3", "type": "gcp-gcs", "bucket_name": BUCKET, **config}
+        with open(workdir / "customer3-gcs.json", "w") as file:
+            json.dump(config, file)
+        monkeypatch.setattr(sys, "argv", ["onboard-gcs.py", "-c", "customer3-gcs.json", *args])
+        onboard_gcs.main()
+
+    run.keys = keys
+    return run
+
+
+def glue_tables(glue):
+    return {table['Name']: table for table in glue.get_tables(DatabaseName=DATABASE)['TableList']}
+
+
+def test_every_table_prefix_is_registered(run, glue):
+    run("-k", "key.json")
+
+    database = glue.get_database(Name=DATABASE)['Database']
+    assert database['LocationUri'] == onboard_gcs.GCS_DATABASE_LOCATION
+    tables = glue_tables(glue)
+    assert sorted(tables) == ["orders", "users"]
+    descriptor = tables["orders"]['StorageDescriptor']
+    assert descriptor['Location'] == f"gs://{BUCKET}/orders/"
+    assert [(c['Name'], c['Type']) for c in descriptor['Columns']] == [("id", "bigint"), ("total", "double")]
+    assert run.keys == ["key.json"]
+
+
+def test_rerun_only_updates_changed_tables(run, glue, client):
+    run("-k", "key.json")
+    versions = {name: table.get('VersionId') for name, table in glue_tables(glue).items()}
+    client.upload(BUCKET, "users/part-1.parquet", parquet_bytes(pa.table({"name": pa.array(["b"]),
+                                                                          "age": pa.array([3], pa.int32())})))
+
+    run("-k", "key.json")
+
+    tables = glue_tables(glue)
+    assert [c['Name'] for c in tables["users"]['StorageDescriptor']['Columns']] == ["name", "age"]
+    assert tables["orders"].get('VersionId') == versions["orders"]
+    assert tables["users"].get('VersionId') != versions["users"]
+
+
+def test_register_table_reports_what_it_did(glue):
+    onboard_gcs.ensure_gcs_database(glue, DATABASE)
+    table_input = onboard_gcs.gcs_table_input(BUCKET, "orders", [{"Name": "id", "Type": "bigint"}])
+
+    assert onboard_gcs.register_table(glue, DATABASE, table_input, None) == "created"
+    existing = onboard_gcs.existing_glue_tables(glue, DATABASE)
+    assert onboard_gcs.register_table(glue, DATABASE, table_input, existing["orders"]) == "unchanged"
+    changed = onboard_gcs.gcs_table_input(BUCKET, "orders", [{"Name": "id", "Type": "string"}])
+    assert onboard_gcs.register_table(glue, DATABASE, changed, existing["orders"]) == "updated"
+
+
+def test_existing_database_gets_the_connector_location(glue):
+    glue.create_database(DatabaseInput={"Name": DATABASE, "Parameters": {"owner": "data"}})
+
+    onboard_gcs.ensure_gcs_database(glue, DATABASE)
+
+    database = glue.get_database(Name=DATABASE)['Database']
+    assert database['LocationUri'] == onboard_gcs.GCS_DATABASE_LOCATION
+    assert database['Parameters'] == {"owner": "data"}
+
+
+def test_tables_are_resolved_from_names_globs_and_the_config(client):
+    assert onboard_gcs.resolve_gcs_tables(["orders,users", "orders"], {}, client, BUCKET) == ["orders", "users"]
+    assert onboard_gcs.resolve_gcs_tables(["u*"], {}, client, BUCKET) == ["users"]
+    assert onboard_gcs.resolve_gcs_tables([], {"table_name": "orders"}, client, BUCKET) == ["orders"]
+    assert onboard_gcs.resolve_gcs_tables([], {}, client, BUCKET) == ["orders", "users"]
+    # Names are taken as given, without listing the bucket
+    assert onboard_gcs.resolve_gcs_tables(["missing"], {}, client, BUCKET) == ["missing"]
+
+
+def test_key_is_read_from_secrets_manager(run, aws, glue):
+    key = {"type": "service_account", "project_id": "customer3-project"}
+    get_client(aws, 'secretsmanager', AWS_REGION).create_secret(Name="tmp/gcp/key", SecretString=json.dumps(key))
+
+    run("-t", "orders", secret_mgr_gcp_key_name="tmp/gcp/key")
+
+    assert run.keys == [key]
+    assert sorted(glue_tables(glue)) == ["orders"]
+
+
+def test_tables_without_parquet_files_fail_after_the_others_are_registered(run, glue):
+    with pytest.raises(SystemExit):
+        run("-k", "key.json", "-t", "orders", "missing")
+
+    assert sorted(glue_tables(glue)) == ["orders"]
+
+
+def test_corrupt_footers_fail_after_the_others_are_registered(run, glue, client, caplog):
+    client.upload(BUCKET, "broken/part-0.parquet", b"not a parquet file PAR1")
+
+    with pytest.raises(SystemExit):
+        run("-k", "key.json")
+
+    assert sorted(glue_tables(glue)) == ["orders", "users"]
+    assert "Failed to register 1 of 3 tables: broken" in caplog.text
+
+
+def test_unexpected_registration_errors_fail_only_their_table(run, glue, monkeypatch, caplog):
+    register_table = onboard_gcs.register_table
+
+    def fail_for_users(glue, database_name, table_input, existing):
+        if table_input['Name'] == "users":
+            raise ValueError("unexpected column type")
+        return register_table(glue, database_name, table_input, existing)
+
+    monkeypatch.setattr(onboard_gcs, "register_table", fail_for_users)
+    caplog.set_level(logging.INFO)
+
+    with pytest.raises(SystemExit):
+        run("-k", "key.json")
+
+    assert sorted(glue_tables(glue)) == ["orders"]
+    assert "failed: unexpected column type" in caplog.text
+    assert "Failed to register 1 of 2 tables: users" in caplog.text
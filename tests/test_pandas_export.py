@@ -0,0 +1,51 @@
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+import onboard
+
+BUCKET = "bench"
+
+
+@pytest.fixture
+def bucket(aws):
+    onboard.get_client(aws, 's3', onboard.AWS_REGION).create_bucket(Bucket=BUCKET)
+    return onboard.get_client(aws, 's3', onboard.AWS_REGION)
+
+
+def read_export(s3, workdir, key):
+    path = workdir / "export.parquet"
+    s3.download_file(BUCKET, key, str(path))
+    return pq.read_table(path)
+
+
+@pytest.mark.parametrize("export_mode", ["pandas", "streaming"])
+def test_constrained_numeric_columns_are_exported_as_decimals(postgres, rds_info, aws, bucket, workdir, export_mode):
+    postgres("CREATE TABLE money (id int, price numeric(10,2), quantity numeric(38,6), ratio numeric)", "money")
+    postgres("INSERT INTO money VALUES (1, 12.50, 3.000001, 0.5), (2, -99999999.99, NULL, NULL), (3, NULL, 0, 1e-20)")
+    options = {**rds_info, "export_mode": export_mode}
+
+    columns = onboard.export_table_to_s3_parquet(options, "money", BUCKET, aws)
+
+    assert columns == [{"Name": "id", "Type": "int"}, {"Name": "price", "Type": "decimal(10,2)"},
+                       {"Name": "quantity", "Type": "decimal(38,6)"}, {"Name": "ratio", "Type": "string"}]
+    table = read_export(bucket, workdir, "money/money.parquet")
+    assert table.schema.field("price").type == pa.decimal128(10, 2)
+    assert table.schema.field("quantity").type == pa.decimal128(38, 6)
+    rows = sorted(table.to_pylist(), key=lambda row: row["id"])
+    assert [str(row["price"]) if row["price"] is not None else None for row in rows] == ["12.50", "-99999999.99", None]
+    assert [str(row["quantity"]) if row["quantity"] is not None else None for row in rows] == ["3.000001", None, "0.000000"]
+
+
+@pytest.mark.parametrize("export_mode", ["pandas", "streaming"])
+def test_nullable_columns_keep_their_types(postgres, rds_info, aws, bucket, workdir, export_mode):
+    postgres("CREATE TABLE typed (id int, small smallint, flag boolean, day date, at timestamptz, note text)", "typed")
+    postgres("INSERT INTO typed VALUES (1, 7, true, '2024-01-31', '2024-01-31 10:00:00+02', 'a'), "
+             "(2, NULL, NULL, NULL, NULL, NULL)")
+
+    columns = onboard.export_table_to_s3_parquet({**rds_info, "export_mode": export_mode}, "typed", BUCKET, aws)
+
+    assert [column["Type"] for column in columns] == ["int", "smallint", "boolean", "date", "timestamp", "string"]
+    rows = sorted(read_export(bucket, workdir, "typed/typed.parquet").to_pylist(), key=lambda row: row["id"])
+    assert rows[0]["small"] == 7 and rows[0]["flag"] is True and str(rows[0]["day"]) == "2024-01-31"
+    assert rows[0]["at"].isoformat().startswith("2024-01-31T08:00:00")
+    assert all(value is None for key, value in rows[1].items() if key != "id")
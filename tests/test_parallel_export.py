@@ -0,0 +1,30 @@
+from concurrent.futures import ThreadPoolExecutor
+import pyarrow.parquet as pq
+import onboard
+
+
+def test_parallel_exports_run_from_a_thread_pool(postgres, rds_info, workdir):
+    # onboard_tables exports tables from threads; each parallel export starts
+    # its own pool of worker processes
+    for name in ("parallel_a", "parallel_b"):
+        postgres(f"CREATE TABLE {name} (id bigint PRIMARY KEY, name text)", name)
+        postgres(f"INSERT INTO {name} SELECT i, 'row ' || i FROM generate_series(1, 5000) AS i")
+    options = {**rds_info, "export_mode": "parallel", "workers": 2, "split_strategy": "pk"}
+
+    def export(name):
+        return onboard.export_table_parallel(options, name, str(workdir / name), 1000)
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        results = dict(zip(("parallel_a", "parallel_b"), pool.map(export, ("parallel_a", "parallel_b"))))
+
+    for name, (columns, parts) in results.items():
+        assert columns == [{"Name": "id", "Type": "bigint"}, {"Name": "name", "Type": "string"}]
+        assert sum(rows for _, rows in parts) == 5000
+        ids = sorted(i for part_name, _ in parts
+                     for i in pq.read_table(workdir / name / part_name).column("id").to_pylist())
+        assert ids == list(range(1, 5001))
+
+
+def test_export_workers_are_spawned():
+    with onboard.export_process_pool(1) as pool:
+        assert pool._mp_context.get_start_method() == "spawn"
@@ -0,0 +1,60 @@
+import json
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+import onboard
+from aws_context import get_client
+from conftest import AWS_REGION
+from table_statistics import list_location_objects
+
+BUCKET = "customer"
+
+
+def parquet_bytes(table):
+    sink = pa.BufferOutputStream()
+    pq.write_table(table, sink)
+    return sink.getvalue().to_pybytes()
+
+
+@pytest.fixture
+def s3(aws):
+    s3 = get_client(aws, 's3', AWS_REGION)
+    s3.create_bucket(Bucket=BUCKET)
+    current = parquet_bytes(pa.table({"id": pa.array([1, 2], pa.int64())}))
+    # Left behind by an interrupted checkpointed export and compaction, with another schema
+    staged = parquet_bytes(pa.table({"id": pa.array(["x"]), "extra": pa.array([1.5])}))
+    for key, body in (("orders/part-0.parquet", current), ("orders/region=eu/part-1.parquet", current),
+                      ("orders/_export_20240101000000/part-00000.parquet", staged),
+                      ("orders/_compact_20240101000000/merged.parquet", staged),
+                      ("orders/.spark-staging/part-2.parquet", staged), ("orders/_SUCCESS", b"")):
+        s3.put_object(Bucket=BUCKET, Key=key, Body=body)
+    return s3
+
+
+def test_files_in_hidden_directories_are_not_table_data(s3):
+    keys = ["orders/part-0.parquet", "orders/region=eu/part-1.parquet"]
+
+    assert [key for key, _ in onboard.list_table_objects(s3, BUCKET, "orders")] == keys
+    assert [obj['Key'] for obj in list_location_objects(s3, f"s3://{BUCKET}/orders/")] == keys
+    # A checkpointed export's location is a hidden directory itself
+    assert [obj['Key'] for obj in list_location_objects(s3, f"s3://{BUCKET}/orders/_export_20240101000000/")] == [
+        "orders/_export_20240101000000/part-00000.parquet"]
+
+
+def test_parquet_sources_ignore_interrupted_exports_and_compactions(s3, aws, workdir, monkeypatch):
+    monkeypatch.setattr(onboard, "AWS_REGION", AWS_REGION)
+
+    fingerprints = onboard.verify_parquet_exists(aws, BUCKET, "orders")
+
+    assert sorted(fingerprints) == ["orders/part-0.parquet", "orders/region=eu/part-1.parquet"]
+    columns, _ = onboard.cached_footer_columns(s3, BUCKET, fingerprints, {})
+    assert columns == [{"Name": "id", "Type": "bigint"}]
+
+
+def test_layout_of_a_checkpointed_export_is_read_from_its_directory(s3, workdir):
+    key = "orders/_export_20240101000000/part-00000.parquet"
+
+    onboard.report_parquet_layout(s3, BUCKET, "orders", [key])
+
+    with open(workdir / "out" / "orders-layout.json") as file:
+        assert [f['key'] for f in json.load(file)['files']] == [key]
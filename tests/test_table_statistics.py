@@ -0,0 +1,222 @@
+import datetime
+from decimal import Decimal
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from aws_context import get_client
+from botocore.exceptions import ClientError
+from conftest import AWS_REGION
+from fingerprint_cache import FingerprintCache
+from table_statistics import _decimal_value, column_summary, glue_column_statistics, publish_table_statistics
+
+BUCKET = "customer"
+DATABASE = "customer"
+
+
+def footer(rows, **columns):
+    """Statistics of one file as collect_file_statistics keeps them."""
+    return {"fingerprint": {"size": 100}, "rows": rows,
+            "columns": {name: {"nulls": nulls, "min": low, "max": high} for name, (nulls, low, high) in columns.items()}}
+
+
+def test_negative_decimals_keep_their_bounds():
+    files = {"a": footer(3, price=(0, "-12.50", "-0.01")), "b": footer(2, price=(1, "-100.00", "7.25"))}
+
+    summary = column_summary({"Name": "price", "Type": "decimal(10,2)"}, files)
+
+    assert summary == {"type": "decimal(10,2)", "nulls": 1, "distinct": 4, "min": "-100.00", "max": "7.25"}
+    data = glue_column_statistics("price", summary, None)['StatisticsData']['DecimalColumnStatisticsData']
+    assert data['MinimumValue'] == {"UnscaledValue": (-10000).to_bytes(2, "big", signed=True), "Scale": 2}
+
+
+@pytest.mark.parametrize("value, scale, unscaled", [
+    ("0", 2, 0), ("-0.01", 2, -1), ("-1.28", 2, -128), ("1.28", 2, 128), ("-99999999.99", 2, -9999999999),
+    ("12.5", 3, 12500), ("-5", 0, -5)
+])
+def test_decimal_values_are_twos_complement(value, scale, unscaled):
+    result = _decimal_value(value, f"decimal(12, {scale})")
+
+    assert result['Scale'] == scale
+    assert int.from_bytes(result['UnscaledValue'], "big", signed=True) == unscaled
+    # No wasted leading byte
+    assert len(result['UnscaledValue']) == max(1, (unscaled.bit_length() + 8) // 8)
+
+
+def test_all_null_files_have_counts_and_no_bounds():
+    files = {"a": footer(4, id=(4, None, None)), "b": footer(2, id=(2, None, None))}
+
+    assert column_summary({"Name": "id", "Type": "bigint"}, files) == {
+        "type": "bigint", "nulls": 6, "distinct": 0, "min": None, "max": None}
+
+
+def test_files_without_the_column_count_as_nulls():
+    files = {"old": footer(5, other=(0, 1, 1)), "new": footer(3, added=(1, "2024-01-01", "2024-01-02"))}
+
+    assert column_summary({"Name": "Added", "Type": "date"}, files) == {
+        "type": "date", "nulls": 6, "distinct": 2, "min": "2024-01-01", "max": "2024-01-02"}
+
+
+def test_incomplete_or_out_of_range_footers_give_no_summary():
+    assert column_summary({"Name": "id", "Type": "int"}, {"a": footer(3, id=(None, 1, 2))}) is None
+    assert column_summary({"Name": "id", "Type": "int"}, {"a": footer(3, id=(0, None, None))}) is None
+    assert column_summary({"Name": "id", "Type": "bigint"}, {"a": footer(3, id=(0, 0, 2 ** 64))}) is None
+    assert column_summary({"Name": "id", "Type": "int"}, {"a": footer(3, id=(0, "x", "y"))}) is None
+    assert column_summary({"Name": "name", "Type": "string"}, {"a": footer(3, name=(0, None, None))}) is None
+
+
+def test_distinct_counts_are_bounded_by_the_range():
+    files = {"a": footer(1000, id=(0, 1, 10))}
+
+    assert column_summary({"Name": "id", "Type": "int"}, files)['distinct'] == 10
+    assert column_summary({"Name": "id", "Type": "double"}, files)['distinct'] == 1000
+
+
+class FakeGlue:
+    """The Glue calls of publish_table_statistics; moto does not implement column statistics."""
+
+    def __init__(self, table_input):
+        self.table = {**table_input, "Parameters": {}}
+        self.statistics = {}
+        self.reject = set()
+        self.fail = None
+        self.calls = []
+
+    def get_table(self, DatabaseName, Name):
+        self.calls.append("get_table")
+        return {"Table": self.table}
+
+    def update_table(self, DatabaseName, TableInput, SkipArchive):
+        self.calls.append("update_table")
+        if self.fail == "update_table":
+            raise ClientError({"Error": {"Code": "InternalServiceException"}}, "UpdateTable")
+        self.table = TableInput
+
+    def update_column_statistics_for_table(self, DatabaseName, TableName, ColumnStatisticsList):
+        self.calls.append("update_column_statistics_for_table")
+        if self.fail == "update_column_statistics_for_table":
+            raise ClientError({"Error": {"Code": "ThrottlingException"}}, "UpdateColumnStatisticsForTable")
+        errors = []
+        for statistics in ColumnStatisticsList:
+            if statistics['ColumnName'] in self.reject:
+                errors.append({"ColumnStatistics": statistics, "Error": {"ErrorMessage": "Invalid statistics"}})
+            else:
+                self.statistics[statistics['ColumnName']] = statistics
+        return {"Errors": errors}
+
+    def delete_column_statistics_for_table(self, DatabaseName, TableName, ColumnName):
+        self.calls.append("delete_column_statistics_for_table")
+        self.statistics.pop(ColumnName, None)
+
+
+@pytest.fixture
+def s3(aws):
+    s3 = get_client(aws, 's3', AWS_REGION)
+    s3.create_bucket(Bucket=BUCKET)
+    return s3
+
+
+def upload(s3, key, table):
+    sink = pa.BufferOutputStream()
+    pq.write_table(table, sink)
+    s3.put_object(Bucket=BUCKET, Key=key, Body=sink.getvalue().to_pybytes())
+
+
+@pytest.fixture
+def table(s3):
+    upload(s3, "orders/part-0.parquet", pa.table({
+        "id": pa.array([1, 2, 3], pa.int64()),
+        "price": pa.array([Decimal("-1.50"), None, Decimal("2.00")], pa.decimal128(10, 2)),
+        "day": pa.array([datetime.date(2024, 1, 1)] * 3)
+    }))
+    return {"Name": "orders", "StorageDescriptor": {
+        "Location": f"s3://{BUCKET}/orders/",
+        "Columns": [{"Name": "id", "Type": "bigint"}, {"Name": "price", "Type": "decimal(10,2)"},
+                    {"Name": "day", "Type": "date"}]}}
+
+
+@pytest.fixture
+def cache(workdir):
+    return FingerprintCache(name="statistics")
+
+
+def test_statistics_are_published_once(s3, table, cache):
+    glue = FakeGlue(table)
+
+    parameters = publish_table_statistics(glue, s3, DATABASE, table, cache)
+    publish_table_statistics(glue, s3, DATABASE, table, cache)
+
+    assert parameters['numRows'] == "3"
+    assert glue.table['Parameters']['numRows'] == "3"
+    assert sorted(glue.statistics) == ["day", "id", "price"]
+    assert glue.calls == ["get_table", "update_table", "update_column_statistics_for_table"]
+
+
+def test_rejected_columns_are_only_sent_again_when_they_change(s3, table, cache):
+    glue = FakeGlue(table)
+    glue.reject = {"price"}
+    publish_table_statistics(glue, s3, DATABASE, table, cache)
+    published = cache.load(BUCKET, "orders")['published']
+    assert sorted(published['columns']) == ["day", "id"] and sorted(published['rejected']) == ["price"]
+
+    # Nothing changed, so Glue is not called even though price was rejected
+    glue.calls.clear()
+    publish_table_statistics(glue, s3, DATABASE, table, cache)
+    assert glue.calls == []
+    assert cache.load(BUCKET, "orders")['published'] == published
+
+    # New bounds for price are sent; the other columns are sent with it
+    glue.reject = set()
+    upload(s3, "orders/part-1.parquet", pa.table({
+        "id": pa.array([4], pa.int64()), "price": pa.array([Decimal("9.99")], pa.decimal128(10, 2)),
+        "day": pa.array([datetime.date(2024, 1, 1)])}))
+    publish_table_statistics(glue, s3, DATABASE, table, cache)
+    assert sorted(glue.statistics) == ["day", "id", "price"]
+    published = cache.load(BUCKET, "orders")['published']
+    assert sorted(published['columns']) == ["day", "id", "price"] and published['rejected'] == {}
+
+
+def test_unchanged_rejected_columns_are_not_sent_with_other_changes(s3, table, cache):
+    glue = FakeGlue(table)
+    glue.reject = {"price"}
+    publish_table_statistics(glue, s3, DATABASE, table, cache)
+    sent = []
+    update = glue.update_column_statistics_for_table
+    glue.update_column_statistics_for_table = lambda **kwargs: (
+        sent.extend(s['ColumnName'] for s in kwargs['ColumnStatisticsList']), update(**kwargs))[1]
+
+    # A column added to the table; price is unchanged
+    table = {**table, "StorageDescriptor": {**table['StorageDescriptor'], "Columns": [
+        *table['StorageDescriptor']['Columns'], {"Name": "added", "Type": "bigint"}]}}
+    publish_table_statistics(glue, s3, DATABASE, table, cache)
+    assert "price" not in sent and "added" in sent
+
+    # --refresh sends everything again
+    sent.clear()
+    publish_table_statistics(glue, s3, DATABASE, table, cache, refresh=True)
+    assert sorted(sent) == ["added", "day", "id", "price"]
+
+
+@pytest.mark.parametrize("failing", ["update_table", "update_column_statistics_for_table"])
+def test_cache_is_kept_when_glue_fails(s3, table, cache, failing):
+    glue = FakeGlue(table)
+    glue.fail = failing
+
+    with pytest.raises(ClientError):
+        publish_table_statistics(glue, s3, DATABASE, table, cache)
+
+    assert cache.load(BUCKET, "orders") == {}
+    glue.fail = None
+    publish_table_statistics(glue, s3, DATABASE, table, cache)
+    assert sorted(glue.statistics) == ["day", "id", "price"]
+
+
+def test_columns_without_statistics_any_more_are_deleted(s3, table, cache):
+    glue = FakeGlue(table)
+    publish_table_statistics(glue, s3, DATABASE, table, cache)
+    # price stops being a decimal, which has no statistics from footers
+    table = {**table, "StorageDescriptor": {**table['StorageDescriptor'], "Columns": [
+        {"Name": "id", "Type": "bigint"}, {"Name": "price", "Type": "string"}, {"Name": "day", "Type": "date"}]}}
+
+    publish_table_statistics(glue, s3, DATABASE, table, cache)
+
+    assert sorted(glue.statistics) == ["day", "id"]
@@ -0,0 +1,56 @@
+import boto3
+import pytest
+from botocore.stub import Stubber
+import update
+from aws_context import get_client
+from conftest import AWS_REGION
+
+SOURCE_ACCOUNT_ID = "210987654321"
+CATALOG = "external-cat-acme"
+
+
+@pytest.fixture
+def source_account(monkeypatch):
+    monkeypatch.setattr(update, "get_account_id", lambda profile: SOURCE_ACCOUNT_ID)
+
+
+@pytest.fixture
+def stubbed_athena(monkeypatch, cymballic_config, source_account):
+    """Athena client whose responses the test sets."""
+    athena = boto3.client('athena', region_name=AWS_REGION, aws_access_key_id="testing",
+                          aws_secret_access_key="testing")
+    monkeypatch.setattr(update, "get_client", lambda session, service, region=None: athena)
+    monkeypatch.setattr(update, "get_session", lambda profile: None)
+    with Stubber(athena) as stubber:
+        yield stubber
+        stubber.assert_no_pending_responses()
+
+
+def test_catalog_is_registered_once(aws, cymballic_config, source_account):
+    athena = get_client(aws, 'athena', AWS_REGION)
+
+    update.register_glue_catalog("acme", "Acme")
+    update.register_glue_catalog("acme", "Acme")
+
+    catalog = athena.get_data_catalog(Name=CATALOG)['DataCatalog']
+    assert catalog['Type'] == "GLUE" and catalog['Parameters'] == {"catalog-id": SOURCE_ACCOUNT_ID}
+
+
+def test_missing_catalog_is_created(stubbed_athena):
+    stubbed_athena.add_client_error('get_data_catalog', 'InvalidRequestException',
+                                    f"Catalog {CATALOG} not found", expected_params={"Name": CATALOG})
+    stubbed_athena.add_response('create_data_catalog', {}, {
+        "Name": CATALOG, "Type": "GLUE", "Description": "Cross-account Glue catalog for acme",
+        "Parameters": {"catalog-id": SOURCE_ACCOUNT_ID}})
+
+    update.register_glue_catalog("acme", "Acme")
+
+
+def test_other_invalid_requests_are_reported(stubbed_athena, caplog):
+    stubbed_athena.add_client_error('get_data_catalog', 'InvalidRequestException',
+                                    "You are not authorized to perform this operation on the catalog")
+
+    with pytest.raises(SystemExit):
+        update.register_glue_catalog("acme", "Acme")
+
+    assert "not authorized" in caplog.text
@@ -1,11 +1,11 @@
-import boto3
 import json
 import logging
-import configparser
-import time
 import argparse
-import configparser
-import os
+from botocore.exceptions import ClientError
+from aws_context import get_account_id, get_client, get_session, load_cymballic_config
+from iam_policies import DEFAULT_MAX_MANAGED_POLICIES, PolicyManager
+from reconcile import data_catalog_changes
+from run_metrics import metrics, run_log_dir
 
 # Configure logging
 logging.basicConfig(
@@ -18,162 +18,124 @@ def fail_fast(msg):
     logger.error(msg)
     exit(1)
 
-# TODO: Consider extracting common AWS profile and config handling into a shared module
 # TODO: Consider moving catalog naming convention to config file
 
-def load_existing_policy(iam, role_name):
-    try:
-        response = iam.get_role_policy(RoleName=role_name, PolicyName=f"{role_name}-policy")
-        return response['PolicyDocument']
-    except iam.exceptions.NoSuchEntityException:
-        return {
-            "Version": "2012-10-17",
-            "Statement": []
-        }
-
-def load_cymballic_config():
-    with open('cymballic.json', 'r') as file:
-        config = json.load(file)
-        return config
-
+def get_source_account_id(source_profile):
+    source_account_id = get_account_id(source_profile)
+    if not source_account_id:
+        fail_fast(f"Could not find sso_account_id for profile {source_profile} in ~/.aws/config")
+    return source_account_id
 
-def update_policy(source_profile, customer):
+def policy_manager():
+    """PolicyManager of the role in the main account of cymballic.json."""
     # Load cymballic config to get target account profile
     cymballic_config = load_cymballic_config()
     aws_region = cymballic_config['aws_region']
     target_profile = cymballic_config['aws_account_profile']
-
-    session = boto3.Session(profile_name=target_profile)
-    iam = session.client('iam')
-    role_name = cymballic_config['iam_service_role']
-
-    # Get source account ID from AWS config
-    config = configparser.ConfigParser()
-    config.read(os.path.expanduser('~/.aws/config'))
-    profile_section = f"profile {source_profile}"
-    
-    if profile_section not in config:
-        fail_fast(f"Profile {source_profile} not found in ~/.aws/config")
-    
-    source_account_id = config[profile_section].get('sso_account_id')
-    database_name = customer.lower()
-    bucket_name = customer.lower()
-    
-    if not source_account_id:
-        fail_fast(f"Could not find sso_account_id for profile {source_profile}")
-    
-    timestamp = time.strftime("%Y%m%d_%H%M")
-    log_dir = f"log/run_{timestamp}"
-    os.mkdir(log_dir)
-    logger.info(f"Using source account ID: {source_account_id}")
-
-    # Load existing policy
-    policy = load_existing_policy(iam, role_name)
-    
-    # Create new statements for this database/bucket
-    new_statements = [
-        {
-            "Effect": "Allow",
-            "Action": [
-                "glue:*",
-                "sts:AssumeRole"
-            ],
-            "Resource": [
-                f"arn:aws:glue:{aws_region}:{source_account_id}:catalog",
-                f"arn:aws:glue:{aws_region}:{source_account_id}:database/{database_name}",
-                f"arn:aws:glue:{aws_region}:{source_account_id}:table/{database_name}/*",
-            ]
-        },
-        {
-            "Effect": "Allow",
-            "Action": [
-                "s3:GetObject",
-                "s3:GetBucketLocation",
-                "s3:ListBucket",
-                "s3:PutObject"
-            ],
-            "Resource": [
-                f"arn:aws:s3:::{bucket_name}",
-                f"arn:aws:s3:::{bucket_name}/*"
-            ]
-        }
-    ]
-
-    # Remove any existing statements for this database/bucket
-    if 'Statement' in policy:
-        policy['Statement'] = [
-            stmt for stmt in policy['Statement']
-            if not (
-                any(res.endswith(f":database/{database_name}") for res in stmt.get('Resource', []))
-                or any(bucket_name in res for res in stmt.get('Resource', []))
-            )
-        ]
-    else:
-        policy['Statement'] = []
-
-    # Add new statements
-    policy['Statement'].extend(new_statements)
-
-    # Save policy for reference
-    policy_path = f"{log_dir}/{role_name}-policy.json"
+    if not cymballic_config.get('s3_bucket'):
+        fail_fast("s3_bucket is needed in cymballic.json to keep the IAM grant registry")
+
+    session = get_session(target_profile)
+    iam = get_client(session, 'iam')
+    return PolicyManager(iam, get_client(session, 's3', aws_region), cymballic_config['iam_service_role'],
+                         cymballic_config['aws_account_id'], aws_region, cymballic_config['s3_bucket'],
+                         int(cymballic_config.get('iam_max_managed_policies', DEFAULT_MAX_MANAGED_POLICIES)))
+
+def apply_registry(manager, registry, revoked=None):
+    # Save policies for reference
+    policy_path = f"{run_log_dir()}/{manager.role_name}-policies.json"
     with open(policy_path, "w") as f:
-        json.dump(policy, f, indent=4)
-    logger.info(f"Policy saved to {policy_path}")
+        json.dump({"registry": registry, "policies": manager.render(registry)}, f, indent=4)
+    logger.info(f"Policies saved to {policy_path}")
 
-    # Update role policy
     try:
-        iam.put_role_policy(
-            RoleName=role_name,
-            PolicyName=f"{role_name}-policy",
-            PolicyDocument=json.dumps(policy)
-        )
-        logger.info(f"Successfully updated policy for role {role_name}")
+        manager.apply(registry, revoked)
+        logger.info(f"Policies of role {manager.role_name} grant {len(registry['customers'])} customers")
     except Exception as e:
-        fail_fast(f"Failed to update role policy. Policy saved at {policy_path}\nError: {str(e)}")
+        fail_fast(f"Failed to update role policies. Policies saved at {policy_path}\nError: {str(e)}")
+
+def update_policy(customers):
+    """
+    Grant the main-account role access to the Glue catalogs and buckets of a
+    batch of customers, given as (source_profile, customer) pairs, in one
+    commit of the grant registry (see iam_policies.py).
+    """
+    manager = policy_manager()
+    grants = {}
+    for source_profile, customer in customers:
+        # Get source account ID from AWS config
+        source_account_id = get_source_account_id(source_profile)
+        logger.info(f"Using source account ID {source_account_id} for {customer}")
+        grants[customer.lower()] = {"source_account_id": source_account_id, "database": customer.lower(),
+                                    "bucket": customer.lower()}
+
+    try:
+        registry = manager.commit(grants)
+    except Exception as e:
+        fail_fast(f"Failed to commit the grants of {', '.join(grants)}: {str(e)}")
+    apply_registry(manager, registry)
+
+def revoke_policy(customers):
+    """
+    Remove the main-account role's access to the Glue catalogs and buckets
+    of a batch of customers, given by name, in one commit of the grant
+    registry. Shards left empty are detached and deleted.
+    """
+    manager = policy_manager()
+    names = [customer.lower() for customer in customers]
+    try:
+        registry, revoked = manager.revoke(names)
+    except Exception as e:
+        fail_fast(f"Failed to revoke the grants of {', '.join(names)}: {str(e)}")
+    missing = [name for name in names if name not in revoked]
+    if missing:
+        logger.warning(f"No grants to revoke for {', '.join(missing)}")
+    apply_registry(manager, registry, revoked)
+
+def is_catalog_not_found(error):
+    # Athena has no error code of its own for this; other invalid requests
+    # (e.g. a malformed name) must not be mistaken for a missing catalog
+    message = error.response['Error'].get('Message', "").lower()
+    return (error.response['Error']['Code'] == 'InvalidRequestException'
+            and ("not found" in message or "does not exist" in message))
 
 def register_glue_catalog(source_profile, customer):
     cymballic_config = load_cymballic_config()
     target_profile = cymballic_config['aws_account_profile']
-    session = boto3.Session(profile_name=target_profile)
-    athena = session.client('athena')
+    session = get_session(target_profile)
+    athena = get_client(session, 'athena', cymballic_config.get('aws_region'))
     catalog_name = f"external-cat-{customer.lower()}"
     
     # Get source account ID from AWS config
-    config = configparser.ConfigParser()
-    config.read(os.path.expanduser('~/.aws/config'))
-    profile_section = f"profile {source_profile}"
-    
-    if profile_section not in config:
-        fail_fast(f"Profile {source_profile} not found in ~/.aws/config")
-    
-    source_account_id = config[profile_section].get('sso_account_id')
-    if not source_account_id:
-        fail_fast(f"Could not find sso_account_id for profile {source_profile}")
-
-    def create_catalog():
-        athena.create_data_catalog(
-            Name=catalog_name,
-            Type='GLUE',
-            Description=f'Cross-account Glue catalog for {customer.lower()}',
-            Parameters={
-                'catalog-id': source_account_id,
-            }
-        )
-        logger.info(f"Successfully registered Glue catalog {catalog_name} for account {source_account_id}")
+    source_account_id = get_source_account_id(source_profile)
+
+    desired = {
+        'Type': 'GLUE',
+        'Description': f'Cross-account Glue catalog for {customer.lower()}',
+        'Parameters': {
+            'catalog-id': source_account_id,
+        }
+    }
 
+    # The catalog is changed in place, never deleted, so queries against it
+    # keep working while it is being updated
     try:
-        create_catalog()
-    except athena.exceptions.ClientError as e:
-        if 'AlreadyExists' in str(e) or 'has already been created' in str(e):
-            logger.info(f"Glue catalog {catalog_name} already exists, attempting to delete and recreate...")
-            try:
-                athena.delete_data_catalog(Name=catalog_name)
-                logger.info(f"Successfully deleted existing catalog {catalog_name}")
-                create_catalog()
-            except Exception as delete_error:
-                fail_fast(f"Failed to delete existing catalog {catalog_name}: {str(delete_error)}")
+        try:
+            catalog = athena.get_data_catalog(Name=catalog_name).get('DataCatalog')
+        except ClientError as e:
+            if not is_catalog_not_found(e):
+                raise
+            catalog = None
+        if catalog is None:
+            athena.create_data_catalog(Name=catalog_name, **desired)
+            logger.info(f"Successfully registered Glue catalog {catalog_name} for account {source_account_id}")
         else:
-            fail_fast(f"Failed to register Glue catalog: {str(e)}")
+            changes = data_catalog_changes(catalog, desired)
+            if changes:
+                athena.update_data_catalog(Name=catalog_name, **desired)
+                logger.info(f"Updated {', '.join(changes)} of Glue catalog {catalog_name} for account {source_account_id}")
+            else:
+                logger.info(f"Glue catalog {catalog_name} is up to date")
     except Exception as e:
         fail_fast(f"Failed to register Glue catalog: {str(e)}")
 
@@ -183,18 +145,43 @@ def register_glue_catalog(source_profile, customer):
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Update role policy")
-    parser.add_argument("-c", "--config", required=True, help="Path to JSON configuration file")
+    inputs = parser.add_mutually_exclusive_group(required=True)
+    inputs.add_argument("-c", "--config", nargs="+",
+                        help="Paths to JSON configuration files; their grants are committed as one batch")
+    inputs.add_argument("--revoke", nargs="+", metavar="CUSTOMER",
+                        help="Revoke the grants of these customers as one batch instead")
     args = parser.parse_args()
-    
-    with open(args.config, 'r') as file:
-        config = json.load(file)
+
+    if args.revoke:
+        try:
+            with metrics.stage("iam"):
+                revoke_policy(args.revoke)
+        finally:
+            metrics.write_report("update")
+        exit(0)
+
+    configs = []
+    for config_path in args.config:
+        with open(config_path, 'r') as file:
+            configs.append(json.load(file))
 
     cymballic_config = load_cymballic_config()
     global AWS_REGION
     AWS_REGION = cymballic_config.get('aws_region')
     
-    source_profile = config.get('aws_profile')
-    customer = config.get('customer')
-    update_policy(source_profile, customer)
-    register_glue_catalog(source_profile, customer)
-
+    customers = [(config.get('aws_profile'), config.get('customer')) for config in configs]
+    try:
+        with metrics.stage("iam"):
+            update_policy(customers)
+        failed = []
+        for source_profile, customer in customers:
+            try:
+                with metrics.stage("athena"):
+                    register_glue_catalog(source_profile, customer)
+            except SystemExit:
+                # fail_fast has logged it; register the other catalogs
+                failed.append(customer)
+        if failed:
+            fail_fast(f"Failed to register the Glue catalogs of {', '.join(failed)}")
+    finally:
+        metrics.write_report("update")